@@ -0,0 +1,175 @@
+# allowance.py
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from policy import ANY, CategoryCap, policy_engine
+from utils import parse_transaction_date
+
+# Ledger statuses that count against a recipient's limits, as in calculate_spent_today
+COUNTED = ("complete", "queued")
+
+
+class AllowanceTracker:
+    """
+    Per-recipient spending counters for answering "how much can this
+    recipient still spend" without a ledger scan or an LNbits call.
+
+    The counters follow every ledger change. They hold today's and this
+    month's spending per vendor category ("*" is the total), counted like
+    calculate_spent_today, and the sats held by queued payments. They also
+    hold the last known wallet balance. That balance is taken from every
+    LNbits read of the recipient's wallet and moved by completed deposits
+    and payments in between, so it is an estimate and comes with its as-of
+    time. Counters reset when the day or month changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._month = None
+        self._daily: Dict[str, Dict[str, int]] = {}
+        self._monthly: Dict[str, Dict[str, int]] = {}
+        self._queued: Dict[str, int] = {}
+        self._balances: Dict[str, tuple] = {}   # recipient id -> (sats, as of)
+        self._wallets: Dict[str, str] = {}      # adminkey -> recipient id
+
+    def _roll(self, now: datetime):
+        """Drops counters of a past day or month; called with the lock held"""
+        day, month = now.date(), (now.year, now.month)
+        if day != self._day:
+            self._daily = {}
+            self._day = day
+        if month != self._month:
+            self._monthly = {}
+            self._month = month
+
+    # Updates
+
+    def track_wallet(self, recipient_id: str, adminkey: str, balance: Optional[int] = None):
+        """Links a recipient's wallet key to it, optionally with a known balance"""
+        with self._lock:
+            self._wallets[adminkey] = recipient_id
+            if balance is not None:
+                self._balances[recipient_id] = (balance, datetime.now())
+
+    def observe_balance(self, wallet_key: str, sats: int):
+        """Balance read hook for lightning.get_wallet_balance"""
+        recipient_id = self._wallets.get(wallet_key)
+        if recipient_id is not None:
+            with self._lock:
+                self._balances[recipient_id] = (sats, datetime.now())
+
+    def apply(self, transaction: dict, category: Optional[str], previous_status: Optional[str] = None):
+        """
+        Moves the counters for a new ledger entry, or for a status change of
+        an existing one when previous_status is given.
+        """
+        recipient_id = transaction["recipient_id"]
+        status = transaction["status"]
+        amount = transaction["amount"]
+        if transaction["type"] == "deposit":
+            if status == "complete" and previous_status != "complete":
+                self._move_balance(recipient_id, amount)
+            return
+        if transaction["type"] != "payment":
+            return
+
+        spent = (amount if status in COUNTED else 0) - (amount if previous_status in COUNTED else 0)
+        queued = (amount if status == "queued" else 0) - (amount if previous_status == "queued" else 0)
+        now = datetime.now()
+        date = parse_transaction_date(transaction.get("date")) or now
+        with self._lock:
+            self._roll(now)
+            if spent and (date.year, date.month) == self._month:
+                periods = [self._monthly] + ([self._daily] if date.date() == self._day else [])
+                for counters in periods:
+                    entry = counters.setdefault(recipient_id, {})
+                    for key in (ANY, category):
+                        entry[key] = entry.get(key, 0) + spent
+            if queued:
+                self._queued[recipient_id] = self._queued.get(recipient_id, 0) + queued
+        if status == "complete" and previous_status != "complete":
+            self._move_balance(recipient_id, -amount)
+
+    def _move_balance(self, recipient_id: str, delta: int):
+        with self._lock:
+            known = self._balances.get(recipient_id)
+            if known is not None:
+                self._balances[recipient_id] = (known[0] + delta, known[1])
+
+    # Queries
+
+    def spent(self, recipient_id: str, period: str, category: str = ANY) -> int:
+        with self._lock:
+            self._roll(datetime.now())
+            counters = self._daily if period == "daily" else self._monthly
+            return counters.get(recipient_id, {}).get(category, 0)
+
+    def remaining(self, recipient_id: str, recipient: dict, vendor_id: Optional[str] = None,
+                  category: Optional[str] = None, amount: int = 0, policy=None) -> dict:
+        """
+        What the recipient can still spend, and at a vendor if one is given,
+        under its program's policy (POLICY_FILE by default).
+
+        Returns:
+            - a dict with the daily limit, spent today, remaining today, the
+                cached balance, sats held by queued payments and spendable now;
+                with a vendor also whether it is allowed and its category's
+                remaining cap, and with an amount whether that payment fits
+        """
+        now = datetime.now()
+        with self._lock:
+            self._roll(now)
+            daily = dict(self._daily.get(recipient_id, {}))
+            monthly = dict(self._monthly.get(recipient_id, {}))
+            queued = self._queued.get(recipient_id, 0)
+            balance, as_of = self._balances.get(recipient_id, (None, None))
+
+        daily_limit = recipient.get("daily_limit", 10000)
+        spent_today = daily.get(ANY, 0)
+        remaining_today = max(0, daily_limit - spent_today)
+        # Queued payments count as spent already but haven't left the wallet yet
+        available = None if balance is None else max(0, balance - queued)
+        spendable = remaining_today if available is None else min(remaining_today, available)
+        result = {
+            "recipient_id": recipient_id,
+            "daily_limit": daily_limit,
+            "spent_today": spent_today,
+            "remaining_today": remaining_today,
+            "balance": balance,
+            "balance_as_of": as_of.isoformat() if as_of else None,
+            "queued": queued,
+            "spendable": spendable,
+        }
+        if vendor_id is None:
+            return result
+
+        def spent(period, cap_category):
+            return (daily if period == "daily" else monthly).get(cap_category, 0)
+
+        policy = (policy or policy_engine).current()
+        allowed, message = policy.evaluate(recipient_id, vendor_id, category, amount, spent, now)
+        # A payment too large for a cap doesn't close the vendor for smaller ones
+        closed = not allowed and (amount == 0 or
+                                  not policy.evaluate(recipient_id, vendor_id, category, 0, spent, now)[0])
+        caps = [check.limit - spent(check.period, check.category)
+                for check in policy.applicable(recipient_id, category) if isinstance(check, CategoryCap)]
+        cap_remaining = max(0, min(caps)) if caps else None
+        result["vendor"] = {
+            "vendor_id": vendor_id,
+            "category": category,
+            "allowed": allowed,
+            "message": message,
+            "cap_remaining": cap_remaining,
+        }
+        if cap_remaining is not None:
+            result["spendable"] = min(spendable, cap_remaining)
+        if closed:
+            result["spendable"] = 0
+        if amount:
+            result["vendor"]["amount_ok"] = allowed and amount <= result["spendable"]
+        return result
+
+
+allowances = AllowanceTracker()
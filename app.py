@@ -1,18 +1,60 @@
 # app.py initialization section - replace this at the top of app.py
 from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from jinja2 import FileSystemBytecodeCache
 import requests
 import json
 import os
+import re
+import threading
 from datetime import datetime
 
 # Import our modules
-from validation import validate_transaction
-from lightning import create_invoice, pay_invoice, get_wallet_balance
+from validation import validate_transaction, validate_batch
+from lightning import create_invoice, pay_invoice, get_wallet_balance, get_wallet_transactions, balance_observers
 from utils import calculate_spent_today, generate_id
+from ratelimit import Overloaded, retry_after_header, limiter
+from circuit import breaker_status, payments_available, CircuitOpen, LNbitsUnavailable
+from payment_jobs import PaymentJob, PaymentPipeline, PaymentUnknown
+from fragment_cache import fragment_cache
+from assets import Assets
+from compression import Compress, gzip_stream
+from events import broker
+from export import ExportFilter, stream_csv, stream_ndjson
+from capture import TrafficCapture
+from nodes import registry
+from search import page_size, SEARCH_PAGE_SIZE
+from disbursement import disbursements, InsufficientFunds, DISBURSE_SCHEDULER
+from settlement import settlements, validate_address, SETTLE_SCHEDULER
+from audit import audit_log
+from walletpool import wallet_pool
+from allowance import allowances
+from velocity import velocity
+from memory import memory_diagnostics
+from programs import programs, program_of, ProgramError
+import bolt11
+from vouchers import voucher_book, VoucherError, VOUCHER_TTL, VOUCHER_BATCH_MAX
+from tracing import tracer
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "your_secret_key")  # Use environment variable
 
+# Keep compiled templates on disk so a cold start skips Jinja compilation
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".jinja_cache"))
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(JINJA_CACHE_DIR)}
+
+# Fingerprinted static assets built by build_assets.py
+assets = Assets(app)
+
+# gzip for HTML and JSON responses, including streamed ones
+Compress(app)
+
+# Opt-in request recording for replay.py (CAPTURE_REQUESTS=1)
+traffic_capture = TrafficCapture(app)
+
+# Trace ids and spans per request; slow and failed traces go to TRACE_FILE
+tracer.init_app(app)
+
 # LNBits API Configuration
 LNBITS_URL = os.getenv("LNBITS_URL", "http://localhost:5001")
 ADMIN_KEY = os.getenv("ADMIN_KEY", "9bca41d2b0f540f08393cde5dd13b178")  # Your admin key
@@ -21,38 +63,745 @@ ADMIN_KEY = os.getenv("ADMIN_KEY", "9bca41d2b0f540f08393cde5dd13b178")  # Your a
 if not ADMIN_KEY:
     print("WARNING: ADMIN_KEY environment variable is not set. Using default key.")
 
-# Test the connection and print detailed info
-try:
-    print(f"Testing connection to LNbits with admin key: {ADMIN_KEY[:5]}...")
+# Test the connection to every LNbits node and print detailed info
+for node in registry.nodes.values():
+    try:
+        print(f"Testing connection to LNbits node {node.name} with admin key: {node.admin_key[:5]}...")
+        
+        # Make a direct API call to check the node's admin wallet
+        response = requests.get(
+            f"{node.url}/api/v1/wallet",
+            headers={"X-Api-Key": node.admin_key, "Content-type": "application/json"},
+            timeout=5
+        )
+        
+        if response.status_code == 200:
+            wallet_data = response.json()
+            balance_msat = wallet_data.get("balance", 0)
+            balance_sat = balance_msat // 1000
+            
+            print(f"Successfully connected to LNbits wallet on {node.name}")
+            print(f"Wallet name: {wallet_data.get('name', 'Unknown')}")
+            print(f"Balance: {balance_sat} sats ({balance_msat} msats)")
+        else:
+            print(f"Failed to connect to LNbits wallet on {node.name}: Status code {response.status_code}")
+            print(f"Response: {response.text}")
+    except Exception as e:
+        print(f"Failed to connect to LNbits wallet on {node.name}: {str(e)}")
+
+# Persistent storage for recipients and vendors, each tagged with its program
+recipients = {}
+vendors = {}
+# Every program served here has its own ledger shard, partitioned by day; days
+# past LEDGER_HOT_DAYS are archived to disk
+
+# Largest batch accepted by /api/validate_payments
+VALIDATE_BATCH_MAX = int(os.getenv("VALIDATE_BATCH_MAX", "500"))
+
+# "sync" pays inside the request, "queued" hands payments to the worker pool
+PAYMENT_MODE = os.getenv("PAYMENT_MODE", "sync")
+# Payments whose outcome is unknown (LNbits timed out) are looked up this often
+payment_pipeline = PaymentPipeline(workers=int(os.getenv("PAYMENT_WORKERS", "4")),
+                                   reconcile_interval=float(os.getenv("PAYMENT_RECONCILE_INTERVAL", "30")))
+# Held while POST /api/record_transaction checks for and records a payment hash
+record_lock = threading.Lock()
+
+# Recipient balances read from LNbits anywhere refresh the allowance counters
+balance_observers.append(allowances.observe_balance)
+
+# What /api/admin/memory sizes; these are the structures that grow with use
+memory_diagnostics.track("recipients", lambda: recipients)
+memory_diagnostics.track("vendors", lambda: vendors)
+for served in programs.local():
+    memory_diagnostics.track(f"ledger.{served.id}", served.ledger.hot)
+    memory_diagnostics.track(f"recipient_index.{served.id}", lambda served=served: served.recipient_index)
+    memory_diagnostics.track(f"vendor_index.{served.id}", lambda served=served: served.vendor_index)
+memory_diagnostics.track("fragment_cache", lambda: fragment_cache)
+memory_diagnostics.track("allowances", lambda: allowances)
+memory_diagnostics.track("velocity", lambda: velocity)
+memory_diagnostics.track("vouchers", lambda: voucher_book)
+memory_diagnostics.track("events", lambda: broker)
+memory_diagnostics.track("payment_jobs", lambda: payment_pipeline)
+
+def ledger_recipient_balance(recipient_id):
+    """Estimate a recipient's balance from the ledger when LNbits is unavailable"""
+    transactions = programs.of(recipients.get(recipient_id)).ledger
+    deposits = sum(t["amount"] for t in transactions 
+                if t["recipient_id"] == recipient_id 
+                and t["type"] == "deposit" 
+                and t["status"] == "complete")
+    
+    payments = sum(t["amount"] for t in transactions 
+                 if t["recipient_id"] == recipient_id 
+                 and t["type"] == "payment" 
+                 and t["status"] == "complete")
+    
+    return deposits - payments
+
+def ledger_vendor_balance(vendor_id):
+    """Estimate a vendor's balance from the payments it received and its payouts"""
+    transactions = programs.of(vendors.get(vendor_id)).ledger
+    received = sum(t["amount"] for t in transactions 
+                   if t["vendor_id"] == vendor_id 
+                   and t["type"] == "payment" 
+                   and t["status"] == "complete")
+    
+    # Pending payouts may have left the wallet already
+    paid_out = sum(t["amount"] for t in transactions 
+                   if t["vendor_id"] == vendor_id 
+                   and t["type"] == "settlement" 
+                   and t["status"] in ("complete", "pending"))
+    
+    return received - paid_out
+
+def transaction_event(transaction):
+    """Serialize a ledger entry for the live event feed"""
+    data = dict(transaction)
+    for field in ("date", "expires_at"):
+        if isinstance(data.get(field), datetime):
+            data[field] = data[field].isoformat()
+    recipient = recipients.get(transaction["recipient_id"])
+    vendor = vendors.get(transaction["vendor_id"])
+    if transaction["type"] == "settlement":
+        data["recipient_name"] = "Payout"
+    else:
+        data["recipient_name"] = recipient["name"] if recipient else "Unknown"
+    if transaction["vendor_id"] == "admin":
+        data["vendor_name"] = "System Admin"
+    else:
+        data["vendor_name"] = vendor["name"] if vendor else "Unknown"
+    return data
+
+def publish_balance_change(transaction):
+    """Tell live dashboards how a completed transaction moved wallet balances"""
+    amount = transaction["amount"]
+    if transaction["type"] == "deposit":
+        recipient_delta, vendor_delta = amount, 0
+    elif transaction["type"] == "settlement":
+        recipient_delta, vendor_delta = 0, -amount
+    else:
+        recipient_delta, vendor_delta = -amount, amount
+        settlements.observe(transaction["vendor_id"], amount)
+    broker.publish("balance", {
+        "program": transaction_program(transaction).id,
+        "recipient_id": transaction["recipient_id"],
+        "vendor_id": transaction["vendor_id"],
+        "recipient_delta": recipient_delta,
+        "vendor_delta": vendor_delta
+    })
+
+def transaction_category(transaction):
+    vendor = vendors.get(transaction["vendor_id"])
+    return vendor["category"] if vendor else None
+
+def transaction_program(transaction):
+    """The program of a ledger entry: its recipient's, or for payouts its vendor's"""
+    if "program" not in transaction:
+        entity = recipients.get(transaction["recipient_id"]) or vendors.get(transaction["vendor_id"])
+        transaction["program"] = program_of(entity)
+    return programs.get(transaction["program"])
+
+def invoice_expiry(invoice):
+    """When an invoice created by create_invoice expires, or None if it can't be told"""
+    if invoice.get("expires_at"):
+        return datetime.fromisoformat(invoice["expires_at"])
+    try:
+        return datetime.fromtimestamp(bolt11.decode(invoice["payment_request"]).expires_at)
+    except bolt11.Bolt11Error:
+        return None
+
+@tracer.wrap("ledger.record_transaction")
+def record_transaction(transaction):
+    """Append a transaction to its program's ledger and invalidate views built from it"""
+    transaction_program(transaction).ledger.append(transaction)
+    allowances.apply(transaction, transaction_category(transaction))
+    velocity.observe(transaction)
+    fragment_cache.bump("transactions")
+    broker.publish("transaction", transaction_event(transaction))
+    if transaction["status"] == "complete":
+        publish_balance_change(transaction)
+    return transaction
+
+@tracer.wrap("ledger.update_transaction")
+def update_transaction(transaction, **changes):
+    """Change a ledger entry in place, e.g. when a queued payment finishes"""
+    previous_status = transaction["status"]
+    transaction.update(changes)
+    if changes.get("payment_hash"):
+        transaction_program(transaction).ledger.index_payment_hash(changes["payment_hash"])
+    fragment_cache.bump("transactions")
+    if transaction["status"] != previous_status:
+        allowances.apply(transaction, transaction_category(transaction), previous_status)
+        broker.publish("status", {
+            "id": transaction["id"],
+            "program": transaction_program(transaction).id,
+            "recipient_id": transaction["recipient_id"],
+            "vendor_id": transaction["vendor_id"],
+            "status": transaction["status"],
+            "payment_hash": transaction.get("payment_hash")
+        })
+        if transaction["status"] == "complete":
+            publish_balance_change(transaction)
+    return transaction
+
+def validate_payment(recipient_id, vendor_id, amount, reserved=0, record=True):
+    """
+    Validate a payment against the ledger shard and policy of the recipient's
+    program; record=False for a check that doesn't make the payment
+    """
+    recipient = recipients.get(recipient_id)
+    program = programs.of(recipient) if recipient else programs.primary
+    return validate_transaction(recipient_id, vendor_id, amount, recipients, vendors,
+                                program.ledger, reserved=reserved, policy=program.policy, record=record)
+
+def validate_payments(items, reserved=None, record=True):
+    """
+    Validate a batch program by program, each part against its own ledger
+    shard and policy; record=False for checks that don't make the payments
+    
+    Returns:
+        list: One (bool, str) verdict per item, in the order given
+    """
+    by_program = {}
+    for index, item in enumerate(items):
+        recipient = recipients.get(item.get("recipient_id"))
+        program = programs.of(recipient) if recipient else programs.primary
+        by_program.setdefault(program.id, (program, []))[1].append(index)
+    verdicts = [None] * len(items)
+    for program, indexes in by_program.values():
+        part = validate_batch([items[index] for index in indexes], recipients, vendors, program.ledger,
+                              reserved=reserved, policy=program.policy, record=record)
+        for index, verdict in zip(indexes, part):
+            verdicts[index] = verdict
+    return verdicts
+
+def audit(action, **details):
+    """Queue an audit log entry for an action taken in the current request"""
+    audit_log.record(action, actor=request.remote_addr, **details)
+
+def pay_vendor(recipient_id, vendor_id, amount):
+    """
+    Create an invoice from the vendor and pay it from the recipient's wallet
+    
+    Returns:
+        dict: Payment data from lightning.pay_invoice
+    
+    Raises:
+        PaymentUnknown: if LNbits didn't answer the payment; it may still settle
+    """
+    recipient = recipients[recipient_id]
+    vendor = vendors[vendor_id]
     
-    # Make a direct API call to check the wallet
-    response = requests.get(
-        f"{LNBITS_URL}/api/v1/wallet",
-        headers={"X-Api-Key": ADMIN_KEY, "Content-type": "application/json"}
+    # Create an invoice from the vendor
+    vendor_invoice = create_invoice(
+        wallet_key=vendor['inkey'], 
+        amount=amount, 
+        memo=f"Payment from {recipient['name']}"
     )
     
-    if response.status_code == 200:
-        wallet_data = response.json()
-        balance_msat = wallet_data.get("balance", 0)
-        balance_sat = balance_msat // 1000
+    if not vendor_invoice:
+        raise Exception("Failed to create vendor invoice")
+    
+    # AUTOMATIC PAYMENT: Pay the invoice directly instead of just displaying it
+    try:
+        payment = pay_invoice(
+            wallet_adminkey=recipient['adminkey'],
+            payment_request=vendor_invoice["payment_request"],
+            amount=amount
+        )
+    except CircuitOpen:
+        raise
+    except LNbitsUnavailable as e:
+        # The payment may have gone out; don't let it be paid twice
+        raise PaymentUnknown(str(e), vendor_invoice["payment_request"]) from e
+    
+    if not payment or 'payment_hash' not in payment:
+        raise Exception(f"Failed to pay invoice: {payment}")
+    
+    print(f"Payment successful: {payment}")
+    return payment
+
+def reconcile_payment(job):
+    """
+    Look up a payment of unknown outcome in the recipient's LNbits payments
+    
+    Returns:
+        dict: Payment data once it settled, or None while it's still unknown
+    
+    Raises:
+        Exception: if the payment failed or LNbits never took it
+    """
+    recipient = recipients[job.recipient_id]
+    try:
+        payment_hash = bolt11.decode(job.payment_request).payment_hash
+    except bolt11.Bolt11Error:
+        payment_hash = None
+    try:
+        payments = get_wallet_transactions(recipient['adminkey'])
+    except (Overloaded, LNbitsUnavailable):
+        return None
+    for payment in payments:
+        if payment.get("bolt11") != job.payment_request and \
+                (not payment_hash or payment.get("payment_hash") != payment_hash):
+            continue
+        if payment.get("pending", False) or payment.get("status") == "pending":
+            return None
+        if payment.get("status", "success") == "success":
+            return {"payment_hash": payment.get("payment_hash") or payment_hash}
+        raise Exception(f"Payment failed in LNbits: {payment.get('status')}")
+    raise Exception("LNbits never took the payment")
+
+def confirm_payment(vendor_id, amount, payment_hash):
+    """
+    Confirm a payment reported from outside: its invoice must be one this app
+    created or paid recently, or the vendor's LNbits wallet must have received it
+    
+    Returns:
+        tuple: (bool, str) whether the payment is confirmed and why not
+    
+    Raises:
+        LNbitsUnavailable: if the vendor's wallet couldn't be read
+    """
+    known = bolt11.lookup(payment_hash)
+    if known:
+        if known.amount_msat is not None and known.amount_msat != amount * 1000:
+            return False, f"Invoice is for {known.amount_sat} sats, expected {amount} sats"
+        return True, ""
+    for payment in get_wallet_transactions(vendors[vendor_id]['adminkey']):
+        if payment.get("payment_hash") != payment_hash or payment.get("amount", 0) <= 0:
+            continue
+        if payment.get("pending", False) or payment.get("status", "success") != "success":
+            return False, "Payment has not settled in the vendor's wallet"
+        if payment["amount"] != amount * 1000:
+            return False, f"Vendor received {payment['amount'] / 1000:g} sats, expected {amount} sats"
+        return True, ""
+    return False, "Payment not found in the vendor's wallet"
+
+def payment_finisher(transaction):
+    """Callback for a payment job: settle its queued ledger entry with the job's outcome"""
+    def finish(job):
+        update_transaction(
+            transaction,
+            status="complete" if job.status == "complete" else "failed",
+            payment_hash=job.payment_hash
+        )
+    return finish
+
+def payment_nodes(recipient_id, vendor_id=None, funding=False):
+    """
+    Names of the LNbits nodes a payment calls: the recipient's, plus the
+    vendor's for a vendor payment (its invoice is created there), or for
+    funding the node of the program's own admin wallet
+    """
+    recipient = recipients[recipient_id]
+    nodes = {registry.get(recipient.get('node')).name}
+    if vendor_id in vendors:
+        nodes.add(registry.get(vendors[vendor_id].get('node')).name)
+    if funding and programs.of(recipient).admin_key:
+        nodes.add(programs.of(recipient).node)
+    return sorted(nodes)
+
+def search_page(index, entities, query="", category=None, offset=0, limit=SEARCH_PAGE_SIZE):
+    """
+    One page of recipients or vendors from a name index
+    
+    Returns:
+        tuple: (list of (id, record) pairs, whether more matches follow)
+    """
+    ids, more = index.search(query, category=category, offset=offset, limit=limit)
+    return [(entity_id, entities[entity_id]) for entity_id in ids if entity_id in entities], more
+
+def program_param(program):
+    """The ?program= value that keeps links on a program; None with a single program"""
+    return program.id if len(programs.local()) > 1 else None
+
+def page_number(value):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return 1
+
+def admin_balances(program):
+    """
+    Balance of every admin wallet funding a program: its own wallet, or
+    every node's admin wallet
+    
+    Nodes that can't be reached are left out; if none can, the last error is raised.
+    
+    Returns:
+        dict: node name -> balance in sats
+    """
+    balances = {}
+    error = None
+    for node_name, admin_key in program.funding_wallets().items():
+        try:
+            balances[node_name] = get_wallet_balance(admin_key)
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Error getting admin wallet balance on {node_name}: {str(e)}")
+            error = e
+    if not balances and error:
+        raise error
+    return balances
+
+def funding_node(recipient, amount, balances):
+    """
+    Pick the node whose admin wallet funds a recipient
+    
+    The recipient's own node is preferred, since the payment then stays inside
+    one LNbits instance. Otherwise the best funded node pays across nodes.
+    
+    Returns:
+        tuple: (LNbitsNode, its admin wallet balance)
+    """
+    home = registry.get(recipient.get('node'))
+    if balances.get(home.name, 0) >= amount:
+        return home, balances[home.name]
+    name = max(balances, key=balances.get)
+    return registry.get(name), balances[name]
+
+def fund_wallet(recipient_id, amount, memo=None, reference=None, check_balance=True):
+    """
+    Fund a recipient's wallet from an admin wallet of its program and record the deposit
+    
+    Args:
+        memo (str, optional): invoice memo, defaults to the subsidy funding memo
+        reference (str, optional): idempotency key stored on the ledger entry
+        check_balance (bool): check the admin wallets first and fall back to
+            another node's; without it the recipient's node pays (or the
+            program's own wallet) and an insufficient balance fails the
+            payment itself
+    
+    Returns:
+        dict: Payment data from lightning.pay_invoice
+    
+    Raises:
+        InsufficientFunds: if no admin wallet can cover the amount
+    """
+    recipient = recipients[recipient_id]
+    program = programs.of(recipient)
+    wallets = program.funding_wallets()
+    
+    if check_balance:
+        # Fund from the recipient's node, or from another node with enough balance
+        node, admin_balance = funding_node(recipient, amount, admin_balances(program))
+        
+        print(f"Admin wallet balance on {node.name}: {admin_balance} sats")
         
-        print(f"Successfully connected to LNbits wallet")
-        print(f"Wallet name: {wallet_data.get('name', 'Unknown')}")
-        print(f"Balance: {balance_sat} sats ({balance_msat} msats)")
+        if admin_balance < amount:
+            raise InsufficientFunds(f'Insufficient balance in admin wallet. Current balance: {admin_balance} sats, Requested: {amount} sats')
     else:
-        print(f"Failed to connect to LNbits wallet: Status code {response.status_code}")
-        print(f"Response: {response.text}")
-except Exception as e:
-    print(f"Failed to connect to LNbits wallet: {str(e)}")
+        node = registry.get(recipient.get('node') if recipient.get('node') in wallets else program.node)
+    
+    # Create an invoice for funding from the recipient's wallet
+    inkey = recipient['inkey']
+    
+    print(f"Creating invoice with inkey: {inkey}, amount: {amount}")
+    
+    # Create the invoice
+    invoice = create_invoice(
+        wallet_key=inkey,
+        amount=amount, 
+        memo=memo or f"Subsidy funding for {recipient['name']}"
+    )
+    
+    if not invoice or 'payment_request' not in invoice:
+        raise Exception(f"Failed to create invoice: {invoice}")
+    
+    print(f"Created invoice: {invoice}")
+    
+    # Automatically pay the invoice using the program's admin wallet on that node
+    payment = pay_invoice(
+        wallet_adminkey=wallets[node.name],
+        payment_request=invoice["payment_request"],
+        amount=amount
+    )
+    
+    if not payment or 'payment_hash' not in payment:
+        raise Exception(f"Failed to pay invoice: {payment}")
+    
+    print(f"Payment successful: {payment}")
+    
+    record_deposit(recipient_id, amount, payment["payment_hash"], reference)
+    return payment
 
-# Import LNbits service class after initializing configuration
-from service import LNbits
-lnbits_client = None  # Will be initialized when needed
+def record_deposit(recipient_id, amount, payment_hash, reference=None):
+    """Record a completed admin deposit in the ledger"""
+    transaction = {
+        "id": generate_id("T"),
+        "recipient_id": recipient_id,
+        "vendor_id": "admin",
+        "amount": amount,
+        "date": datetime.now(),
+        "status": "complete",
+        "type": "deposit",
+        "payment_hash": payment_hash
+    }
+    if reference:
+        transaction["reference"] = reference
+    return record_transaction(transaction)
 
-# Persistent storage for recipients and vendors
-recipients = {}
-vendors = {}
-transactions = []
+def queue_payment(recipient_id, vendor_id, amount):
+    """
+    Validate a payment, reserve the funds and hand it to the worker pool
+    
+    The ledger entry is added as "queued" right away so it counts against the
+    daily limit, and the job's amount is held against the wallet balance until
+    a worker has finished it.
+    
+    Returns:
+        tuple: (PaymentJob or None, str message)
+    """
+    with payment_pipeline.recipient_lock(recipient_id):
+        valid, message = validate_payment(
+            recipient_id, vendor_id, amount,
+            reserved=payment_pipeline.reserved(recipient_id)
+        )
+        if not valid:
+            return None, message
+        
+        transaction = {
+            "id": generate_id("T"),
+            "recipient_id": recipient_id,
+            "vendor_id": vendor_id,
+            "amount": amount,
+            "date": datetime.now(),
+            "status": "queued",
+            "type": "payment",
+            "payment_hash": None
+        }
+        record_transaction(transaction)
+        
+        # A payment of unknown outcome keeps its entry queued and its
+        # reservation until reconcile_payment finds out how it ended
+        job = PaymentJob(recipient_id, vendor_id, amount, transaction["id"])
+        payment_pipeline.submit(
+            job,
+            lambda job: pay_vendor(job.recipient_id, job.vendor_id, job.amount),
+            on_done=payment_finisher(transaction),
+            reconcile=reconcile_payment
+        )
+    return job, job.message
+
+def redeem_vouchers(vendor_id, redemptions):
+    """
+    Reconcile a vendor's batch of offline voucher redemptions
+    
+    Each redemption is checked like vendor software does (signature, expiry,
+    category, cap) and held against the voucher's cap. The survivors are
+    validated together against the ledger, daily limits, balances and policy
+    with validate_batch. Approved redemptions of the same recipient are paid
+    with one payment, so a batch costs one invoice and one payment per
+    recipient instead of per purchase.
+    
+    Returns:
+        list: One result per redemption, in the order given
+    """
+    vendor = vendors[vendor_id]
+    results = [None] * len(redemptions)
+    held = []
+    seen = set()
+    
+    for index, item in enumerate(redemptions):
+        redemption_id = str(item.get('id') or '')
+        previous = voucher_book.previous(vendor_id, redemption_id) if redemption_id else None
+        if previous:
+            results[index] = previous
+            continue
+        if redemption_id and redemption_id in seen:
+            # Not stored, it would take the place of the first one's result
+            results[index] = {"id": redemption_id, "status": "rejected",
+                              "message": "Duplicate redemption id in batch"}
+            continue
+        if redemption_id:
+            seen.add(redemption_id)
+        try:
+            amount = int(item.get('amount'))
+            claims = voucher_book.check(item.get('token', ''), vendor['category'], amount,
+                                        item.get('redeemed_at'))
+            if claims['sub'] not in recipients:
+                raise VoucherError("Recipient not found")
+            voucher_book.hold(claims, amount)
+        except (VoucherError, TypeError, ValueError) as e:
+            results[index] = {"id": redemption_id, "status": "rejected", "message": str(e)}
+            voucher_book.finish(vendor_id, redemption_id, results[index])
+            continue
+        held.append((index, redemption_id, claims, amount))
+    
+    items = [{"recipient_id": claims['sub'], "vendor_id": vendor_id, "amount": amount}
+             for _, _, claims, amount in held]
+    reserved = {item['recipient_id']: payment_pipeline.reserved(item['recipient_id']) for item in items}
+    verdicts = validate_payments(items, reserved)
+    
+    groups = {}
+    for (index, redemption_id, claims, amount), (valid, message) in zip(held, verdicts):
+        if valid:
+            groups.setdefault(claims['sub'], []).append((index, redemption_id, claims, amount))
+        else:
+            voucher_book.release(claims, amount)
+            results[index] = {"id": redemption_id, "status": "rejected", "message": message}
+            voucher_book.finish(vendor_id, redemption_id, results[index], claims['exp'])
+    
+    for recipient_id, group in groups.items():
+        total = sum(amount for _, _, _, amount in group)
+        try:
+            payment = pay_vendor(recipient_id, vendor_id, total)
+        except PaymentUnknown as e:
+            # It may have gone out: keep the holds, and answer resubmissions
+            # with "pending" until the payment is reconciled
+            transaction = record_voucher_payment(recipient_id, vendor_id, total, group, "queued", None)
+            job = payment_pipeline.track(PaymentJob(recipient_id, vendor_id, total, transaction["id"]),
+                                         e.payment_request, voucher_finisher(vendor_id, group, transaction),
+                                         reconcile_payment)
+            for index, redemption_id, claims, amount in group:
+                results[index] = {"id": redemption_id, "status": "pending", "amount": amount,
+                                  "message": "Payment sent, waiting for LNbits to confirm it",
+                                  "transaction_id": transaction["id"], "job_id": job.id}
+                voucher_book.finish(vendor_id, redemption_id, results[index], claims['exp'])
+            continue
+        except Exception as e:
+            # Not final: nothing was paid, so the vendor can submit these again
+            status = "retry" if isinstance(e, Overloaded) else "failed"
+            for index, redemption_id, claims, amount in group:
+                voucher_book.release(claims, amount)
+                results[index] = {"id": redemption_id, "status": status, "message": str(e)}
+            continue
+        
+        transaction = record_voucher_payment(recipient_id, vendor_id, total, group, "complete",
+                                             payment["payment_hash"])
+        for index, redemption_id, claims, amount in group:
+            results[index] = {"id": redemption_id, "status": "redeemed", "amount": amount,
+                              "transaction_id": transaction["id"]}
+            voucher_book.finish(vendor_id, redemption_id, results[index], claims['exp'])
+    
+    return results
+
+def record_voucher_payment(recipient_id, vendor_id, total, group, status, payment_hash):
+    """Record the payment of a recipient's redemptions in a batch"""
+    return record_transaction({
+        "id": generate_id("T"),
+        "recipient_id": recipient_id,
+        "vendor_id": vendor_id,
+        "amount": total,
+        "date": datetime.now(),
+        "status": status,
+        "type": "payment",
+        "payment_hash": payment_hash,
+        "vouchers": sorted({claims['jti'] for _, _, claims, _ in group})
+    })
+
+def voucher_finisher(vendor_id, group, transaction):
+    """
+    Callback for a redemption payment of unknown outcome: once reconciled,
+    store the redemptions as redeemed, or release their holds and let the
+    vendor submit them again
+    """
+    settle = payment_finisher(transaction)
+    def finish(job):
+        settle(job)
+        for index, redemption_id, claims, amount in group:
+            if job.status == "complete":
+                voucher_book.finish(vendor_id, redemption_id,
+                                    {"id": redemption_id, "status": "redeemed", "amount": amount,
+                                     "transaction_id": transaction["id"]}, claims['exp'])
+            else:
+                voucher_book.release(claims, amount)
+                voucher_book.forget(vendor_id, redemption_id)
+    return finish
+
+def disbursement_members(group):
+    """Recipient ids in a disbursement group; "*" is every recipient"""
+    return [recipient_id for recipient_id, recipient in recipients.items()
+            if group == "*" or recipient.get("group", "default") == group]
+
+def disbursement_paid(recipient_id, amount, memo, reference):
+    """
+    Look for a disbursement payment that already reached the recipient
+    
+    Checks the ledger first, then the recipient's LNbits payments, so a
+    payment that went out just before a crash is recorded instead of repeated.
+    
+    Returns:
+        str: the payment hash, or None if the recipient wasn't paid
+    """
+    # Recent days only: an older payment is still found in LNbits below
+    for transaction in reversed(programs.of(recipients[recipient_id]).ledger.hot()):
+        if transaction.get("reference") == reference and transaction["status"] == "complete":
+            return transaction["payment_hash"]
+    
+    recipient = recipients[recipient_id]
+    for payment in get_wallet_transactions(recipient['adminkey']):
+        settled = not payment.get("pending", False) and payment.get("status", "success") == "success"
+        if payment.get("memo") == memo and settled and payment.get("amount", 0) > 0:
+            record_deposit(recipient_id, amount, payment.get("payment_hash"), reference)
+            return payment.get("payment_hash")
+    return None
+
+def disbursement_fund(recipient_id, amount, memo, reference):
+    # One admin wallet call per payment: balance reads would compete with the
+    # payments for the admin wallet's admission tokens
+    return fund_wallet(recipient_id, amount, memo, reference, check_balance=False)
+
+disbursements.bind(disbursement_fund, disbursement_paid, disbursement_members)
+
+def record_settlement(vendor_id, amount, status, payment_hash, reference, address):
+    """Record a vendor payout to its external address in the ledger"""
+    return record_transaction({
+        "id": generate_id("T"),
+        "recipient_id": "payout",
+        "vendor_id": vendor_id,
+        "amount": amount,
+        "date": datetime.now(),
+        "status": status,
+        "type": "settlement",
+        "payment_hash": payment_hash,
+        "reference": reference,
+        "destination": address
+    })
+
+def settlement_update(transaction, status, payment_hash):
+    return update_transaction(transaction, status=status, payment_hash=payment_hash)
+
+settlements.bind(lambda: vendors, record_settlement, settlement_update)
+
+# Under the debug reloader only the child process that serves requests schedules runs
+_reloader_parent = (__name__ == '__main__'
+                    and os.getenv("DEBUG", "True").lower() in ["true", "1", "t"]
+                    and os.environ.get("WERKZEUG_RUN_MAIN") != "true")
+if DISBURSE_SCHEDULER and not _reloader_parent:
+    disbursements.start()
+if SETTLE_SCHEDULER and not _reloader_parent:
+    settlements.start()
+if not _reloader_parent:
+    wallet_pool.start()
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(error):
+    """Shed load with a fast 429 instead of queueing behind LNbits"""
+    if request.path.startswith('/api/'):
+        response = jsonify({"success": False, "message": str(error)})
+    else:
+        response = app.response_class(
+            f"Service busy, please retry shortly: {error}", mimetype="text/plain"
+        )
+    response.status_code = 429
+    response.headers["Retry-After"] = retry_after_header(error)
+    return response
+
+@app.errorhandler(ProgramError)
+def handle_program_error(error):
+    """
+    404 for an unknown program; a program placed on another worker gets 421,
+    or for pages a redirect when that worker's URL is configured
+    """
+    status = 421 if error.worker else 404
+    if request.path.startswith('/api/'):
+        return jsonify({"success": False, "message": str(error),
+                        "worker": error.worker, "url": error.url}), status
+    if error.url and request.method == 'GET':
+        return redirect(error.url + request.full_path.rstrip('?'))
+    return app.response_class(str(error), status=status, mimetype="text/plain")
 
 # Routes
 @app.route('/')
@@ -64,100 +813,128 @@ def index():
 @app.route('/admin')
 @app.route('/admin')
 def admin_dashboard():
-    """Admin dashboard route with wallet balances"""
+    """Admin dashboard route for one program (?program=); balances load from /api/admin/balances"""
+    program = programs.get(request.args.get('program'))
+    program_recipients = {recipient_id: recipient for recipient_id, recipient in recipients.items()
+                          if program_of(recipient) == program.id}
+    program_vendors = {vendor_id: vendor for vendor_id, vendor in vendors.items()
+                       if program_of(vendor) == program.id}
     
-    # Fetch balance for all recipients
-    recipient_balances = {}
-    for recipient_id, recipient in recipients.items():
-        try:
-            if 'adminkey' in recipient:
-                # Try to get balance from LNbits
-                balance = get_wallet_balance(recipient['adminkey'])
-                recipient_balances[recipient_id] = balance
-        except Exception as e:
-            print(f"Error getting balance for recipient {recipient_id}: {str(e)}")
-            # Calculate from transactions as fallback
-            deposits = sum(t["amount"] for t in transactions 
-                        if t["recipient_id"] == recipient_id 
-                        and t["type"] == "deposit" 
-                        and t["status"] == "complete")
-            
-            payments = sum(t["amount"] for t in transactions 
-                         if t["recipient_id"] == recipient_id 
-                         and t["type"] == "payment" 
-                         and t["status"] == "complete")
-            
-            recipient_balances[recipient_id] = deposits - payments
-    
-    # Fetch balance for all vendors
-    vendor_balances = {}
-    for vendor_id, vendor in vendors.items():
-        try:
-            if 'adminkey' in vendor:
-                # Try to get balance from LNbits
-                balance = get_wallet_balance(vendor['adminkey'])
-                vendor_balances[vendor_id] = balance
-        except Exception as e:
-            print(f"Error getting balance for vendor {vendor_id}: {str(e)}")
-            # For vendors, we can estimate based on received payments
-            received = sum(t["amount"] for t in transactions 
-                         if t["vendor_id"] == vendor_id 
-                         and t["type"] == "payment" 
-                         and t["status"] == "complete")
-            
-            vendor_balances[vendor_id] = received
+    # Render each section from the fragment cache. Balances change with every
+    # payment, so they are left out and filled in from /api/admin/balances
+    recipients_table = fragment_cache.render(
+        f"admin_recipients.{program.id}", ("recipients",),
+        lambda: render_template('admin/_recipients_table.html', recipients=program_recipients)
+    )
+    vendors_table = fragment_cache.render(
+        f"admin_vendors.{program.id}", ("vendors",),
+        lambda: render_template('admin/_vendors_table.html', vendors=program_vendors)
+    )
+    transactions_table = fragment_cache.render(
+        f"admin_transactions.{program.id}", ("transactions", "recipients", "vendors"),
+        lambda: render_template('admin/_transactions_table.html',
+                                recipients=program_recipients,
+                                vendors=program_vendors,
+                                transactions=program.ledger.hot())
+    )
     
     return render_template('admin/dashboard.html', 
-                          recipients=recipients,
-                          recipient_balances=recipient_balances,
-                          vendors=vendors,
-                          vendor_balances=vendor_balances,
-                          transactions=transactions)
+                          program=program,
+                          programs=programs.local(),
+                          recipients_table=recipients_table,
+                          vendors_table=vendors_table,
+                          transactions_table=transactions_table,
+                          lnbits_status=breaker_status())
+
 
+@app.route('/api/admin/balances')
+def api_admin_balances():
+    """
+    Wallet balances of a program's recipients and vendors (?program=), for
+    the admin dashboard's balance cells
+    
+    Wallets LNbits can't report are estimated from the ledger.
+    
+    Returns:
+        JSON: {"recipient:<id>" or "vendor:<id>": {"balance": sats, "estimated": bool}}
+    """
+    program = programs.get(request.args.get('program'))
+    balances = {}
+    for kind, entities, estimate in (("recipient", recipients, ledger_recipient_balance),
+                                     ("vendor", vendors, ledger_vendor_balance)):
+        for entity_id, entity in list(entities.items()):
+            if program_of(entity) != program.id or 'adminkey' not in entity:
+                continue
+            try:
+                balances[f"{kind}:{entity_id}"] = {"balance": get_wallet_balance(entity['adminkey']),
+                                                   "estimated": False}
+            except Overloaded:
+                raise
+            except Exception as e:
+                print(f"Error getting balance for {kind} {entity_id}: {str(e)}")
+                balances[f"{kind}:{entity_id}"] = {"balance": estimate(entity_id), "estimated": True}
+    return jsonify(balances)
 
 @app.route('/admin/add_recipient', methods=['GET', 'POST'])
 def add_recipient():
+    program = programs.get(request.values.get('program'))
     if request.method == 'POST':
         try:
             # Create a new account for the recipient using LNbits service
             recipient_name = request.form['name']
             daily_limit = int(request.form['daily_limit'])
+            group = request.form.get('group', '').strip() or "default"
             
-            # Import LNbits module properly - this ensures lnbits_client is defined
-            from service import LNbits
-            
-            # Create or reuse the global lnbits_client
-            global lnbits_client
-            if not lnbits_client:
-                lnbits_client = LNbits(LNBITS_URL)
-            
-            # Create LNbits account
-            account = lnbits_client.create_account(name=f"Subsidy-{recipient_name}")
+            # Place the recipient's wallet on one of the LNbits nodes
+            recipient_id = generate_id("R")
+            node = registry.place(recipient_id)
             
-            # Create wallet for the account
-            wallet = lnbits_client.create_wallet(
-                account_api_key=account.adminkey,
-                name=f"{recipient_name}-wallet"
-            )
+            # Take a pre-provisioned wallet, or create one when the pool is empty
+            wallet = wallet_pool.claim(node.name, f"{recipient_name}-wallet")
+            if wallet is None:
+                lnbits_client = registry.client(node.name)
+                
+                # Create LNbits account
+                account = lnbits_client.create_account(name=f"Subsidy-{recipient_name}")
+                
+                # Create wallet for the account
+                wallet = lnbits_client.create_wallet(
+                    account_api_key=account.adminkey,
+                    name=f"{recipient_name}-wallet"
+                )
+                registry.register_wallet(node.name, wallet.adminkey, wallet.inkey)
             
             # Store recipient info
-            recipient_id = generate_id("R")
             recipients[recipient_id] = {
                 "name": recipient_name,
                 "wallet_id": wallet.id,
                 "adminkey": wallet.adminkey,
                 "inkey": wallet.inkey,
+                "node": node.name,
+                "program": program.id,
+                "group": group,
                 "daily_limit": daily_limit,
                 "created_at": datetime.now()
             }
+            program.recipient_index.add(recipient_id, recipient_name)
+            # A new wallet starts empty
+            allowances.track_wallet(recipient_id, wallet.adminkey, balance=0)
+            
+            fragment_cache.bump("recipients")
+            audit("add_recipient", outcome="ok", recipient_id=recipient_id, name=recipient_name,
+                  daily_limit=daily_limit, group=group, node=node.name, wallet_id=wallet.id,
+                  program=program.id)
             
             flash(f'Recipient {recipient_name} added successfully')
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('admin_dashboard', program=program.id))
             
+        except Overloaded:
+            raise
         except Exception as e:
+            audit("add_recipient", outcome="error", name=request.form.get('name'), error=str(e))
             flash(f'Error creating account: {str(e)}')
     
-    return render_template('admin/add_recipient.html')
+    return render_template('admin/add_recipient.html', program=program, programs=programs.local())
 
 
 # Replace the fund_recipient function in app.py with this updated version
@@ -170,6 +947,10 @@ def fund_recipient(recipient_id):
         return redirect(url_for('admin_dashboard'))
     
     if request.method == 'POST':
+        if not payments_available(*payment_nodes(recipient_id, funding=True)):
+            flash('Funding is temporarily unavailable because LNbits is not responding. Please try again shortly.')
+            return redirect(url_for('fund_recipient', recipient_id=recipient_id))
+        
         try:
             amount = int(request.form['amount'])
             recipient = recipients.get(recipient_id)
@@ -178,60 +959,23 @@ def fund_recipient(recipient_id):
                 flash('Recipient not found')
                 return redirect(url_for('admin_dashboard'))
             
-            # Use the global ADMIN_KEY to get the admin wallet balance
-            admin_balance = get_wallet_balance(ADMIN_KEY)
-            
-            print(f"Admin wallet balance: {admin_balance} sats")
-            
-            if admin_balance < amount:
-                flash(f'Insufficient balance in admin wallet. Current balance: {admin_balance} sats, Requested: {amount} sats')
-                return redirect(url_for('fund_recipient', recipient_id=recipient_id))
-            
-            # Create an invoice for funding from the recipient's wallet
-            inkey = recipient['inkey']
-            
-            print(f"Creating invoice with inkey: {inkey}, amount: {amount}")
-            
-            # Create the invoice
-            invoice = create_invoice(
-                wallet_key=inkey,
-                amount=amount, 
-                memo=f"Subsidy funding for {recipient['name']}"
-            )
-            
-            if not invoice or 'payment_request' not in invoice:
-                raise Exception(f"Failed to create invoice: {invoice}")
-            
-            print(f"Created invoice: {invoice}")
-            
-            # Automatically pay the invoice using the admin wallet
-            payment = pay_invoice(
-                wallet_adminkey=ADMIN_KEY,
-                payment_request=invoice["payment_request"]
-            )
-            
-            if not payment or 'payment_hash' not in payment:
-                raise Exception(f"Failed to pay invoice: {payment}")
-            
-            print(f"Payment successful: {payment}")
-            
-            # Record the transaction as complete
-            transaction_id = generate_id("T")
-            transactions.append({
-                "id": transaction_id,
-                "recipient_id": recipient_id,
-                "vendor_id": "admin",
-                "amount": amount,
-                "date": datetime.now(),
-                "status": "complete",
-                "type": "deposit",
-                "payment_hash": payment["payment_hash"]
-            })
+            payment = fund_wallet(recipient_id, amount)
+            audit("fund_recipient", outcome="ok", recipient_id=recipient_id, amount=amount,
+                  payment_hash=payment["payment_hash"])
             
             flash(f'Recipient {recipient["name"]} funded successfully with {amount} sats')
             return redirect(url_for('admin_dashboard'))
             
+        except InsufficientFunds as e:
+            audit("fund_recipient", outcome="rejected", recipient_id=recipient_id,
+                  amount=request.form.get('amount'), error=str(e))
+            flash(str(e))
+            return redirect(url_for('fund_recipient', recipient_id=recipient_id))
+        except Overloaded:
+            raise
         except Exception as e:
+            audit("fund_recipient", outcome="error", recipient_id=recipient_id,
+                  amount=request.form.get('amount'), error=str(e))
             import traceback
             print(f"Error funding recipient: {str(e)}")
             print(traceback.format_exc())
@@ -240,60 +984,119 @@ def fund_recipient(recipient_id):
     # GET request - display the form
     recipient = recipients.get(recipient_id)
     
-    # Get admin wallet balance for display
-    admin_balance = get_wallet_balance(ADMIN_KEY)
+    # Get admin wallet balances for display; one payment can't exceed the largest
+    try:
+        node_balances = admin_balances(programs.of(recipient))
+        admin_balance = max(node_balances.values())
+    except Overloaded:
+        raise
+    except Exception as e:
+        print(f"Error getting admin wallet balance: {str(e)}")
+        flash(f'Could not fetch the admin wallet balance: {str(e)}')
+        node_balances = {}
+        admin_balance = 0
     
     return render_template('admin/fund_recipient.html', 
                           recipient_id=recipient_id, 
                           recipients=recipients, 
                           recipient=recipient,
-                          admin_balance=admin_balance)
+                          admin_balance=admin_balance,
+                          node_balances=node_balances)
 
 @app.route('/admin/vendors')
 def vendor_list():
-    return render_template('admin/vendors.html', vendors=vendors)
+    program = programs.get(request.args.get('program'))
+    q = request.args.get('q', '')
+    category = request.args.get('category') or None
+    page = page_number(request.args.get('page'))
+    page_vendors, has_more = search_page(program.vendor_index, vendors, q, category,
+                                         offset=(page - 1) * SEARCH_PAGE_SIZE)
+    return render_template('admin/vendors.html',
+                          page_vendors=page_vendors,
+                          has_more=has_more,
+                          page=page,
+                          q=q,
+                          category=category,
+                          categories=program.vendor_index.categories(),
+                          program_param=program_param(program))
 
 @app.route('/admin/add_vendor', methods=['GET', 'POST'])
 def add_vendor():
+    program = programs.get(request.values.get('program'))
     if request.method == 'POST':
         try:
             # Create a new account for the vendor
             vendor_name = request.form['name']
             vendor_category = request.form['category']
+            payout_address = request.form.get('payout_address', '').strip() or None
+            payout_threshold = int(request.form.get('payout_threshold') or 0) or None
+            if payout_address:
+                payout_address = validate_address(payout_address)
             
-            # Create LNbits account
-            account = lnbits_client.create_account(name=f"Vendor-{vendor_name}")
+            # Place the vendor's wallet on one of the LNbits nodes
+            vendor_id = generate_id("V")
+            node = registry.place(vendor_id)
             
-            # Create wallet for the vendor
-            wallet = lnbits_client.create_wallet(
-                account_api_key=account.adminkey,
-                name=f"{vendor_name}-wallet"
-            )
+            # Take a pre-provisioned wallet, or create one when the pool is empty
+            wallet = wallet_pool.claim(node.name, f"{vendor_name}-wallet")
+            if wallet is None:
+                lnbits_client = registry.client(node.name)
+                
+                # Create LNbits account
+                account = lnbits_client.create_account(name=f"Vendor-{vendor_name}")
+                
+                # Create wallet for the vendor
+                wallet = lnbits_client.create_wallet(
+                    account_api_key=account.adminkey,
+                    name=f"{vendor_name}-wallet"
+                )
+                registry.register_wallet(node.name, wallet.adminkey, wallet.inkey)
             
             # Store vendor info
-            vendor_id = generate_id("V")
             vendors[vendor_id] = {
                 "name": vendor_name,
                 "category": vendor_category,
                 "wallet_id": wallet.id,
                 "adminkey": wallet.adminkey,
-                "inkey": wallet.inkey
+                "inkey": wallet.inkey,
+                "node": node.name,
+                "program": program.id,
+                "payout_address": payout_address,
+                "payout_threshold": payout_threshold
             }
+            program.vendor_index.add(vendor_id, vendor_name, vendor_category)
+            
+            fragment_cache.bump("vendors")
+            audit("add_vendor", outcome="ok", vendor_id=vendor_id, name=vendor_name,
+                  category=vendor_category, node=node.name, wallet_id=wallet.id,
+                  payout_address=payout_address, program=program.id)
             
             flash('Vendor added successfully')
-            return redirect(url_for('vendor_list'))
+            return redirect(url_for('vendor_list', program=program_param(program)))
             
+        except Overloaded:
+            raise
         except Exception as e:
+            audit("add_vendor", outcome="error", name=request.form.get('name'), error=str(e))
             flash(f'Error creating vendor: {str(e)}')
     
-    return render_template('admin/add_vendor.html')
+    return render_template('admin/add_vendor.html', program=program, programs=programs.local())
 
 # Recipient Routes
 @app.route('/recipient_list')
 def recipient_list():
-    """Route to display all recipients"""
+    """Route to display a program's recipients a page at a time, optionally filtered by name"""
+    program = programs.get(request.args.get('program'))
+    q = request.args.get('q', '')
+    page = page_number(request.args.get('page'))
+    page_recipients, has_more = search_page(program.recipient_index, recipients, q,
+                                            offset=(page - 1) * SEARCH_PAGE_SIZE)
     return render_template('recipient/list.html', 
-                          recipients=recipients)
+                          page_recipients=page_recipients,
+                          has_more=has_more,
+                          page=page,
+                          q=q,
+                          program_param=program_param(program))
 
 @app.route('/recipient/<recipient_id>')
 def recipient_dashboard(recipient_id):
@@ -311,6 +1114,7 @@ def recipient_dashboard(recipient_id):
             return redirect(url_for('index'))
         
         # Get recipient's wallet balance
+        estimated = False
         try:
             # Try to get the balance from LNbits
             balance = get_wallet_balance(recipient['adminkey'])
@@ -319,26 +1123,18 @@ def recipient_dashboard(recipient_id):
             print(f"Error getting wallet balance: {str(e)}")
             
             # Fall back to calculating balance from transactions
-            deposits = sum(t["amount"] for t in transactions 
-                        if t["recipient_id"] == recipient_id 
-                        and t["type"] == "deposit" 
-                        and t["status"] == "complete")
-            
-            payments = sum(t["amount"] for t in transactions 
-                         if t["recipient_id"] == recipient_id 
-                         and t["type"] == "payment" 
-                         and t["status"] == "complete")
-            
-            balance = deposits - payments
+            balance = ledger_recipient_balance(recipient_id)
+            estimated = True
             print(f"Calculated balance from transactions: {balance} sats")
         
         # Get recipient's transactions
-        recipient_transactions = [t for t in transactions if t["recipient_id"] == recipient_id]
+        recipient_transactions = [t for t in programs.of(recipient).ledger.hot() if t["recipient_id"] == recipient_id]
         
         return render_template('recipient/dashboard.html',
                               recipients=recipients,  # Pass full recipients dict
                               recipient_id=recipient_id,
                               balance=balance,
+                              estimated=estimated,
                               transactions=recipient_transactions,
                               vendors=vendors)
     except Exception as e:
@@ -357,95 +1153,143 @@ def make_payment(recipient_id):
         return redirect(url_for('index'))
     
     if request.method == 'POST':
+        if not payments_available(*payment_nodes(recipient_id, request.form.get('vendor_id'))):
+            flash('Payments are temporarily unavailable because LNbits is not responding. Please try again shortly.')
+            return redirect(url_for('make_payment', recipient_id=recipient_id))
+        
         try:
             vendor_id = request.form['vendor_id']
             amount = int(request.form['amount'])
             
-            # Validate payment
-            valid, message = validate_transaction(
-                recipient_id, vendor_id, amount, 
-                recipients, vendors, transactions
-            )
-            
-            if not valid:
-                flash(message)
-                return redirect(url_for('make_payment', recipient_id=recipient_id))
+            # The form sends a hidden "sync" plus the checkbox value when ticked
+            if 'queued' in (request.form.getlist('mode') or [PAYMENT_MODE]):
+                job, message = queue_payment(recipient_id, vendor_id, amount)
+                if not job:
+                    audit("make_payment", outcome="rejected", recipient_id=recipient_id,
+                          vendor_id=vendor_id, amount=amount, mode="queued", message=message)
+                    flash(message)
+                    return redirect(url_for('make_payment', recipient_id=recipient_id))
+                audit("make_payment", outcome="queued", recipient_id=recipient_id, vendor_id=vendor_id,
+                      amount=amount, job_id=job.id, transaction_id=job.transaction_id)
+                return redirect(url_for('payment_status', job_id=job.id))
             
-            try:
-                # Find the vendor's invoice key
-                vendor = vendors[vendor_id]
-                
-                # Create an invoice from the vendor
-                vendor_invoice = create_invoice(
-                    wallet_key=vendor['inkey'], 
-                    amount=amount, 
-                    memo=f"Payment from {recipient['name']}"
+            # Held until the ledger entry is recorded, so a queued payment or a
+            # second sync payment can't pass the same daily limit and balance
+            with payment_pipeline.recipient_lock(recipient_id):
+                # Validate payment
+                valid, message = validate_payment(
+                    recipient_id, vendor_id, amount,
+                    reserved=payment_pipeline.reserved(recipient_id)
                 )
                 
-                if not vendor_invoice:
-                    raise Exception("Failed to create vendor invoice")
+                if not valid:
+                    audit("make_payment", outcome="rejected", recipient_id=recipient_id,
+                          vendor_id=vendor_id, amount=amount, mode="sync", message=message)
+                    flash(message)
+                    return redirect(url_for('make_payment', recipient_id=recipient_id))
                 
-                # AUTOMATIC PAYMENT: Pay the invoice directly instead of just displaying it
-                payment = pay_invoice(
-                    wallet_adminkey=recipient['adminkey'],
-                    payment_request=vendor_invoice["payment_request"]
-                )
-                
-                if not payment or 'payment_hash' not in payment:
-                    raise Exception(f"Failed to pay invoice: {payment}")
-                
-                print(f"Payment successful: {payment}")
+                try:
+                    vendor = vendors[vendor_id]
+                    payment = pay_vendor(recipient_id, vendor_id, amount)
+                    
+                    # Record the transaction as complete
+                    transaction_id = generate_id("T")
+                    record_transaction({
+                        "id": transaction_id,
+                        "recipient_id": recipient_id,
+                        "vendor_id": vendor_id,
+                        "amount": amount,
+                        "date": datetime.now(),
+                        "status": "complete",  # Mark as complete since we paid it
+                        "type": "payment",
+                        "payment_hash": payment["payment_hash"]
+                    })
+                    audit("make_payment", outcome="ok", recipient_id=recipient_id, vendor_id=vendor_id,
+                          amount=amount, transaction_id=transaction_id, payment_hash=payment["payment_hash"])
+                    
+                    # Redirect to dashboard with success message
+                    flash(f'Payment of {amount} sats to {vendor["name"]} completed successfully')
+                    return redirect(url_for('recipient_dashboard', recipient_id=recipient_id))
                 
-                # Record the transaction as complete
-                transaction_id = generate_id("T")
-                transactions.append({
-                    "id": transaction_id,
-                    "recipient_id": recipient_id,
-                    "vendor_id": vendor_id,
-                    "amount": amount,
-                    "date": datetime.now(),
-                    "status": "complete",  # Mark as complete since we paid it
-                    "type": "payment",
-                    "payment_hash": payment["payment_hash"]
-                })
-                
-                # Redirect to dashboard with success message
-                flash(f'Payment of {amount} sats to {vendor["name"]} completed successfully')
-                return redirect(url_for('recipient_dashboard', recipient_id=recipient_id))
-                
-            except Exception as e:
-                import traceback
-                print(f"Error processing vendor payment: {str(e)}")
-                print(traceback.format_exc())
-                flash(f'Error processing vendor payment: {str(e)}')
+                except PaymentUnknown as e:
+                    # It may have gone out: hold it like a queued payment until it's reconciled
+                    transaction = record_transaction({
+                        "id": generate_id("T"),
+                        "recipient_id": recipient_id,
+                        "vendor_id": vendor_id,
+                        "amount": amount,
+                        "date": datetime.now(),
+                        "status": "queued",
+                        "type": "payment",
+                        "payment_hash": None
+                    })
+                    job = payment_pipeline.track(PaymentJob(recipient_id, vendor_id, amount, transaction["id"]),
+                                                 e.payment_request, payment_finisher(transaction), reconcile_payment)
+                    audit("make_payment", outcome="unknown", recipient_id=recipient_id, vendor_id=vendor_id,
+                          amount=amount, job_id=job.id, transaction_id=transaction["id"], error=str(e))
+                    return redirect(url_for('payment_status', job_id=job.id))
+                except Overloaded:
+                    raise
+                except Exception as e:
+                    audit("make_payment", outcome="error", recipient_id=recipient_id,
+                          vendor_id=vendor_id, amount=amount, error=str(e))
+                    import traceback
+                    print(f"Error processing vendor payment: {str(e)}")
+                    print(traceback.format_exc())
+                    flash(f'Error processing vendor payment: {str(e)}')
                 
+        except Overloaded:
+            raise
         except Exception as e:
             import traceback
             print(f"Error processing payment: {str(e)}")
             print(traceback.format_exc())
             flash(f'Error processing payment: {str(e)}')
         
+    # The first page of the program's vendors; the form searches for the rest as the user types
+    program = programs.of(recipient)
+    vendor_options, vendors_more = search_page(program.vendor_index, vendors)
     return render_template('recipient/payment.html', 
                           recipient_id=recipient_id,
+                          vendor_options=vendor_options,
+                          vendors_more=vendors_more,
+                          vendor_categories=program.vendor_index.categories(),
+                          program_param=program_param(program),
+                          payment_mode=PAYMENT_MODE)
+
+@app.route('/payments/<job_id>')
+def payment_status(job_id):
+    """Status page for a queued payment; redirects once the payment finished"""
+    job = payment_pipeline.get(job_id)
+    if not job:
+        flash('Payment not found')
+        return redirect(url_for('index'))
+    
+    if job.done:
+        flash(job.message)
+        if job.status == 'complete':
+            return redirect(url_for('recipient_dashboard', recipient_id=job.recipient_id))
+        return redirect(url_for('make_payment', recipient_id=job.recipient_id))
+    
+    return render_template('recipient/payment_status.html',
+                          job=job,
                           vendors=vendors)
 
 # Vendor Routes
 @app.route('/vendor/generate_invoice', methods=['GET', 'POST'])
 def vendor_generate_invoice():
+    program = programs.get(request.values.get('program'))
     if request.method == 'POST':
         vendor_id = request.form['vendor_id']
         recipient_id = request.form['recipient_id']
         amount = int(request.form['amount'])
         
         # Validate the transaction
-        valid, message = validate_transaction(
-            recipient_id, vendor_id, amount, 
-            recipients, vendors, transactions
-        )
+        valid, message = validate_payment(recipient_id, vendor_id, amount)
         
         if not valid:
             flash(message)
-            return redirect(url_for('vendor_generate_invoice'))
+            return redirect(url_for('vendor_generate_invoice', program=program_param(program)))
         
         try:
             # Get the vendor's LNbits wallet
@@ -463,7 +1307,7 @@ def vendor_generate_invoice():
             
             # Record the transaction
             transaction_id = generate_id("T")
-            transactions.append({
+            record_transaction({
                 "id": transaction_id,
                 "recipient_id": recipient_id,
                 "vendor_id": vendor_id,
@@ -471,19 +1315,28 @@ def vendor_generate_invoice():
                 "date": datetime.now(),
                 "status": "pending",
                 "type": "payment",
-                "payment_hash": invoice["payment_hash"]
+                "payment_hash": invoice["payment_hash"],
+                # Nothing settles the entry, so past this it stops holding its ledger day in memory
+                "expires_at": invoice_expiry(invoice)
             })
             
             return render_template('vendor/invoice.html', 
                                  invoice=invoice, 
                                  recipient_id=recipient_id,
                                  vendor_id=vendor_id)
+        except Overloaded:
+            raise
         except Exception as e:
             flash(f'Error generating invoice: {str(e)}')
     
+    vendor_options, vendors_more = search_page(program.vendor_index, vendors)
+    recipient_options, recipients_more = search_page(program.recipient_index, recipients)
     return render_template('vendor/generate_invoice.html', 
-                          vendors=vendors, 
-                          recipients=recipients)
+                          vendor_options=vendor_options,
+                          vendors_more=vendors_more,
+                          recipient_options=recipient_options,
+                          recipients_more=recipients_more,
+                          program_param=program_param(program))
 
 # API Routes (for integration with payment systems)
 @app.route('/api/validate_payment', methods=['POST'])
@@ -499,17 +1352,52 @@ def api_validate_payment():
     if not all([recipient_id, vendor_id, amount]):
         return jsonify({"success": False, "message": "Missing required fields"}), 400
     
-    # Validate the payment
-    valid, message = validate_transaction(
-        recipient_id, vendor_id, int(amount), 
-        recipients, vendors, transactions
-    )
+    # Validate the payment; only a check, so velocity flags wait for the real one
+    valid, message = validate_payment(recipient_id, vendor_id, int(amount), record=False)
     
     return jsonify({
         "success": valid,
         "message": message
     })
 
+@app.route('/api/validate_payments', methods=['POST'])
+def api_validate_payments():
+    """Validate a batch of payments, e.g. a POS basket or a queue of customers"""
+    data = request.json
+    if not data:
+        return jsonify({"success": False, "message": "No data provided"}), 400
+    
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({"success": False, "message": "Expected a list of items"}), 400
+    
+    if len(items) > VALIDATE_BATCH_MAX:
+        return jsonify({
+            "success": False,
+            "message": f"Batch too large (max {VALIDATE_BATCH_MAX} items)"
+        }), 400
+    
+    reserved = {recipient_id: payment_pipeline.reserved(recipient_id)
+                for recipient_id in {item.get('recipient_id') for item in items}}
+    verdicts = validate_payments(items, reserved, record=False)
+    
+    results = []
+    for index, (item, (valid, message)) in enumerate(zip(items, verdicts)):
+        results.append({
+            "index": index,
+            "recipient_id": item.get('recipient_id'),
+            "vendor_id": item.get('vendor_id'),
+            "amount": item.get('amount'),
+            "success": valid,
+            "message": message
+        })
+    
+    return jsonify({
+        "success": all(valid for valid, _ in verdicts),
+        "valid_count": sum(1 for valid, _ in verdicts if valid),
+        "results": results
+    })
+
 @app.route('/api/record_transaction', methods=['POST'])
 def api_record_transaction():
     data = request.json
@@ -524,24 +1412,472 @@ def api_record_transaction():
     if not all([recipient_id, vendor_id, amount, payment_hash]):
         return jsonify({"success": False, "message": "Missing required fields"}), 400
     
-    # Record the transaction
+    # An invoice sent along must match the claim, but proves nothing by itself:
+    # anyone can encode one, and its signature isn't checked
+    try:
+        amount = int(amount)
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        if not re.fullmatch(r"[0-9a-fA-F]{64}", str(payment_hash)):
+            raise ValueError("payment_hash must be 64 hex characters")
+        payment_hash = payment_hash.lower()
+        payment_request = data.get('payment_request') or data.get('bolt11')
+        if payment_request and bolt11.BOLT11_VERIFY:
+            bolt11.check(payment_request, amount=amount, payment_hash=payment_hash, allow_expired=True)
+    except (ValueError, TypeError) as e:
+        audit("api_record_transaction", outcome="rejected", recipient_id=recipient_id, vendor_id=vendor_id,
+              amount=data.get('amount'), payment_hash=payment_hash, message=str(e))
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    # Only payments between known parties are recorded, as validate_transaction requires
+    if recipient_id not in recipients or vendor_id not in vendors:
+        message = "Recipient not found" if recipient_id not in recipients else "Vendor not found"
+        audit("api_record_transaction", outcome="rejected", recipient_id=recipient_id, vendor_id=vendor_id,
+              amount=amount, payment_hash=payment_hash, message=message)
+        return jsonify({"success": False, "message": message}), 404
+    # Every payment belongs to one program, so both parties must be in it
+    if program_of(vendors[vendor_id]) != program_of(recipients[recipient_id]):
+        message = "Vendor not approved for subsidy program"
+        audit("api_record_transaction", outcome="rejected", recipient_id=recipient_id, vendor_id=vendor_id,
+              amount=amount, payment_hash=payment_hash, message=message)
+        return jsonify({"success": False, "message": message}), 404
+    
+    if bolt11.BOLT11_VERIFY:
+        try:
+            confirmed, message = confirm_payment(vendor_id, amount, payment_hash)
+        except LNbitsUnavailable:
+            return jsonify({
+                "success": False,
+                "message": "Can't confirm the payment because LNbits is not responding"
+            }), 503
+        if not confirmed:
+            audit("api_record_transaction", outcome="rejected", recipient_id=recipient_id, vendor_id=vendor_id,
+                  amount=amount, payment_hash=payment_hash, message=message)
+            return jsonify({"success": False, "message": message}), 400
+    
+    # Checked and recorded under one lock, so the same payment can't be recorded twice
     transaction_id = generate_id("T")
-    transactions.append({
-        "id": transaction_id,
-        "recipient_id": recipient_id,
-        "vendor_id": vendor_id,
-        "amount": int(amount),
-        "date": datetime.now(),
-        "status": "complete",
-        "type": "payment",
-        "payment_hash": payment_hash
-    })
+    with record_lock:
+        if any(program.ledger.has_payment_hash(payment_hash) for program in programs.local()):
+            message = "Payment already recorded"
+            audit("api_record_transaction", outcome="rejected", recipient_id=recipient_id, vendor_id=vendor_id,
+                  amount=amount, payment_hash=payment_hash, message=message)
+            return jsonify({"success": False, "message": message}), 409
+        record_transaction({
+            "id": transaction_id,
+            "recipient_id": recipient_id,
+            "vendor_id": vendor_id,
+            "amount": int(amount),
+            "date": datetime.now(),
+            "status": "complete",
+            "type": "payment",
+            "payment_hash": payment_hash
+        })
+    audit("api_record_transaction", outcome="ok", recipient_id=recipient_id, vendor_id=vendor_id,
+          amount=int(amount), transaction_id=transaction_id, payment_hash=payment_hash)
     
     return jsonify({
         "success": True,
         "transaction_id": transaction_id
     })
 
+@app.route('/api/payments', methods=['POST'])
+def api_queue_payment():
+    """Accept a payment for background processing and return its job id"""
+    data = request.json
+    if not data:
+        return jsonify({"success": False, "message": "No data provided"}), 400
+    
+    recipient_id = data.get('recipient_id')
+    vendor_id = data.get('vendor_id')
+    amount = data.get('amount')
+    
+    if not all([recipient_id, vendor_id, amount]):
+        return jsonify({"success": False, "message": "Missing required fields"}), 400
+    
+    recipient = recipients.get(recipient_id)
+    if recipient and not payments_available(*payment_nodes(recipient_id, vendor_id)):
+        return jsonify({
+            "success": False,
+            "message": "Payments are temporarily unavailable because LNbits is not responding"
+        }), 503
+    
+    job, message = queue_payment(recipient_id, vendor_id, int(amount))
+    if not job:
+        audit("api_queue_payment", outcome="rejected", recipient_id=recipient_id,
+              vendor_id=vendor_id, amount=int(amount), message=message)
+        return jsonify({"success": False, "message": message}), 400
+    audit("api_queue_payment", outcome="queued", recipient_id=recipient_id, vendor_id=vendor_id,
+          amount=int(amount), job_id=job.id, transaction_id=job.transaction_id)
+    
+    status_url = url_for('api_payment_status', job_id=job.id)
+    response = jsonify({
+        "success": True,
+        "job_id": job.id,
+        "transaction_id": job.transaction_id,
+        "status_url": status_url
+    })
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return response
+
+@app.route('/api/allowance/<recipient_id>')
+def api_allowance(recipient_id):
+    """
+    What a recipient can still spend today, for POS terminals to poll
+    
+    Answered from in-memory counters without calling LNbits; the balance is
+    the last known one and comes with its as-of time. With ?vendor_id= it
+    also says whether the vendor is allowed (and ?amount= checks a payment).
+    """
+    recipient = recipients.get(recipient_id)
+    if not recipient:
+        return jsonify({"success": False, "message": "Recipient not found"}), 404
+    vendor_id = request.args.get('vendor_id')
+    category = None
+    if vendor_id:
+        vendor = vendors.get(vendor_id)
+        if not vendor or program_of(vendor) != program_of(recipient):
+            return jsonify({"success": False, "message": "Vendor not approved for subsidy program"}), 404
+        category = vendor["category"]
+    amount = request.args.get('amount', 0, type=int)
+    response = jsonify(allowances.remaining(recipient_id, recipient, vendor_id, category, amount,
+                                            policy=programs.of(recipient).policy))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route('/api/vouchers', methods=['POST'])
+def api_issue_voucher():
+    """
+    Issue a signed voucher that vendors can check without reaching the server
+    
+    The cap defaults to, and can't exceed, what the recipient can spend now.
+    """
+    data = request.json or {}
+    recipient_id = data.get('recipient_id')
+    recipient = recipients.get(recipient_id)
+    if not recipient:
+        return jsonify({"success": False, "message": "Recipient not found"}), 404
+    
+    spendable = allowances.remaining(recipient_id, recipient)["spendable"]
+    try:
+        cap = min(int(data.get('cap') or spendable), spendable)
+        ttl = int(data.get('ttl') or VOUCHER_TTL)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "cap and ttl must be numbers"}), 400
+    if cap <= 0:
+        return jsonify({"success": False, "message": "Nothing left to spend today"}), 409
+    
+    categories = programs.of(recipient).policy.current().allowed_categories(recipient_id)
+    token, claims = voucher_book.issue(recipient_id, categories, cap, ttl)
+    audit("issue_voucher", outcome="ok", recipient_id=recipient_id, voucher_id=claims['jti'],
+          cap=cap, expires=claims['exp'])
+    return jsonify({"success": True, "voucher": token, "claims": claims}), 201
+
+@app.route('/api/vouchers/key')
+def api_voucher_key():
+    """How vendor software verifies vouchers offline"""
+    return jsonify(voucher_book.signer.describe())
+
+@app.route('/api/vouchers/redeem', methods=['POST'])
+def api_redeem_vouchers():
+    """Batch-submit voucher redemptions a vendor accepted offline"""
+    data = request.json or {}
+    vendor_id = data.get('vendor_id')
+    redemptions = data.get('redemptions')
+    if vendor_id not in vendors:
+        return jsonify({"success": False, "message": "Vendor not approved for subsidy program"}), 404
+    if not isinstance(redemptions, list) or not redemptions:
+        return jsonify({"success": False, "message": "No redemptions provided"}), 400
+    if len(redemptions) > VOUCHER_BATCH_MAX:
+        return jsonify({"success": False, "message": f"At most {VOUCHER_BATCH_MAX} redemptions per batch"}), 413
+    if not all(isinstance(item, dict) for item in redemptions):
+        return jsonify({"success": False, "message": "Each redemption must be an object"}), 400
+    
+    results = redeem_vouchers(vendor_id, redemptions)
+    redeemed = [result for result in results if result['status'] == "redeemed"]
+    audit("redeem_vouchers", outcome="ok", vendor_id=vendor_id, submitted=len(redemptions),
+          redeemed=len(redeemed), sats=sum(result['amount'] for result in redeemed))
+    return jsonify({"success": True, "results": results})
+
+@app.route('/api/payments/<job_id>')
+def api_payment_status(job_id):
+    job = payment_pipeline.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Payment job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/search/<kind>')
+def api_search(kind):
+    """Typeahead search over the recipient or vendor names of a program (?program=)"""
+    program = programs.get(request.args.get('program'))
+    if kind == 'recipients':
+        index, entities = program.recipient_index, recipients
+    elif kind == 'vendors':
+        index, entities = program.vendor_index, vendors
+    else:
+        return jsonify({"success": False, "message": "Unknown search"}), 404
+    
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid offset"}), 400
+    
+    page, more = search_page(index, entities,
+                             request.args.get('q', ''),
+                             request.args.get('category') or None,
+                             offset=offset,
+                             limit=page_size(request.args.get('limit')))
+    results = []
+    for entity_id, entity in page:
+        result = {"id": entity_id, "name": entity["name"], "wallet_id": entity["wallet_id"]}
+        if "category" in entity:
+            result["category"] = entity["category"]
+        results.append(result)
+    return jsonify({"results": results, "more": more, "next_offset": offset + len(results)})
+
+@app.route('/api/export/transactions.<export_format>')
+def api_export_transactions(export_format):
+    """
+    Stream a program's ledger (?program=) as CSV or NDJSON
+    
+    Filters: start, end, vendor_id, recipient_id, type. Resume an interrupted
+    export with the cursor of the last row received; add gzip=1 to download a
+    gzip file compressed on the fly.
+    """
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"success": False, "message": "Format must be csv or ndjson"}), 404
+    program = programs.get(request.args.get('program'))
+    
+    try:
+        export_filter = ExportFilter.from_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid export filter: {str(e)}"}), 400
+    
+    if export_format == 'csv':
+        body = stream_csv(program.ledger, export_filter)
+        mimetype = 'text/csv'
+    else:
+        body = stream_ndjson(program.ledger, export_filter)
+        mimetype = 'application/x-ndjson'
+    
+    filename = f"transactions.{export_format}"
+    if request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        body = gzip_stream(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    
+    response = app.response_class(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+@app.route('/events')
+def event_stream():
+    """Server-Sent Events feed of ledger changes, optionally for one program, vendor or recipient"""
+    subscriber = broker.subscribe(
+        vendor_id=request.args.get('vendor_id'),
+        recipient_id=request.args.get('recipient_id'),
+        program=request.args.get('program')
+    )
+    if not subscriber:
+        response = jsonify({"success": False, "message": "Too many live connections"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "30"
+        return response
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    response = app.response_class(broker.stream(subscriber, last_event_id), mimetype='text/event-stream')
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route('/api/admin/lnbits_status')
+def api_lnbits_status():
+    """Circuit breaker and admission control state for admins"""
+    return jsonify({
+        "breakers": breaker_status(),
+        "nodes": registry.stats(),
+        "admission": limiter.stats(),
+        "payment_jobs": payment_pipeline.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "events": broker.stats(),
+        "disbursements": disbursements.stats(),
+        "settlements": settlements.stats(),
+        "audit": audit_log.stats(),
+        "wallet_pool": wallet_pool.stats(),
+        "vouchers": voucher_book.stats(),
+        "bolt11": bolt11.stats(),
+        "velocity": velocity.stats(),
+        "ledger": {program.id: program.ledger.stats() for program in programs.local()},
+        "programs": programs.stats(),
+        "tracing": tracer.stats()
+    })
+
+@app.route('/api/admin/disbursements')
+def api_disbursements():
+    """Recurring funding plans and the history of their runs"""
+    disbursements.load_plans()
+    return jsonify({
+        "plans": [plan.to_dict() for plan in disbursements.plans.values()],
+        "runs": disbursements.history()
+    })
+
+@app.route('/api/admin/disbursements/<plan_id>/run', methods=['POST'])
+def api_run_disbursement(plan_id):
+    """Start (or resume) the plan's run for the current period right away"""
+    disbursements.load_plans()
+    if plan_id not in disbursements.plans:
+        return jsonify({"success": False, "message": "Plan not found"}), 404
+    try:
+        run = disbursements.trigger(plan_id)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 409
+    audit("run_disbursement", outcome="ok", plan_id=plan_id, run_id=run.id)
+    return jsonify({"success": True, "run": run.to_dict()}), 202
+
+@app.route('/api/admin/disbursements/runs/<run_id>')
+def api_disbursement_run(run_id):
+    run = disbursements.runs.get(run_id)
+    if not run:
+        return jsonify({"success": False, "message": "Run not found"}), 404
+    return jsonify({"run": run.to_dict(), "failures": run.failures()})
+
+@app.route('/api/admin/settlements')
+def api_settlements():
+    """Vendor payout sweeps, newest first; ?vendor_id= narrows to one vendor"""
+    return jsonify({
+        "stats": settlements.stats(),
+        "sweeps": settlements.history(request.args.get('vendor_id'))
+    })
+
+@app.route('/api/admin/vendors/<vendor_id>/payout', methods=['GET', 'POST'])
+def api_vendor_payout(vendor_id):
+    """Show or set where and when a vendor's balance is swept"""
+    vendor = vendors.get(vendor_id)
+    if not vendor:
+        return jsonify({"success": False, "message": "Vendor not found"}), 404
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            if "address" in data:
+                vendor["payout_address"] = validate_address(data["address"]) if data["address"] else None
+            if "threshold" in data:
+                threshold = int(data["threshold"]) if data["threshold"] else None
+                if threshold is not None and threshold <= 0:
+                    raise ValueError("Threshold must be positive")
+                vendor["payout_threshold"] = threshold
+        except (TypeError, ValueError) as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        audit("set_vendor_payout", outcome="ok", vendor_id=vendor_id,
+              payout_address=vendor.get("payout_address"), payout_threshold=vendor.get("payout_threshold"))
+    return jsonify({
+        "success": True,
+        "vendor_id": vendor_id,
+        "address": vendor.get("payout_address"),
+        "threshold": settlements.threshold(vendor),
+        "received_since_sweep": settlements.received.get(vendor_id, 0),
+        "last_window": settlements.settled.get(vendor_id)
+    })
+
+@app.route('/api/admin/settlements/<vendor_id>/sweep', methods=['POST'])
+def api_sweep_vendor(vendor_id):
+    """Sweep a vendor now; this is its payout for the current window"""
+    vendor = vendors.get(vendor_id)
+    if not vendor:
+        return jsonify({"success": False, "message": "Vendor not found"}), 404
+    if not vendor.get("payout_address"):
+        return jsonify({"success": False, "message": "Vendor has no payout address"}), 409
+    window = settlements.window()
+    if settlements.settled.get(vendor_id, -1) >= window:
+        return jsonify({"success": False, "message": "Vendor was already paid out this window"}), 409
+    if not settlements.submit(vendor_id, window):
+        return jsonify({"success": False, "message": "A sweep of this vendor is running"}), 409
+    audit("sweep_vendor", outcome="queued", vendor_id=vendor_id, window=window)
+    return jsonify({"success": True, "vendor_id": vendor_id, "window": window}), 202
+
+@app.route('/api/admin/velocity')
+def api_velocity():
+    """
+    Recently flagged or blocked payments, newest first; ?recipient_id= or
+    ?vendor_id= also shows that entity's current windows
+    """
+    result = {"stats": velocity.stats(), "flags": velocity.recent_flags()}
+    if request.args.get('recipient_id'):
+        result["recipient"] = velocity.windows("recipient", request.args['recipient_id'])
+    if request.args.get('vendor_id'):
+        result["vendor"] = velocity.windows("vendor", request.args['vendor_id'])
+    return jsonify(result)
+
+@app.route('/api/admin/memory', methods=['GET', 'POST'])
+def api_memory():
+    """
+    Memory per structure, top allocation sites and growth since the last report
+    
+    GET ?force=1 skips the cached report. POST {"trace": true|false} starts or
+    stops tracemalloc, which allocation sites need.
+    """
+    if request.method == 'POST':
+        trace = bool((request.json or {}).get('trace'))
+        if trace:
+            memory_diagnostics.start_tracing()
+        else:
+            memory_diagnostics.stop_tracing()
+        audit("memory_tracing", outcome="ok", trace=trace)
+    force = request.method == 'POST' or request.args.get('force', '').lower() in ["true", "1", "t"]
+    return jsonify(memory_diagnostics.report(force=force))
+
+@app.route('/api/admin/traces')
+def api_traces():
+    """
+    Recently kept traces, newest first, with their spans
+    
+    GET ?trace_id=<id> looks one up by the id returned in X-Trace-Id;
+    ?limit=<n> caps the list (default 20).
+    """
+    limit = max(1, min(request.args.get('limit', 20, type=int), 1000))
+    return jsonify({
+        "stats": tracer.stats(),
+        "traces": tracer.recent_traces(limit, request.args.get('trace_id'))
+    })
+
+@app.route('/api/admin/ledger', methods=['GET', 'POST'])
+def api_ledger():
+    """A program's ledger partitions (?program=); POST archives and expires partitions right away"""
+    program = programs.get(request.args.get('program'))
+    if request.method == 'POST':
+        result = program.ledger.maintain()
+        fragment_cache.bump("transactions")
+        audit("ledger_maintenance", outcome="ok", program=program.id, **result)
+        return jsonify(dict(result, ledger=program.ledger.stats()))
+    return jsonify(program.ledger.stats())
+
+@app.route('/api/programs')
+def api_programs():
+    """The programs, the worker each is placed on, and which this worker serves"""
+    return jsonify({"worker": programs.worker or None, "programs": programs.stats()})
+
+@app.route('/api/admin/wallet_pool')
+def api_wallet_pool():
+    """Pre-provisioned onboarding wallets per LNbits node"""
+    return jsonify(wallet_pool.stats())
+
+@app.route('/api/admin/policy', methods=['GET', 'POST'])
+def api_policy():
+    """
+    Show a program's compiled spending policy (?program=); POST forces a reload
+    from disk and says whether a new policy was loaded
+    """
+    program = programs.get(request.args.get('program'))
+    if request.method == 'POST':
+        reloaded = program.policy.reload(force=True)
+        return jsonify(dict(program.policy.describe(), reloaded=reloaded))
+    return jsonify(program.policy.describe())
+
 @app.route('/vendor/<vendor_id>')
 def vendor_dashboard(vendor_id):
     """Route to display vendor dashboard"""
@@ -559,6 +1895,7 @@ def vendor_dashboard(vendor_id):
             return redirect(url_for('index'))
         
         # Get vendor's wallet balance
+        estimated = False
         try:
             # Try to get the balance from LNbits
             balance = get_wallet_balance(vendor['adminkey'])
@@ -567,21 +1904,18 @@ def vendor_dashboard(vendor_id):
             print(f"Error getting wallet balance: {str(e)}")
             
             # Fall back to calculating balance from transactions
-            received = sum(t["amount"] for t in transactions 
-                         if t["vendor_id"] == vendor_id 
-                         and t["type"] == "payment" 
-                         and t["status"] == "complete")
-            
-            balance = received
+            balance = ledger_vendor_balance(vendor_id)
+            estimated = True
             print(f"Calculated balance from transactions: {balance} sats")
         
         # Get vendor's transactions
-        vendor_transactions = [t for t in transactions if t["vendor_id"] == vendor_id]
+        vendor_transactions = [t for t in programs.of(vendor).ledger.hot() if t["vendor_id"] == vendor_id]
         
         return render_template('vendor/dashboard.html',
                               vendor=vendor,
                               vendor_id=vendor_id,
                               balance=balance,
+                              estimated=estimated,
                               vendor_transactions=vendor_transactions,
                               recipients=recipients)
     except Exception as e:
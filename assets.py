@@ -0,0 +1,76 @@
+# assets.py
+import json
+import mimetypes
+import os
+
+from flask import abort, request, send_from_directory, url_for
+
+from build_assets import DIST_DIR, MANIFEST
+
+# One year; fingerprinted names change whenever the content does
+IMMUTABLE_MAX_AGE = 31536000
+
+# Precompressed variants in order of preference
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+class Assets:
+    """
+    Serves fingerprinted, precompressed assets produced by build_assets.py.
+
+    Templates keep calling url_for('static', filename=...); when the asset is
+    in the manifest the URL points at its fingerprinted copy under /assets/,
+    which is served with immutable one-year caching and br/gzip negotiation.
+    Without a build, URLs fall back to Flask's static handler.
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.dist_dir = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.dist_dir = os.path.join(app.static_folder, DIST_DIR)
+        self.load_manifest()
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.context_processor(lambda: {"url_for": self.url_for})
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST), 'r') as f:
+                self.manifest = json.load(f)
+            print(f"Loaded asset manifest with {len(self.manifest)} entries")
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+
+    def url_for(self, endpoint, **values):
+        """url_for that emits fingerprinted names for static assets"""
+        if endpoint == 'static':
+            hashed = self.manifest.get(values.get('filename'))
+            if hashed:
+                values['filename'] = hashed
+                endpoint = 'assets'
+        return url_for(endpoint, **values)
+
+    def serve(self, filename):
+        if not self.dist_dir or filename == MANIFEST:
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accepted = request.accept_encodings
+        path = filename
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if accepted[name] and os.path.isfile(os.path.join(self.dist_dir, filename + suffix)):
+                path = filename + suffix
+                encoding = name
+                break
+
+        response = send_from_directory(self.dist_dir, path, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,242 @@
+# audit.py
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+AUDIT_LOG = os.getenv("AUDIT_LOG", "audit.log")
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "True").lower() in ["true", "1", "t"]
+# Most entries written with one fsync
+AUDIT_BATCH_MAX = int(os.getenv("AUDIT_BATCH_MAX", "1000"))
+# Entries waiting for the writer; when full, requests wait instead of losing entries
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "100000"))
+
+# The "previous hash" of the first entry
+GENESIS = "0" * 64
+
+# Each line is "<hash> <entry JSON>", where hash is the SHA-256 hex digest of
+# the previous line's hash followed by the entry JSON exactly as written.
+# Editing, inserting or removing a line breaks every hash after it.
+
+
+def chain_hash(previous: str, body: bytes) -> str:
+    return hashlib.sha256(previous.encode() + body).hexdigest()
+
+
+def read_head(path: str) -> Tuple[int, str]:
+    """
+    Returns the sequence number and hash of the last entry of a log, reading
+    only its tail, or (0, GENESIS) for a missing or empty log.
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            block = 4096
+            while True:
+                start = max(0, end - block)
+                f.seek(start)
+                tail = f.read(end - start)
+                lines = tail.rstrip(b"\n").split(b"\n")
+                if len(lines) > 1 or start == 0:
+                    break
+                block *= 2
+    except FileNotFoundError:
+        return 0, GENESIS
+    last = lines[-1]
+    if not last:
+        return 0, GENESIS
+    digest, _, body = last.partition(b" ")
+    return json.loads(body)["seq"], digest.decode()
+
+
+def verify_file(path: str, expected_head: Optional[str] = None) -> dict:
+    """
+    Streams through a log and recomputes the chain.
+
+    Only the hashes are checked line by line, which is what makes this fast;
+    entries are parsed just to report where a break is.
+
+    Returns:
+        - a dict with ok, entries, head and, if the chain is broken, line and error
+    """
+    previous = GENESIS
+    count = 0
+    with open(path, 'rb', buffering=1 << 20) as f:
+        for count, line in enumerate(f, start=1):
+            digest, _, body = line.rstrip(b"\n").partition(b" ")
+            if hashlib.sha256(previous.encode() + body).hexdigest().encode() != digest:
+                try:
+                    seq = json.loads(body).get("seq")
+                except ValueError:
+                    seq = None
+                return {"ok": False, "entries": count - 1, "head": previous, "line": count,
+                        "seq": seq, "error": "hash mismatch"}
+            previous = digest.decode()
+    if expected_head and previous != expected_head:
+        return {"ok": False, "entries": count, "head": previous, "line": None, "seq": None,
+                "error": f"log ends at {previous}, expected {expected_head} (truncated?)"}
+    return {"ok": True, "entries": count, "head": previous}
+
+
+def trim_torn_tail(path: str) -> int:
+    """
+    Drops a last line cut short by a crash. It was never fsynced, so no
+    request was told it was durable. Returns the number of bytes dropped.
+    """
+    try:
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            position = end
+            while position > 0:
+                step = min(4096, position)
+                f.seek(position - step)
+                block = f.read(step)
+                newline = block.rfind(b"\n")
+                if newline != -1:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            if position < end:
+                f.truncate(position)
+            return end - position
+    except FileNotFoundError:
+        return 0
+
+
+class AuditLog:
+    """
+    A tamper-evident, append-only log of admin and payment actions.
+
+    record() only puts the entry on a queue, so requests never wait for the
+    disk. A writer thread takes everything queued, chains and appends it, and
+    makes it durable with a single fsync (group commit); entries queued while
+    that fsync runs form the next batch. The hashes are computed by the writer,
+    so the chain follows the order entries reach the file.
+
+    Entries still queued when the process dies are lost; flush() waits until
+    everything recorded so far is on disk.
+    """
+
+    def __init__(self, path: str = AUDIT_LOG, batch_max: int = AUDIT_BATCH_MAX,
+                 queue_max: int = AUDIT_QUEUE_MAX, enabled: bool = AUDIT_ENABLED):
+        self.path = path
+        self.batch_max = max(1, batch_max)
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._done = threading.Condition()
+        self._recorded = 0
+        self._written = 0
+        self._batches = 0
+        self._fsync_seconds = 0.0
+        self._errors = 0
+        self._last_error = None
+        self._thread = None
+        self.seq, self.head = 0, GENESIS
+        if enabled:
+            dropped = trim_torn_tail(path)
+            if dropped:
+                print(f"Dropped {dropped} bytes of an unfinished audit entry from {path}")
+            self.seq, self.head = read_head(path)
+
+    def record(self, action: str, actor: Optional[str] = None, **details):
+        """Queues an entry; blocks only if the writer fell AUDIT_QUEUE_MAX entries behind"""
+        if not self.enabled:
+            return
+        entry = dict(details, action=action, actor=actor, ts=datetime.now().isoformat())
+        with self._done:
+            self._recorded += 1
+        self._queue.put(entry)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._done:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._writer, name="audit-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Waits until every entry recorded so far is written; False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._done:
+            target = self._recorded
+            while self._written < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+        return True
+
+    def _writer(self):
+        with open(self.path, 'ab') as f:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.batch_max:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                while not self._commit(f, batch):
+                    time.sleep(1)
+
+    def _commit(self, f, batch: list) -> bool:
+        seq, head = self.seq, self.head
+        lines = []
+        for entry in batch:
+            seq += 1
+            entry["seq"] = seq
+            body = json.dumps(entry, sort_keys=True, separators=(",", ":"), default=str).encode()
+            head = chain_hash(head, body)
+            lines.append(head.encode() + b" " + body + b"\n")
+        offset = f.tell()
+        try:
+            f.write(b"".join(lines))
+            f.flush()
+            started = time.monotonic()
+            os.fsync(f.fileno())
+            fsync_seconds = time.monotonic() - started
+        except OSError as e:
+            # Cut off whatever part of the batch made it, so the chain stays intact
+            print(f"Error writing audit log, retrying: {str(e)}")
+            self._errors += 1
+            self._last_error = str(e)
+            try:
+                f.truncate(offset)
+                f.seek(offset)
+            except OSError:
+                pass
+            return False
+        with self._done:
+            self.seq, self.head = seq, head
+            self._written += len(batch)
+            self._batches += 1
+            self._fsync_seconds += fsync_seconds
+            self._done.notify_all()
+        return True
+
+    def stats(self) -> dict:
+        with self._done:
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "seq": self.seq,
+                "head": self.head,
+                "queued": self._recorded - self._written,
+                "batches": self._batches,
+                "avg_batch": round(self._written / self._batches, 1) if self._batches else 0.0,
+                "avg_fsync_ms": round(self._fsync_seconds * 1000 / self._batches, 2) if self._batches else 0.0,
+                "errors": self._errors,
+                "last_error": self._last_error,
+            }
+
+
+audit_log = AuditLog()
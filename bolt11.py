@@ -0,0 +1,260 @@
+# bolt11.py
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+# Decoded invoices kept, both by invoice string and by payment hash
+BOLT11_CACHE_SIZE = int(os.getenv("BOLT11_CACHE_SIZE", "10000"))
+# Check invoices locally when they are created, paid and recorded
+BOLT11_VERIFY = os.getenv("BOLT11_VERIFY", "True").lower() in ["true", "1", "t"]
+
+CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+_CHARSET_REV = {char: value for value, char in enumerate(CHARSET)}
+_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+
+# ln + currency (mainnet, testnet, signet, regtest, simnet) + optional amount and multiplier
+_HRP = re.compile(r"^ln(bcrt|bc|tbs|tb|sb)(\d*)([munp]?)$")
+# Millisatoshis per unit of the amount, by multiplier (1 BTC = 10^11 msat)
+_MSAT_PER_UNIT = {"": 10 ** 11, "m": 10 ** 8, "u": 10 ** 5, "n": 10 ** 2}
+_HASH_GROUPS = 52         # 256 bits in 5-bit groups
+_SIGNATURE_GROUPS = 104   # 520 bits: 64-byte signature and recovery id
+DEFAULT_EXPIRY = 3600
+
+
+class Bolt11Error(ValueError):
+    """Raised when an invoice can't be decoded or doesn't match what was expected"""
+
+
+@dataclass(frozen=True)
+class DecodedInvoice:
+    """The fields of a BOLT11 invoice the app checks"""
+    payment_request: str
+    currency: str
+    amount_msat: Optional[int]
+    timestamp: int
+    expiry: int
+    payment_hash: str
+    description: Optional[str] = None
+    description_hash: Optional[str] = None
+    payee: Optional[str] = None
+
+    @property
+    def amount_sat(self) -> Optional[int]:
+        return None if self.amount_msat is None else self.amount_msat // 1000
+
+    @property
+    def expires_at(self) -> int:
+        return self.timestamp + self.expiry
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) >= self.expires_at
+
+
+def _polymod(values: List[int]) -> int:
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                checksum ^= _GENERATOR[i]
+    return checksum
+
+
+def _hrp_expand(hrp: str) -> List[int]:
+    return [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+
+
+def _to_int(groups: List[int]) -> int:
+    value = 0
+    for group in groups:
+        value = value << 5 | group
+    return value
+
+
+def _to_bytes(groups: List[int]) -> bytes:
+    """5-bit groups to bytes, dropping the padding bits"""
+    value = _to_int(groups)
+    bits = len(groups) * 5
+    return (value >> (bits % 8)).to_bytes(bits // 8, "big")
+
+
+def _from_bytes(data: bytes) -> List[int]:
+    """Bytes to 5-bit groups, zero-padded at the end"""
+    bits = len(data) * 8
+    padding = -bits % 5
+    value = int.from_bytes(data, "big") << padding
+    return _from_int(value, (bits + padding) // 5)
+
+
+def _from_int(value: int, groups: int) -> List[int]:
+    return [(value >> (5 * (groups - 1 - i))) & 31 for i in range(groups)]
+
+
+@lru_cache(maxsize=BOLT11_CACHE_SIZE)
+def decode(payment_request: str) -> DecodedInvoice:
+    """
+    Decodes a BOLT11 invoice; repeated calls with the same invoice are served
+    from an LRU cache.
+
+    The bech32 checksum and the fields are checked, the node's signature is
+    not: LNbits checks it when paying, and the app only uses the decoded
+    fields to compare with what it asked for or was told.
+
+    Raises:
+        - Bolt11Error if the invoice is malformed
+    """
+    invoice = payment_request.strip().lower()
+    if invoice.startswith("lightning:"):
+        invoice = invoice[len("lightning:"):]
+    separator = invoice.rfind("1")
+    if separator < 1 or len(invoice) - separator - 1 < 7 + _SIGNATURE_GROUPS + 6:
+        raise Bolt11Error("Not a BOLT11 invoice")
+    hrp = invoice[:separator]
+    try:
+        data = [_CHARSET_REV[char] for char in invoice[separator + 1:]]
+    except KeyError:
+        raise Bolt11Error("Invalid character in invoice")
+    if _polymod(_hrp_expand(hrp) + data) != 1:
+        raise Bolt11Error("Invoice checksum mismatch")
+
+    match = _HRP.match(hrp)
+    if not match:
+        raise Bolt11Error(f"Unknown invoice prefix '{hrp}'")
+    currency, amount, multiplier = match.groups()
+    amount_msat = None
+    if amount:
+        if multiplier == "p":
+            if int(amount) % 10:
+                raise Bolt11Error("Invoice amount is not a whole millisatoshi")
+            amount_msat = int(amount) // 10
+        else:
+            amount_msat = int(amount) * _MSAT_PER_UNIT[multiplier]
+    elif multiplier:
+        raise Bolt11Error("Invoice multiplier without an amount")
+
+    data = data[:-6]
+    fields = data[7:-_SIGNATURE_GROUPS]
+    tags = {}
+    position = 0
+    while position + 3 <= len(fields):
+        tag = CHARSET[fields[position]]
+        length = fields[position + 1] << 5 | fields[position + 2]
+        value = fields[position + 3:position + 3 + length]
+        if len(value) != length:
+            raise Bolt11Error("Truncated invoice field")
+        position += 3 + length
+        # Only the first of a field counts; unknown and wrongly sized ones are skipped (BOLT11)
+        if tag in ("p", "h") and length != _HASH_GROUPS or tag == "n" and length != 53:
+            continue
+        tags.setdefault(tag, value)
+    if "p" not in tags:
+        raise Bolt11Error("Invoice has no payment hash")
+
+    return DecodedInvoice(
+        payment_request=invoice,
+        currency=currency,
+        amount_msat=amount_msat,
+        timestamp=_to_int(data[:7]),
+        expiry=_to_int(tags["x"]) if "x" in tags else DEFAULT_EXPIRY,
+        payment_hash=_to_bytes(tags["p"]).hex(),
+        description=_to_bytes(tags["d"]).decode("utf-8", "replace") if "d" in tags else None,
+        description_hash=_to_bytes(tags["h"]).hex() if "h" in tags else None,
+        payee=_to_bytes(tags["n"]).hex() if "n" in tags else None,
+    )
+
+
+def encode(amount_msat: Optional[int], payment_hash: str, description: str = "",
+           timestamp: Optional[int] = None, expiry: int = DEFAULT_EXPIRY, currency: str = "bcrt") -> str:
+    """
+    Encodes an unsigned invoice (the signature is all zeros). For test
+    backends such as lnbits_standin.py, which don't sign; real nodes do.
+    """
+    amount = ""
+    if amount_msat is not None:
+        for multiplier in ("", "m", "u", "n"):
+            if amount_msat % _MSAT_PER_UNIT[multiplier] == 0:
+                amount = f"{amount_msat // _MSAT_PER_UNIT[multiplier]}{multiplier}"
+                break
+        else:
+            amount = f"{amount_msat * 10}p"
+    hrp = f"ln{currency}{amount}"
+
+    def field(tag: str, groups: List[int]) -> List[int]:
+        return [_CHARSET_REV[tag], len(groups) >> 5, len(groups) & 31] + groups
+
+    expiry_groups = _from_int(expiry, max(1, (expiry.bit_length() + 4) // 5))
+    data = (_from_int(timestamp if timestamp is not None else int(time.time()), 7)
+            + field("p", _from_bytes(bytes.fromhex(payment_hash)))
+            + field("d", _from_bytes(description.encode()))
+            + field("x", expiry_groups)
+            + [0] * _SIGNATURE_GROUPS)
+    checksum = _polymod(_hrp_expand(hrp) + data + [0] * 6) ^ 1
+    data += [(checksum >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(CHARSET[value] for value in data)
+
+
+# Invoices this app created or paid, by payment hash, so a payment hash alone
+# can be checked. Invoices that were only decoded are not trusted this way.
+_by_hash: OrderedDict = OrderedDict()
+_by_hash_lock = threading.Lock()
+
+
+def remember(invoice: DecodedInvoice) -> DecodedInvoice:
+    """Indexes an invoice LNbits created or paid for this app, for lookup()"""
+    with _by_hash_lock:
+        _by_hash[invoice.payment_hash] = invoice
+        _by_hash.move_to_end(invoice.payment_hash)
+        while len(_by_hash) > BOLT11_CACHE_SIZE:
+            _by_hash.popitem(last=False)
+    return invoice
+
+
+def lookup(payment_hash: str) -> Optional[DecodedInvoice]:
+    """The invoice with this payment hash, if this app created or paid it recently"""
+    with _by_hash_lock:
+        return _by_hash.get(payment_hash.lower())
+
+
+def check(payment_request: str, amount: Optional[int] = None, payment_hash: Optional[str] = None,
+          allow_expired: bool = False) -> DecodedInvoice:
+    """
+    Decodes an invoice and checks it against what the caller expects.
+
+    Args:
+        - amount (int, optional): sats the invoice must be for
+        - payment_hash (str, optional): the payment hash it must carry
+        - allow_expired (bool): accept an expired invoice, e.g. when
+            recording a payment made before it expired
+
+    Raises:
+        - Bolt11Error if the invoice is malformed, expired or doesn't match
+    """
+    invoice = decode(payment_request)
+    if amount is not None and invoice.amount_msat != amount * 1000:
+        found = "no amount" if invoice.amount_msat is None else f"{invoice.amount_msat / 1000:g} sats"
+        raise Bolt11Error(f"Invoice is for {found}, expected {amount} sats")
+    if payment_hash is not None and invoice.payment_hash != payment_hash.lower():
+        raise Bolt11Error("Invoice payment hash does not match")
+    if not allow_expired and invoice.expired():
+        raise Bolt11Error("Invoice has expired")
+    return invoice
+
+
+def stats() -> dict:
+    info = decode.cache_info()
+    with _by_hash_lock:
+        indexed = len(_by_hash)
+    return {
+        "verify": BOLT11_VERIFY,
+        "hits": info.hits,
+        "misses": info.misses,
+        "cached": info.currsize,
+        "by_hash": indexed,
+        "max_size": BOLT11_CACHE_SIZE,
+    }
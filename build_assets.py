@@ -0,0 +1,95 @@
+# build_assets.py
+"""
+Build step for static assets.
+
+Copies every file under static/ to static/dist/ with a content hash in its
+name (css/style.css -> css/style.3f2a9c1b04de.css), writes gzip and, if the
+brotli package is installed, brotli versions next to it, and records the
+mapping in static/dist/manifest.json for assets.url_for.
+
+Usage:
+    python build_assets.py [static_dir]
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_DIR = "dist"
+MANIFEST = "manifest.json"
+HASH_LENGTH = 12
+
+# Formats that are already compressed gain nothing from another pass
+COMPRESSIBLE = {".css", ".js", ".svg", ".html", ".json", ".txt", ".map", ".xml", ".ico"}
+
+
+def fingerprint(path: str) -> str:
+    """Returns the first HASH_LENGTH hex digits of the file's SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(relative_path: str, digest: str) -> str:
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{digest}{ext}"
+
+
+def build(static_dir: str) -> dict:
+    """
+    Fingerprints and precompresses every asset under static_dir.
+
+    Returns:
+        dict: the manifest, logical path -> fingerprinted path
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        # Never fingerprint our own output
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_dir]
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            target_name = hashed_name(logical, fingerprint(source))
+            target = os.path.join(dist_dir, target_name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            manifest[logical] = target_name
+
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            # mtime=0 keeps the .gz output byte-identical between builds
+            with open(target + ".gz", 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(target + ".br", 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    static_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "static")
+    manifest = build(static_dir)
+    print(f"Fingerprinted {len(manifest)} assets into {os.path.join(static_dir, DIST_DIR)}"
+          f" (brotli {'enabled' if brotli else 'not installed'})")
@@ -0,0 +1,68 @@
+# capture.py
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+
+CAPTURE_REQUESTS = os.getenv("CAPTURE_REQUESTS", "False").lower() in ["true", "1", "t"]
+CAPTURE_FILE = os.getenv("CAPTURE_FILE", "traffic.jsonl")
+
+# Long-lived streams and asset downloads say nothing about the load shape
+CAPTURE_SKIP_PREFIXES = ("/static/", "/assets/", "/events")
+
+
+class TrafficCapture:
+    """
+    Records incoming requests as JSON lines for replay.py.
+
+    Each line holds the arrival time, method, path, query string, matched
+    route, form or JSON body, response status and server-side duration.
+    Capture is opt-in through CAPTURE_REQUESTS.
+    """
+
+    def __init__(self, app=None, path: str = CAPTURE_FILE, enabled: bool = CAPTURE_REQUESTS):
+        self.path = path
+        self.enabled = enabled
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._file = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        self._file = open(self.path, 'a', buffering=1)
+        app.before_request(self._start)
+        app.after_request(self._record)
+        print(f"Capturing requests to {self.path}")
+
+    def _start(self):
+        g.capture_started = time.time()
+        g.capture_perf = time.perf_counter()
+
+    def _record(self, response):
+        if request.path.startswith(CAPTURE_SKIP_PREFIXES) or "capture_started" not in g:
+            return response
+
+        entry = {
+            "ts": g.capture_started,
+            "method": request.method,
+            "path": request.path,
+            "query": request.query_string.decode("utf-8", "replace"),
+            "route": request.url_rule.rule if request.url_rule else None,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - g.capture_perf) * 1000, 3),
+        }
+        if request.is_json:
+            entry["json"] = request.get_json(silent=True)
+        elif request.form:
+            entry["form"] = {key: request.form.getlist(key) for key in request.form}
+
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self.recorded += 1
+        return response
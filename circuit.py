@@ -0,0 +1,201 @@
+# circuit.py
+import os
+import threading
+import time
+from typing import Dict, Any, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from tracing import tracer
+
+# Per-operation deadlines in seconds, passed to requests as the timeout
+OPERATION_TIMEOUTS = {
+    "get_wallet": float(os.getenv("LNBITS_TIMEOUT_READ", "3")),
+    "list_payments": float(os.getenv("LNBITS_TIMEOUT_READ", "3")),
+    "create_invoice": float(os.getenv("LNBITS_TIMEOUT_INVOICE", "5")),
+    "pay_invoice": float(os.getenv("LNBITS_TIMEOUT_PAY", "15")),
+    "create_account": float(os.getenv("LNBITS_TIMEOUT_ACCOUNT", "5")),
+    "create_wallet": float(os.getenv("LNBITS_TIMEOUT_ACCOUNT", "5")),
+    "rename_wallet": float(os.getenv("LNBITS_TIMEOUT_ACCOUNT", "5")),
+}
+DEFAULT_TIMEOUT = float(os.getenv("LNBITS_TIMEOUT_DEFAULT", "5"))
+
+FAILURE_THRESHOLD = int(os.getenv("LNBITS_BREAKER_FAILURES", "5"))
+RESET_TIMEOUT = float(os.getenv("LNBITS_BREAKER_RESET", "30"))
+
+# Breakers are kept per LNbits node, so one node going down leaves the others usable
+DEFAULT_NODE = "default"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class LNbitsUnavailable(Exception):
+    """Raised when an LNbits call timed out, could not connect or returned a 5xx"""
+
+
+class CircuitOpen(LNbitsUnavailable):
+    """
+    Raised without contacting LNbits while the breaker of an endpoint is open.
+
+    Attributes:
+        - operation (str): the LNbits operation that was refused
+        - retry_after (float): seconds until the breaker lets a probe through
+    """
+
+    def __init__(self, operation: str, retry_after: float):
+        super().__init__(
+            f"LNbits is unavailable ({operation} circuit open), "
+            f"retry in {max(1, int(retry_after))}s"
+        )
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    A per-endpoint circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls
+    fail immediately. Once `reset_timeout` seconds have passed a single probe is
+    let through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, operation: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT, node: str = DEFAULT_NODE):
+        self.operation = operation
+        self.node = node
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self.total_failures = 0
+        self.total_rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpen if the call must not reach LNbits"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.total_rejected += 1
+            raise CircuitOpen(self.operation, max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"LNbits circuit for {self.operation} on {self.node} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = error
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"LNbits circuit for {self.operation} on {self.node} opened: {error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == OPEN and time.monotonic() < self.opened_at + self.reset_timeout
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == OPEN:
+                retry_in = max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+            return {
+                "operation": self.operation,
+                "node": self.node,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected,
+                "retry_in": round(retry_in, 1),
+                "last_error": self.last_error,
+            }
+
+
+breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(operation: str, node: str = DEFAULT_NODE) -> CircuitBreaker:
+    """Returns the breaker of an LNbits endpoint on a node, creating it on first use"""
+    with _breakers_lock:
+        breaker = breakers.get((operation, node))
+        if breaker is None:
+            breaker = breakers[(operation, node)] = CircuitBreaker(operation, node=node)
+        return breaker
+
+
+def guarded_request(operation: str, method: str, url: str, node: str = DEFAULT_NODE,
+                    **kwargs) -> requests.Response:
+    """
+    Makes an LNbits HTTP request with the operation's deadline, behind its breaker.
+    The call is a trace span, and the trace id is sent along in the headers.
+
+    Args:
+        - operation (str): the LNbits operation, e.g. "pay_invoice"
+        - method (str): the HTTP method
+        - url (str): the request URL
+        - node (str): the name of the LNbits node the URL belongs to
+        - kwargs: passed through to requests.request
+
+    Returns:
+        - the Response; 4xx responses are returned to the caller as before
+
+    Raises:
+        - CircuitOpen if the endpoint's breaker is open
+        - LNbitsUnavailable on timeouts, connection errors and 5xx responses
+    """
+    breaker = get_breaker(operation, node)
+    kwargs.setdefault("timeout", OPERATION_TIMEOUTS.get(operation, DEFAULT_TIMEOUT))
+    with tracer.span(f"lnbits.{operation}", node=node, method=method, path=urlsplit(url).path) as span:
+        breaker.before_call()
+        # Let LNbits logs be matched to the request that caused the call
+        kwargs["headers"] = tracer.headers(kwargs.get("headers"))
+        try:
+            response = requests.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            breaker.record_failure(str(e))
+            raise LNbitsUnavailable(f"LNbits {operation} failed: {str(e)}") from e
+        span.set(status=response.status_code)
+        if response.status_code >= 500:
+            error = f"LNbits {operation} returned {response.status_code}"
+            breaker.record_failure(error)
+            raise LNbitsUnavailable(f"{error}: {response.text}")
+        breaker.record_success()
+        return response
+
+
+def breaker_status() -> list:
+    """Returns a snapshot of every breaker for the admin status view"""
+    with _breakers_lock:
+        current = list(breakers.values())
+    return [breaker.snapshot() for breaker in current]
+
+
+def payments_available(*nodes: str) -> bool:
+    """Whether neither payment endpoint is known to be down on any of the given nodes"""
+    for node in nodes or (DEFAULT_NODE,):
+        if get_breaker("create_invoice", node).is_open() or get_breaker("pay_invoice", node).is_open():
+            return False
+    return True
@@ -0,0 +1,105 @@
+# compression.py
+import os
+import zlib
+
+from flask import request
+
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "500"))
+COMPRESS_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/csv",
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+}
+
+# wbits=31 makes zlib write a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class Compress:
+    """
+    gzip-compresses HTML and JSON responses.
+
+    Buffered responses are compressed when they are at least `min_size` bytes.
+    Streamed responses (stream_template, generators) are compressed chunk by
+    chunk, with a sync flush after every chunk so the client still receives
+    each one as soon as it is produced. Responses that already carry a
+    Content-Encoding, such as precompressed assets, are left alone.
+    """
+
+    def __init__(self, app=None, level: int = COMPRESS_LEVEL, min_size: int = COMPRESS_MIN_SIZE,
+                 mimetypes=None):
+        self.level = level
+        self.min_size = min_size
+        self.mimetypes = set(mimetypes or COMPRESS_MIMETYPES)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def _should_compress(self, response) -> bool:
+        if self.level <= 0:
+            return False
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if "Content-Encoding" in response.headers:
+            return False
+        if response.direct_passthrough:
+            # send_file responses stream a file handle; leave them to the asset build
+            return False
+        if response.mimetype not in self.mimetypes:
+            return False
+        if "no-transform" in response.headers.get("Cache-Control", ""):
+            return False
+        return bool(request.accept_encodings["gzip"])
+
+    def after_request(self, response):
+        if not self._should_compress(response):
+            return response
+
+        if response.is_streamed:
+            response.response = gzip_stream(response.response, self.level)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS)
+            response.set_data(compressor.compress(data) + compressor.flush())
+
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        if response.headers.get("ETag"):
+            # The compressed body differs byte-wise from the identity one
+            etag, weak = response.get_etag()
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def gzip_stream(chunks, level: int = COMPRESS_LEVEL):
+    """
+    gzip-compresses an iterable of str or bytes chunks lazily.
+
+    Each chunk is followed by a sync flush so it reaches the client without
+    waiting for the rest of the stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if not chunk:
+                continue
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
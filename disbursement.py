@@ -0,0 +1,493 @@
+# disbursement.py
+import calendar
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from ratelimit import Overloaded
+
+# Plans are a JSON list, e.g.
+#     [{"id": "food-monthly", "group": "food", "amount": 5000,
+#       "frequency": "monthly", "day": 1, "hour": 6}]
+# "group" matches the recipient's group; "*" means every recipient.
+DISBURSE_PLANS_FILE = os.getenv("DISBURSE_PLANS_FILE", "disbursements.json")
+DISBURSE_JOURNAL = os.getenv("DISBURSE_JOURNAL", "disbursements.journal")
+DISBURSE_SCHEDULER = os.getenv("DISBURSE_SCHEDULER", "True").lower() in ["true", "1", "t"]
+DISBURSE_CHUNK_SIZE = int(os.getenv("DISBURSE_CHUNK_SIZE", "50"))
+DISBURSE_CONCURRENCY = int(os.getenv("DISBURSE_CONCURRENCY", "4"))
+DISBURSE_MAX_ATTEMPTS = int(os.getenv("DISBURSE_MAX_ATTEMPTS", "3"))
+DISBURSE_TICK = float(os.getenv("DISBURSE_TICK", "60"))
+DISBURSE_HISTORY = int(os.getenv("DISBURSE_HISTORY", "100"))
+# How long a payment refused by admission control keeps being retried, in seconds.
+# Every funding uses the admin wallet, so LNBITS_WALLET_RATE paces a run.
+DISBURSE_OVERLOAD_WAIT = float(os.getenv("DISBURSE_OVERLOAD_WAIT", "120"))
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+PAID = "paid"
+FAILED = "failed"
+
+RUNNING = "running"
+INCOMPLETE = "incomplete"
+COMPLETE = "complete"
+
+
+class InsufficientFunds(Exception):
+    """Raised when no admin wallet can cover a funding payment"""
+
+
+class DisbursementPlan:
+    """
+    A recurring funding plan: `amount` sats to every recipient in `group`,
+    once per day, week (on `weekday`, 0 is Monday) or month (on `day`),
+    from `hour` o'clock on.
+    """
+
+    def __init__(self, plan_id: str, group: str, amount: int, frequency: str = "monthly",
+                 day: int = 1, weekday: int = 0, hour: int = 0, enabled: bool = True):
+        if amount <= 0:
+            raise ValueError(f"Plan {plan_id}: amount must be positive")
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Plan {plan_id}: frequency must be one of {', '.join(FREQUENCIES)}")
+        self.id = plan_id
+        self.group = group
+        self.amount = amount
+        self.frequency = frequency
+        self.day = day
+        self.weekday = weekday
+        self.hour = hour
+        self.enabled = enabled
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DisbursementPlan":
+        return cls(
+            plan_id=str(data["id"]),
+            group=str(data.get("group", "*")),
+            amount=int(data["amount"]),
+            frequency=data.get("frequency", "monthly"),
+            day=int(data.get("day", 1)),
+            weekday=int(data.get("weekday", 0)),
+            hour=int(data.get("hour", 0)),
+            enabled=bool(data.get("enabled", True)),
+        )
+
+    def period(self, now: datetime):
+        """
+        Returns the current period's key and the time its run is due.
+
+        The key names the run, so a plan is paid at most once per period.
+        """
+        if self.frequency == "daily":
+            return now.strftime("%Y-%m-%d"), now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if self.frequency == "weekly":
+            year, week, _ = now.isocalendar()
+            monday = now.date() - timedelta(days=now.weekday())
+            due = datetime.combine(monday + timedelta(days=self.weekday), datetime.min.time())
+            return f"{year}-W{week:02d}", due.replace(hour=self.hour)
+        day = min(self.day, calendar.monthrange(now.year, now.month)[1])
+        return now.strftime("%Y-%m"), datetime(now.year, now.month, day, self.hour)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "group": self.group,
+            "amount": self.amount,
+            "frequency": self.frequency,
+            "day": self.day,
+            "weekday": self.weekday,
+            "hour": self.hour,
+            "enabled": self.enabled,
+        }
+
+
+class DisbursementRun:
+    """
+    One period's run of a plan over a fixed snapshot of the group's members.
+
+    Every member has an item with a status: pending, in_flight (the payment
+    may have gone out), paid or failed.
+    """
+
+    def __init__(self, run_id: str, plan_id: str, period: str, group: str, amount: int,
+                 members: List[str], started_at: str):
+        self.id = run_id
+        self.plan_id = plan_id
+        self.period = period
+        self.group = group
+        self.amount = amount
+        self.members = members
+        self.items: Dict[str, dict] = {member: {"status": PENDING, "attempts": 0} for member in members}
+        self.status = RUNNING
+        self.started_at = started_at
+        self.finished_at = None
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def memo(self) -> str:
+        # Identifies the payment in the recipient's LNbits history when reconciling
+        return f"Subsidy disbursement {self.id}"
+
+    def reference(self, recipient_id: str) -> str:
+        return f"{self.id}/{recipient_id}"
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            counts = {PENDING: 0, IN_FLIGHT: 0, PAID: 0, FAILED: 0}
+            for item in self.items.values():
+                counts[item["status"]] += 1
+            elapsed = self.elapsed
+        return {
+            "id": self.id,
+            "plan_id": self.plan_id,
+            "period": self.period,
+            "group": self.group,
+            "amount": self.amount,
+            "status": self.status,
+            "recipients": len(self.members),
+            "paid": counts[PAID],
+            "failed": counts[FAILED],
+            "pending": counts[PENDING] + counts[IN_FLIGHT],
+            "sats_paid": counts[PAID] * self.amount,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_s": round(elapsed, 3),
+            "payments_per_second": round(counts[PAID] / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def failures(self) -> list:
+        with self.lock:
+            return [{"recipient_id": member, "attempts": item["attempts"], "error": item.get("error")}
+                    for member, item in self.items.items() if item["status"] == FAILED]
+
+
+class DisbursementEngine:
+    """
+    Runs recurring funding plans as idempotent, checkpointed jobs.
+
+    A run is named after its plan and period, so triggering it twice resumes
+    the same run instead of paying again. Members are processed in chunks of
+    `chunk_size` with at most `concurrency` payments in flight. Before a chunk
+    starts, its items are written to the journal as in flight, and the results
+    are written once it finishes, each with a single fsync. After a crash, the
+    journal is replayed. In-flight and failed items are checked against the
+    recipient's LNbits payments (by the run's memo) before being paid again.
+    """
+
+    def __init__(self, plans_path: str = DISBURSE_PLANS_FILE, journal_path: str = DISBURSE_JOURNAL,
+                 chunk_size: int = DISBURSE_CHUNK_SIZE, concurrency: int = DISBURSE_CONCURRENCY,
+                 max_attempts: int = DISBURSE_MAX_ATTEMPTS):
+        self.plans_path = plans_path
+        self.journal_path = journal_path
+        self.chunk_size = max(1, chunk_size)
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+        self.plans: Dict[str, DisbursementPlan] = {}
+        self.runs: Dict[str, DisbursementRun] = {}
+        self._plans_mtime = None
+        self._active = set()
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._thread = None
+        self.fund = None
+        self.already_paid = None
+        self.members = None
+        self.load_plans()
+        self._replay_journal()
+
+    def bind(self, fund: Callable, already_paid: Callable, members: Callable):
+        """
+        Connects the engine to the app.
+
+        Args:
+            - fund (callable): fund(recipient_id, amount, memo, reference), pays and records a deposit
+            - already_paid (callable): already_paid(recipient_id, amount, memo, reference),
+                returns the payment hash if the payment went out, else None
+            - members (callable): members(group), returns the recipient ids of a group
+        """
+        self.fund = fund
+        self.already_paid = already_paid
+        self.members = members
+
+    def load_plans(self):
+        """(Re)loads the plans file when it changed; keeps the old plans on errors"""
+        try:
+            mtime = os.path.getmtime(self.plans_path)
+        except OSError:
+            return
+        if mtime == self._plans_mtime:
+            return
+        try:
+            with open(self.plans_path, 'r') as f:
+                plans = [DisbursementPlan.from_dict(entry) for entry in json.load(f)]
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Error loading disbursement plans from {self.plans_path}: {str(e)}")
+            return
+        self._plans_mtime = mtime
+        self.plans = {plan.id: plan for plan in plans}
+        print(f"Loaded {len(plans)} disbursement plans")
+
+    # Journal
+
+    def _replay_journal(self):
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line cut short by a crash
+                    self._apply(record)
+        except FileNotFoundError:
+            return
+        for run in self.runs.values():
+            if run.status == RUNNING:
+                # The process stopped while this run was going
+                run.status = INCOMPLETE
+        interrupted = [run.id for run in self.runs.values() if run.status == INCOMPLETE]
+        if interrupted:
+            print(f"Disbursement runs to resume: {', '.join(interrupted)}")
+        self._compact()
+
+    def _apply(self, record: dict):
+        kind = record.get("type")
+        if kind == "run":
+            self.runs[record["id"]] = DisbursementRun(
+                record["id"], record["plan_id"], record["period"], record["group"],
+                record["amount"], record["members"], record["started_at"]
+            )
+            return
+        run = self.runs.get(record.get("run"))
+        if run is None:
+            return
+        if kind == "item":
+            item = run.items.setdefault(record["recipient_id"], {"status": PENDING, "attempts": 0})
+            item.update({key: record[key] for key in ("status", "attempts", "error", "payment_hash")
+                         if key in record})
+        elif kind == "session":
+            run.elapsed = record["elapsed"]
+            run.status = record["status"]
+            run.finished_at = record.get("finished_at")
+
+    def _records(self, run: DisbursementRun) -> list:
+        records = [{"type": "run", "id": run.id, "plan_id": run.plan_id, "period": run.period,
+                    "group": run.group, "amount": run.amount, "members": run.members,
+                    "started_at": run.started_at}]
+        for member, item in run.items.items():
+            if item["status"] != PENDING or item["attempts"]:
+                records.append(dict(item, type="item", run=run.id, recipient_id=member))
+        if run.status != RUNNING:
+            records.append({"type": "session", "run": run.id, "status": run.status,
+                            "elapsed": run.elapsed, "finished_at": run.finished_at})
+        return records
+
+    def _compact(self):
+        """Rewrites the journal with only the runs kept in the history"""
+        finished = sorted((run for run in self.runs.values() if run.status == COMPLETE),
+                          key=lambda run: run.started_at)
+        for run in finished[:max(0, len(finished) - DISBURSE_HISTORY)]:
+            del self.runs[run.id]
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            for run in self.runs.values():
+                for record in self._records(run):
+                    f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.journal_path)
+
+    def _write(self, records: list):
+        """Appends records to the journal with one fsync"""
+        data = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        with self._journal_lock:
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'a')
+            self._journal.write(data)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    # Scheduling
+
+    def start(self):
+        """Starts the scheduler thread, which also resumes interrupted runs"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="disbursements", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error in disbursement scheduler: {str(e)}")
+            time.sleep(DISBURSE_TICK)
+
+    def tick(self, now: Optional[datetime] = None):
+        """Starts due runs and retries unfinished ones"""
+        now = now or datetime.now()
+        self.load_plans()
+        for plan in list(self.plans.values()):
+            if not plan.enabled:
+                continue
+            period, due = plan.period(now)
+            if now >= due and f"{plan.id}:{period}" not in self.runs:
+                try:
+                    self.trigger(plan.id, now)
+                except ValueError:
+                    pass  # nobody in the group yet; try again next tick
+        for run in list(self.runs.values()):
+            if run.status == INCOMPLETE:
+                self._launch(run)
+
+    def trigger(self, plan_id: str, now: Optional[datetime] = None) -> DisbursementRun:
+        """
+        Starts the plan's run for the current period, or resumes it if it exists.
+
+        Members are fixed when the run is created; recipients added to the
+        group later are paid from the next period on.
+
+        Raises:
+            - KeyError if the plan does not exist
+            - ValueError if a new run would have no recipients
+        """
+        plan = self.plans[plan_id]
+        period, _ = plan.period(now or datetime.now())
+        run_id = f"{plan.id}:{period}"
+        with self._lock:
+            run = self.runs.get(run_id)
+            if run is None:
+                members = sorted(self.members(plan.group))
+                if not members:
+                    raise ValueError(f"No recipients in group {plan.group}")
+                run = DisbursementRun(run_id, plan.id, period, plan.group, plan.amount,
+                                      members, datetime.now().isoformat())
+                self._write(self._records(run))
+                self.runs[run_id] = run
+                print(f"Starting disbursement run {run_id} for {len(members)} recipients")
+        if run.status != COMPLETE:
+            self._launch(run)
+        return run
+
+    def _launch(self, run: DisbursementRun):
+        with self._lock:
+            if run.id in self._active:
+                return
+            self._active.add(run.id)
+            run.status = RUNNING
+        threading.Thread(target=self._execute, args=(run,), name=f"disbursement-{run.id}",
+                         daemon=True).start()
+
+    # Execution
+
+    def _execute(self, run: DisbursementRun):
+        started = time.monotonic()
+        elapsed_before = run.elapsed
+        try:
+            with run.lock:
+                todo = [member for member in run.members
+                        if run.items[member]["status"] != PAID
+                        and run.items[member]["attempts"] < self.max_attempts]
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for index in range(0, len(todo), self.chunk_size):
+                    chunk = todo[index:index + self.chunk_size]
+                    self._run_chunk(run, chunk, pool)
+                    run.elapsed = elapsed_before + time.monotonic() - started
+        except Exception as e:
+            print(f"Disbursement run {run.id} stopped: {str(e)}")
+        finally:
+            run.elapsed = elapsed_before + time.monotonic() - started
+            with run.lock:
+                retry = any(item["status"] != PAID and item["attempts"] < self.max_attempts
+                            for item in run.items.values())
+            run.status = INCOMPLETE if retry else COMPLETE
+            if run.status == COMPLETE:
+                run.finished_at = datetime.now().isoformat()
+            self._write([{"type": "session", "run": run.id, "status": run.status,
+                          "elapsed": run.elapsed, "finished_at": run.finished_at}])
+            with self._lock:
+                self._active.discard(run.id)
+            summary = run.to_dict()
+            print(f"Disbursement run {run.id} {run.status}: {summary['paid']} paid, "
+                  f"{summary['failed']} failed, {summary['payments_per_second']} payments/s")
+
+    def _run_chunk(self, run: DisbursementRun, chunk: List[str], pool: ThreadPoolExecutor):
+        # Items that were in flight or failed before may have been paid after all
+        with run.lock:
+            needs_check = {member for member in chunk if run.items[member]["status"] != PENDING}
+            for member in chunk:
+                run.items[member]["status"] = IN_FLIGHT
+            checkpoint = [dict(run.items[member], type="item", run=run.id, recipient_id=member)
+                          for member in chunk]
+        self._write(checkpoint)
+
+        futures = [pool.submit(self._pay, run, member, member in needs_check) for member in chunk]
+        for future in futures:
+            future.result()
+
+        with run.lock:
+            results = [dict(run.items[member], type="item", run=run.id, recipient_id=member)
+                       for member in chunk]
+        self._write(results)
+
+    def _pay(self, run: DisbursementRun, recipient_id: str, check_first: bool):
+        reference = run.reference(recipient_id)
+        payment_hash = None
+        counted = True
+        error = None
+        give_up_at = time.monotonic() + DISBURSE_OVERLOAD_WAIT
+        while True:
+            try:
+                if check_first:
+                    payment_hash = self.already_paid(recipient_id, run.amount, run.memo, reference)
+                if not payment_hash:
+                    payment = self.fund(recipient_id, run.amount, run.memo, reference)
+                    payment_hash = payment["payment_hash"]
+                break
+            except Overloaded as e:
+                # Refused before reaching LNbits, so it is safe to back off and
+                # retry; it doesn't use up an attempt either
+                counted = False
+                error = str(e)
+                if time.monotonic() >= give_up_at:
+                    break
+                # Jitter keeps the workers from retrying in lockstep
+                time.sleep(e.retry_after + random.uniform(0, e.retry_after + 0.1))
+            except Exception as e:
+                counted = True
+                error = str(e)
+                break
+        with run.lock:
+            item = run.items[recipient_id]
+            if payment_hash:
+                item.update(status=PAID, payment_hash=payment_hash, error=None)
+            else:
+                item.update(status=FAILED, error=error)
+                if counted:
+                    item["attempts"] += 1
+
+    # Views
+
+    def history(self) -> list:
+        runs = sorted(self.runs.values(), key=lambda run: run.started_at, reverse=True)
+        return [run.to_dict() for run in runs]
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = sorted(self._active)
+        return {
+            "plans": len(self.plans),
+            "runs": len(self.runs),
+            "active": active,
+        }
+
+
+disbursements = DisbursementEngine()
@@ -0,0 +1,133 @@
+# events.py
+import json
+import os
+import queue
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Iterator
+
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "100"))
+SSE_REPLAY_SIZE = int(os.getenv("SSE_REPLAY_SIZE", "1000"))
+
+
+class Subscriber:
+    """One connected event stream, optionally filtered to a program, vendor or recipient"""
+
+    def __init__(self, vendor_id: Optional[str] = None, recipient_id: Optional[str] = None,
+                 program: Optional[str] = None):
+        self.vendor_id = vendor_id
+        self.recipient_id = recipient_id
+        self.program = program
+        self.queue = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        data = event["data"]
+        if self.program and data.get("program") != self.program:
+            return False
+        if self.vendor_id and data.get("vendor_id") != self.vendor_id:
+            return False
+        if self.recipient_id and data.get("recipient_id") != self.recipient_id:
+            return False
+        return True
+
+
+class EventBroker:
+    """
+    Fans ledger events out to Server-Sent Events subscribers.
+
+    Recent events are kept in a ring buffer so a client that reconnects with
+    Last-Event-ID receives what it missed. A subscriber whose queue fills up is
+    disconnected instead of slowing down publishers; its browser reconnects
+    and catches up from the buffer.
+    """
+
+    def __init__(self, max_clients: int = SSE_MAX_CLIENTS, replay_size: int = SSE_REPLAY_SIZE):
+        self.max_clients = max_clients
+        self._subscribers = set()
+        self._recent = deque(maxlen=replay_size)
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def publish(self, event_type: str, data: Dict[str, Any]):
+        """
+        Sends an event to every interested subscriber.
+
+        Args:
+            - event_type (str): "transaction", "status" or "balance"
+            - data (dict): event payload; its program, vendor_id and
+                recipient_id fields are used for filtering
+        """
+        with self._lock:
+            event = {"id": self._next_id, "type": event_type, "data": data}
+            self._next_id += 1
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            if subscriber.overflowed or not subscriber.wants(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                subscriber.overflowed = True
+
+    def subscribe(self, vendor_id: Optional[str] = None, recipient_id: Optional[str] = None,
+                  program: Optional[str] = None) -> Optional[Subscriber]:
+        """Registers a subscriber, or returns None when at capacity"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = Subscriber(vendor_id, recipient_id, program)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def missed(self, subscriber: Subscriber, last_event_id: int) -> list:
+        with self._lock:
+            return [event for event in self._recent
+                    if event["id"] > last_event_id and subscriber.wants(event)]
+
+    def stream(self, subscriber: Subscriber, last_event_id: Optional[int] = None) -> Iterator[str]:
+        """Yields the subscriber's events in text/event-stream format until it disconnects"""
+        sent = last_event_id or 0
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id is not None:
+                for event in self.missed(subscriber, last_event_id):
+                    sent = event["id"]
+                    yield format_event(event)
+            while not subscriber.overflowed:
+                try:
+                    event = subscriber.queue.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                # Events queued while the backlog was replayed were already sent
+                if event["id"] > sent:
+                    sent = event["id"]
+                    yield format_event(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "buffered_events": len(self._recent),
+                "last_event_id": self._next_id - 1,
+            }
+
+
+def format_event(event: Dict[str, Any]) -> str:
+    data = json.dumps(event["data"], default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+broker = EventBroker()
@@ -0,0 +1,160 @@
+# export.py
+import csv
+import io
+import json
+from datetime import datetime, time
+from typing import Iterator, Optional
+
+from utils import parse_transaction_date
+
+EXPORT_FIELDS = ["id", "date", "recipient_id", "vendor_id", "amount", "type", "status", "payment_hash"]
+
+# Rows are buffered into chunks of about this many bytes before being yielded
+CHUNK_SIZE = 64 * 1024
+
+
+class ExportFilter:
+    """
+    Filters for a ledger export.
+
+    The cursor is the ledger position to resume from; every exported row carries
+    the cursor of the row after it, so an interrupted export can continue from
+    the last row the client received.
+    """
+
+    def __init__(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 vendor_id: Optional[str] = None, recipient_id: Optional[str] = None,
+                 tx_type: Optional[str] = None, cursor: int = 0, limit: Optional[int] = None):
+        self.start = start
+        self.end = end
+        self.vendor_id = vendor_id
+        self.recipient_id = recipient_id
+        self.tx_type = tx_type
+        self.cursor = max(0, cursor)
+        self.limit = limit
+
+    @classmethod
+    def from_args(cls, args) -> "ExportFilter":
+        """
+        Builds a filter from request arguments: start, end (ISO dates or
+        datetimes; a bare end date includes that whole day), vendor_id,
+        recipient_id, type, cursor and limit.
+
+        Raises:
+            - ValueError if an argument cannot be parsed
+        """
+        start = args.get("start")
+        end = args.get("end")
+        limit = args.get("limit")
+        return cls(
+            start=datetime.fromisoformat(start) if start else None,
+            end=_parse_end(end) if end else None,
+            vendor_id=args.get("vendor_id") or None,
+            recipient_id=args.get("recipient_id") or None,
+            tx_type=args.get("type") or None,
+            cursor=int(args.get("cursor", 0)),
+            limit=int(limit) if limit else None,
+        )
+
+    def matches(self, transaction: dict) -> bool:
+        if self.vendor_id and transaction["vendor_id"] != self.vendor_id:
+            return False
+        if self.recipient_id and transaction["recipient_id"] != self.recipient_id:
+            return False
+        if self.tx_type and transaction["type"] != self.tx_type:
+            return False
+        if self.start or self.end:
+            tx_date = parse_transaction_date(transaction["date"])
+            if tx_date is None:
+                return False
+            if self.start and tx_date < self.start:
+                return False
+            if self.end and tx_date > self.end:
+                return False
+        return True
+
+
+def _parse_end(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if len(value) == 10:
+        return datetime.combine(parsed.date(), time.max)
+    return parsed
+
+
+def iter_transactions(transactions: list, export_filter: ExportFilter) -> Iterator[tuple]:
+    """
+    Yields (next_cursor, transaction) pairs matching the filter.
+
+    The ledger is only appended to, so walking it by index up to the length it
+    had when the export started gives a consistent snapshot without copying it.
+    A partitioned ledger narrows the walk to the days the date range touches
+    and skips days past retention; cursors stay ledger positions either way.
+    """
+    end = len(transactions)
+    first = export_filter.cursor
+    bounds = getattr(transactions, "bounds", None)
+    if bounds is not None and (export_filter.start or export_filter.end):
+        low, high = bounds(export_filter.start, export_filter.end)
+        first, end = max(first, low), min(end, high)
+    ranges = getattr(transactions, "ranges", None)
+    spans = ranges(first, end) if ranges is not None else [(first, end)]
+    emitted = 0
+    for low, high in spans:
+        for position in range(low, high):
+            if export_filter.limit is not None and emitted >= export_filter.limit:
+                return
+            transaction = transactions[position]
+            if export_filter.matches(transaction):
+                emitted += 1
+                yield position + 1, transaction
+
+
+def _value(transaction: dict, field: str):
+    value = transaction.get(field)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _chunked(lines: Iterator[str]) -> Iterator[str]:
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_csv(transactions: list, export_filter: ExportFilter) -> Iterator[str]:
+    """Yields the filtered ledger as CSV in chunks, with a trailing cursor column"""
+    def lines():
+        row_buffer = io.StringIO()
+        writer = csv.writer(row_buffer)
+
+        def render(row):
+            row_buffer.seek(0)
+            row_buffer.truncate()
+            writer.writerow(row)
+            return row_buffer.getvalue()
+
+        yield render(EXPORT_FIELDS + ["cursor"])
+        for cursor, transaction in iter_transactions(transactions, export_filter):
+            yield render([_value(transaction, field) for field in EXPORT_FIELDS] + [cursor])
+
+    return _chunked(lines())
+
+
+def stream_ndjson(transactions: list, export_filter: ExportFilter) -> Iterator[str]:
+    """Yields the filtered ledger as newline-delimited JSON in chunks"""
+    def lines():
+        for cursor, transaction in iter_transactions(transactions, export_filter):
+            record = {field: _value(transaction, field) for field in EXPORT_FIELDS}
+            record["cursor"] = cursor
+            yield json.dumps(record, default=str) + "\n"
+
+    return _chunked(lines())
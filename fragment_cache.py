@@ -0,0 +1,71 @@
+# fragment_cache.py
+import threading
+from typing import Callable, Dict, Any, Iterable
+
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """
+    Caches rendered template fragments in memory.
+
+    Every fragment depends on one or more sections ("recipients", "vendors",
+    "transactions", ...). Code that mutates a section calls `bump()`, which
+    moves its version counter on; a fragment is re-rendered only when the
+    versions of its sections, or the extra key it was rendered with, changed.
+    Only the latest rendering of each fragment is kept.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._fragments: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, *sections: str):
+        """Invalidates every fragment built from the given sections"""
+        with self._lock:
+            for section in sections:
+                self._versions[section] = self._versions.get(section, 0) + 1
+
+    def version(self, section: str) -> int:
+        return self._versions.get(section, 0)
+
+    def render(self, name: str, sections: Iterable[str], render: Callable[[], str],
+               extra_key: Any = None) -> Markup:
+        """
+        Returns a cached fragment, rendering it if any dependency changed.
+
+        Args:
+            - name (str): the fragment name
+            - sections (iterable): sections the fragment is built from
+            - render (callable): renders the fragment HTML
+            - extra_key (hashable, optional): other inputs the HTML depends on,
+                e.g. balances that are fetched per request
+        """
+        with self._lock:
+            key = (tuple(self._versions.get(section, 0) for section in sections), extra_key)
+            cached = self._fragments.get(name)
+            if cached and cached[0] == key:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        html = Markup(render())
+        with self._lock:
+            self._fragments[name] = (key, html)
+        return html
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "fragments": len(self._fragments),
+                "bytes": sum(len(html) for _, html in self._fragments.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "versions": dict(self._versions),
+            }
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,500 @@
+# ledger.py
+import bisect
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import Sequence
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+from tracing import tracer
+from utils import parse_transaction_date
+
+# Today's partition and those of the days before it, up to this many days in
+# all, stay in memory; older ones are archived to LEDGER_ARCHIVE_DIR. 31 keeps
+# the month to date, which monthly policy caps read, in memory.
+LEDGER_HOT_DAYS = int(os.getenv("LEDGER_HOT_DAYS", "31"))
+LEDGER_ARCHIVE_ENABLED = os.getenv("LEDGER_ARCHIVE_ENABLED", "True").lower() in ["true", "1", "t"]
+LEDGER_ARCHIVE_DIR = os.getenv("LEDGER_ARCHIVE_DIR", "ledger_archive")
+# Archived partitions older than this many days are deleted (0 keeps them)
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "0"))
+# Entries per compressed block; a lookup decompresses one block
+LEDGER_BLOCK_SIZE = int(os.getenv("LEDGER_BLOCK_SIZE", "512"))
+LEDGER_COMPRESS_LEVEL = int(os.getenv("LEDGER_COMPRESS_LEVEL", "6"))
+# Decompressed archive blocks kept in memory
+LEDGER_CACHE_BLOCKS = int(os.getenv("LEDGER_CACHE_BLOCKS", "64"))
+
+# An archive file is MAGIC, the zlib-compressed JSON blocks, a JSON footer
+# (day, count, dates, block offsets) and the footer's length as 8 bytes
+MAGIC = b"LDG1\n"
+_LENGTH = struct.Struct(">Q")
+
+# Entries in these statuses can still change, so their partition stays in memory
+OPEN_STATUSES = ("queued", "pending")
+
+
+def is_open(entry: dict, now: datetime) -> bool:
+    """Whether an entry can still change: one pending on an invoice past its expiry can't be paid anymore"""
+    if entry.get("status") not in OPEN_STATUSES:
+        return False
+    expires_at = entry.get("expires_at")
+    return not isinstance(expires_at, datetime) or expires_at > now
+
+
+class HotPartition:
+    """One day of the ledger, in memory"""
+
+    def __init__(self, day: date, start: int):
+        self.day = day
+        self.start = start
+        self.entries: list = []
+        self.first: Optional[datetime] = None
+        self.last: Optional[datetime] = None
+
+    @property
+    def count(self) -> int:
+        return len(self.entries)
+
+    def add(self, transaction: dict, when: datetime):
+        self.entries.append(transaction)
+        if self.first is None or when < self.first:
+            self.first = when
+        if self.last is None or when > self.last:
+            self.last = when
+
+    def get(self, offset: int) -> dict:
+        return self.entries[offset]
+
+    def materialize(self) -> list:
+        return self.entries
+
+
+class _BlockCache:
+    """The most recently used decompressed archive blocks"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._blocks: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+        block = load()
+        with self._lock:
+            self._blocks[key] = block
+            while len(self._blocks) > self.capacity:
+                self._blocks.popitem(last=False)
+        return block
+
+    def drop(self, path: str):
+        with self._lock:
+            for key in [key for key in self._blocks if key[0] == path]:
+                del self._blocks[key]
+
+
+class ColdPartition:
+    """
+    One archived day of the ledger. The file is memory-mapped and only the
+    footer is read up front; blocks are decompressed when an entry in them
+    is needed.
+    """
+
+    def __init__(self, path: str, start: int, cache: _BlockCache):
+        self.path = path
+        self.start = start
+        self._cache = cache
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a ledger archive")
+        footer_length = _LENGTH.unpack(self._map[-_LENGTH.size:])[0]
+        footer = json.loads(self._map[-_LENGTH.size - footer_length:-_LENGTH.size])
+        self.day = date.fromisoformat(footer["day"])
+        self.count = footer["count"]
+        self.first = datetime.fromisoformat(footer["first"]) if footer["first"] else None
+        self.last = datetime.fromisoformat(footer["last"]) if footer["last"] else None
+        self.block_size = footer["block_size"]
+        self.blocks = footer["blocks"]
+        self.datetime_fields = footer["datetime_fields"]
+        # Archives written before the footer listed them are read through once
+        self.payment_hashes = footer.get("payment_hashes")
+        self.size = len(self._map)
+
+    def _load(self, index: int) -> list:
+        offset, length = self.blocks[index]
+        # A block cache miss: the read that makes an old date range slow
+        with tracer.span("ledger.load_block", archive=os.path.basename(self.path), block=index):
+            entries = json.loads(zlib.decompress(self._map[offset:offset + length]))
+        for entry in entries:
+            for field in self.datetime_fields:
+                if isinstance(entry.get(field), str):
+                    entry[field] = datetime.fromisoformat(entry[field])
+        return entries
+
+    def block(self, index: int) -> list:
+        return self._cache.get((self.path, index), lambda: self._load(index))
+
+    def get(self, offset: int) -> dict:
+        return self.block(offset // self.block_size)[offset % self.block_size]
+
+    def materialize(self) -> list:
+        return list(itertools.chain.from_iterable(self.block(index) for index in range(len(self.blocks))))
+
+    def hashes(self) -> List[str]:
+        """Payment hashes of the entries, from the footer when it has them"""
+        if self.payment_hashes is None:
+            self.payment_hashes = [entry["payment_hash"] for entry in self.materialize()
+                                   if entry.get("payment_hash")]
+        return self.payment_hashes
+
+    def close(self):
+        self._cache.drop(self.path)
+        self._map.close()
+
+
+class ExpiredPartition:
+    """A day past retention; its positions stay taken so later positions don't move"""
+
+    def __init__(self, day: date, start: int, count: int):
+        self.day = day
+        self.start = start
+        self.count = count
+        self.first = self.last = None
+
+    def get(self, offset: int) -> dict:
+        raise IndexError(f"ledger entries of {self.day} are past retention")
+
+    def materialize(self) -> list:
+        return []
+
+
+def write_archive(partition: HotPartition, path: str, block_size: int = LEDGER_BLOCK_SIZE,
+                  level: int = LEDGER_COMPRESS_LEVEL) -> int:
+    """
+    Writes a partition to an archive file (through a temporary file, so a
+    crash never leaves a partial archive). Returns the file size.
+    """
+    datetime_fields = set()
+
+    def encode(entry: dict) -> dict:
+        encoded = {}
+        for field, value in entry.items():
+            if isinstance(value, datetime):
+                datetime_fields.add(field)
+                value = value.isoformat()
+            encoded[field] = value
+        return encoded
+
+    temp_path = path + ".tmp"
+    blocks = []
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        for index in range(0, partition.count, block_size):
+            chunk = [encode(entry) for entry in partition.entries[index:index + block_size]]
+            data = zlib.compress(json.dumps(chunk, separators=(",", ":"), default=str).encode(), level)
+            blocks.append((f.tell(), len(data)))
+            f.write(data)
+        footer = json.dumps({
+            "day": partition.day.isoformat(),
+            "count": partition.count,
+            "first": partition.first.isoformat() if partition.first else None,
+            "last": partition.last.isoformat() if partition.last else None,
+            "block_size": block_size,
+            "blocks": blocks,
+            "datetime_fields": sorted(datetime_fields),
+            "payment_hashes": sorted({entry["payment_hash"] for entry in partition.entries
+                                      if entry.get("payment_hash")}),
+        }).encode()
+        f.write(footer)
+        f.write(_LENGTH.pack(len(footer)))
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+class LedgerView(Sequence):
+    """Read-only view over the entries of some partitions, in ledger order"""
+
+    def __init__(self, parts: List[list]):
+        self._parts = [part for part in parts if part]
+        self._starts = list(itertools.accumulate([0] + [len(part) for part in self._parts]))
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ledger view index out of range")
+        part = bisect.bisect_right(self._starts, index) - 1
+        return self._parts[part][index - self._starts[part]]
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._parts)
+
+    def __reversed__(self):
+        return itertools.chain.from_iterable(reversed(part) for part in reversed(self._parts))
+
+
+class Ledger(Sequence):
+    """
+    The transaction ledger, partitioned by day.
+
+    Entries go to the partition of the day they are appended on. Today's
+    partition and those of the last `hot_days` days stay in memory; older
+    ones are written to compressed archive files and read back lazily, a
+    block at a time, when a query's date range reaches them. A partition
+    holding a queued or pending entry stays in memory until that settles,
+    since those entries are still updated in place.
+
+    Positions never change: archiving keeps an entry's position and retention
+    leaves the positions of deleted days unused, so export cursors stay
+    valid. len() is the position after the last entry.
+
+    The payment hashes of all entries, archived ones included, are kept in
+    a set, so a payment already in the ledger is found without reading
+    the archives.
+    """
+
+    def __init__(self, archive_dir: str = LEDGER_ARCHIVE_DIR, hot_days: int = LEDGER_HOT_DAYS,
+                 retention_days: int = LEDGER_RETENTION_DAYS, archive: bool = LEDGER_ARCHIVE_ENABLED,
+                 block_size: int = LEDGER_BLOCK_SIZE, cache_blocks: int = LEDGER_CACHE_BLOCKS):
+        self.archive_dir = archive_dir
+        self.hot_days = max(1, hot_days)
+        self.retention_days = retention_days
+        self.archive = archive
+        self.block_size = max(1, block_size)
+        self._cache = _BlockCache(cache_blocks)
+        self._partitions: list = []
+        self._starts: List[int] = []
+        self._end = 0
+        self._hashes = set()
+        self._lock = threading.Lock()
+        # Held for a whole maintenance run, so two runs never archive the same day
+        self._maintenance = threading.Lock()
+        self.counters = {"archived": 0, "expired": 0, "archive_errors": 0}
+        self.last_error = None
+        if archive:
+            self._attach()
+
+    def _attach(self):
+        """Picks up partitions archived by earlier runs, in day order"""
+        try:
+            names = sorted(name for name in os.listdir(self.archive_dir) if name.endswith(".ldg"))
+        except FileNotFoundError:
+            return
+        for name in names:
+            try:
+                partition = ColdPartition(os.path.join(self.archive_dir, name), self._end, self._cache)
+            except (OSError, ValueError) as e:
+                print(f"Skipping ledger archive {name}: {str(e)}")
+                continue
+            self._partitions.append(partition)
+            self._starts.append(partition.start)
+            self._end += partition.count
+            self._hashes.update(partition.hashes())
+        if names:
+            print(f"Attached {len(self._partitions)} archived ledger partitions ({self._end} entries)")
+
+    # Writing
+
+    def append(self, transaction: dict):
+        when = parse_transaction_date(transaction.get("date")) or datetime.now()
+        rolled = False
+        with self._lock:
+            current = self._partitions[-1] if self._partitions else None
+            if not isinstance(current, HotPartition) or when.date() > current.day:
+                rolled = current is not None
+                current = HotPartition(when.date(), self._end)
+                self._partitions.append(current)
+                self._starts.append(current.start)
+            # A late entry dated before the current day still goes to the current partition
+            current.add(transaction, when)
+            self._end += 1
+            if transaction.get("payment_hash"):
+                self._hashes.add(transaction["payment_hash"])
+        if rolled and self.archive:
+            self.maintain_async()
+
+    def index_payment_hash(self, payment_hash: str):
+        """Notes the payment hash an entry got after it was appended"""
+        with self._lock:
+            self._hashes.add(payment_hash)
+
+    # Reading
+
+    def has_payment_hash(self, payment_hash: str) -> bool:
+        with self._lock:
+            return payment_hash in self._hashes
+
+    def __len__(self):
+        return self._end
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += self._end
+        if not 0 <= index < self._end:
+            raise IndexError("ledger index out of range")
+        with self._lock:
+            partition = self._partitions[bisect.bisect_right(self._starts, index) - 1]
+        return partition.get(index - partition.start)
+
+    def _snapshot(self) -> list:
+        with self._lock:
+            return list(self._partitions)
+
+    def __iter__(self) -> Iterator[dict]:
+        for partition in self._snapshot():
+            yield from partition.materialize()
+
+    def __reversed__(self) -> Iterator[dict]:
+        for partition in reversed(self._snapshot()):
+            yield from reversed(partition.materialize())
+
+    def between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> LedgerView:
+        """Entries of every partition with entries dated between start and end"""
+        return LedgerView([partition.materialize() for partition in self._overlapping(start, end)])
+
+    def since(self, start: datetime) -> LedgerView:
+        """Entries of the partitions that reach `start`; today's range touches today only"""
+        return self.between(start, None)
+
+    def hot(self) -> LedgerView:
+        """Entries held in memory"""
+        return LedgerView([partition.entries for partition in self._snapshot()
+                           if isinstance(partition, HotPartition)])
+
+    def _overlapping(self, start: Optional[datetime], end: Optional[datetime]) -> list:
+        return [partition for partition in self._snapshot()
+                if partition.count and partition.first is not None
+                and (start is None or partition.last >= start)
+                and (end is None or partition.first <= end)]
+
+    def bounds(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, int]:
+        """The positions from the first to past the last partition a date range touches"""
+        partitions = self._overlapping(start, end)
+        if not partitions:
+            return self._end, self._end
+        return partitions[0].start, partitions[-1].start + partitions[-1].count
+
+    def ranges(self, first: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+        """The position ranges from first to end whose entries are still held, skipping days past retention"""
+        end = self._end if end is None else end
+        return [(max(first, partition.start), min(end, partition.start + partition.count))
+                for partition in self._snapshot()
+                if not isinstance(partition, ExpiredPartition)
+                and partition.start < end and partition.start + partition.count > first]
+
+    # Archiving
+
+    def maintain_async(self):
+        if self._maintenance.locked():
+            return
+        threading.Thread(target=self.maintain, name="ledger-archive", daemon=True).start()
+
+    @tracer.wrap("ledger.maintain")
+    def maintain(self, today: Optional[date] = None) -> dict:
+        """
+        Archives partitions that fell out of the hot window and deletes those
+        past retention.
+
+        Returns:
+            - a dict with the days archived and expired in this run
+        """
+        now = datetime.now() if today is None else datetime.combine(today, datetime.min.time())
+        today = today or now.date()
+        archived, expired = [], []
+        with self._maintenance:
+            cutoff = today - timedelta(days=self.hot_days - 1)
+            candidates = [partition for partition in self._snapshot()
+                          if isinstance(partition, HotPartition) and partition.day < cutoff
+                          and not any(is_open(entry, now) for entry in partition.entries)]
+            for partition in candidates:
+                if self._archive_partition(partition):
+                    archived.append(partition.day.isoformat())
+            if self.retention_days > 0:
+                expiry = today - timedelta(days=self.retention_days)
+                for partition in self._snapshot():
+                    if isinstance(partition, ColdPartition) and partition.day < expiry:
+                        self._expire(partition)
+                        expired.append(partition.day.isoformat())
+        if archived or expired:
+            print(f"Ledger maintenance: archived {archived or 'nothing'}, expired {expired or 'nothing'}")
+        return {"archived": archived, "expired": expired}
+
+    def _archive_partition(self, partition: HotPartition) -> bool:
+        count = partition.count
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{partition.day.isoformat()}-{partition.start:012d}.ldg")
+        try:
+            write_archive(partition, path, self.block_size)
+            cold = ColdPartition(path, partition.start, self._cache)
+        except (OSError, ValueError) as e:
+            print(f"Error archiving ledger partition {partition.day}: {str(e)}")
+            with self._lock:
+                self.counters["archive_errors"] += 1
+                self.last_error = str(e)
+            return False
+        with self._lock:
+            # Swap only if nothing was added meanwhile, or the new entries would be lost
+            if partition.count == count and partition in self._partitions:
+                self._partitions[self._partitions.index(partition)] = cold
+                self.counters["archived"] += 1
+                return True
+        cold.close()
+        os.remove(path)
+        return False
+
+    def _expire(self, partition: ColdPartition):
+        with self._lock:
+            index = self._partitions.index(partition)
+            self._partitions[index] = ExpiredPartition(partition.day, partition.start, partition.count)
+            self.counters["expired"] += 1
+        partition.close()
+        try:
+            os.remove(partition.path)
+        except OSError as e:
+            print(f"Error deleting ledger archive {partition.path}: {str(e)}")
+
+    def stats(self) -> dict:
+        partitions = self._snapshot()
+        hot = [partition for partition in partitions if isinstance(partition, HotPartition)]
+        cold = [partition for partition in partitions if isinstance(partition, ColdPartition)]
+        return dict(
+            self.counters,
+            entries=self._end,
+            hot_partitions=len(hot),
+            hot_entries=sum(partition.count for partition in hot),
+            cold_partitions=len(cold),
+            cold_entries=sum(partition.count for partition in cold),
+            cold_bytes=sum(partition.size for partition in cold),
+            expired_entries=sum(partition.count for partition in partitions
+                                if isinstance(partition, ExpiredPartition)),
+            oldest_hot_day=hot[0].day.isoformat() if hot else None,
+            cache_hits=self._cache.hits,
+            cache_misses=self._cache.misses,
+            hot_days=self.hot_days,
+            retention_days=self.retention_days,
+            archive=self.archive,
+            last_error=self.last_error,
+        )
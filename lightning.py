@@ -1,12 +1,22 @@
 # lightning.py
-import requests
-import json
-import os
+from datetime import datetime
 from typing import Optional, Dict, Any
 
-# LNBits API Configuration
-LNBITS_URL = os.getenv("LNBITS_URL", "http://localhost:5001")
+from bolt11 import Bolt11Error, BOLT11_VERIFY, check as check_bolt11, remember
 
+from ratelimit import rate_limited, LANE_PAYMENT, LANE_READ
+from circuit import guarded_request, LNbitsUnavailable
+from nodes import registry
+from tracing import tracer
+
+# LNBits API Configuration: each wallet key is routed to the node holding the wallet
+
+# Called with (wallet_key, sats) after every successful balance read, so
+# caches of wallet balances stay current without extra LNbits calls
+balance_observers = []
+
+@tracer.wrap("lightning.create_invoice")
+@rate_limited(LANE_PAYMENT, key="wallet_key")
 def create_invoice(wallet_key: str, amount: int, memo: str = "") -> Optional[Dict[str, Any]]:
     """
     Creates a Lightning invoice using LNbits
@@ -18,13 +28,17 @@ def create_invoice(wallet_key: str, amount: int, memo: str = "") -> Optional[Dic
         
     Returns:
         Optional[Dict]: Invoice data or None if failed
+        
+    Raises:
+        LNbitsUnavailable: if LNbits timed out, is down or its circuit is open
     """
     try:
         # Print debug info
         print(f"Creating invoice with wallet_key: {wallet_key[:5] if wallet_key else 'None'}..., amount: {amount}, memo: {memo}")
         
-        # Make a direct API call to create an invoice
-        url = f"{LNBITS_URL}/api/v1/payments"
+        # Make a direct API call to create an invoice on the wallet's node
+        node = registry.node_for_key(wallet_key)
+        url = f"{node.url}/api/v1/payments"
         headers = {
             "X-Api-Key": wallet_key,
             "Content-type": "application/json"
@@ -38,7 +52,7 @@ def create_invoice(wallet_key: str, amount: int, memo: str = "") -> Optional[Dic
         print(f"Sending request to: {url}")
         print(f"Request data: {data}")
         
-        response = requests.post(url, headers=headers, json=data)
+        response = guarded_request("create_invoice", "POST", url, node=node.name, headers=headers, json=data)
         print(f"Response status: {response.status_code}")
         
         if response.status_code == 201 or response.status_code == 200:
@@ -68,34 +82,63 @@ def create_invoice(wallet_key: str, amount: int, memo: str = "") -> Optional[Dic
                 "created_at": invoice_data.get("time", "")
             }
             
+            # Make sure the invoice is for what we asked, without another LNbits call
+            if BOLT11_VERIFY:
+                try:
+                    decoded = check_bolt11(payment_request, amount=amount,
+                                           payment_hash=invoice_data.get("payment_hash") or None)
+                except Bolt11Error as e:
+                    print(f"ERROR: LNbits returned an invoice that doesn't match the request: {str(e)}")
+                    return None
+                remember(decoded)
+                result["payment_hash"] = decoded.payment_hash
+                result["expires_at"] = datetime.fromtimestamp(decoded.expires_at).isoformat()
+            
             print(f"Formatted invoice data: {result}")
             return result
         else:
             print(f"Error from LNbits API: {response.status_code} - {response.text}")
             return None
+    except LNbitsUnavailable:
+        raise
     except Exception as e:
         import traceback
         print(f"Exception creating invoice: {str(e)}")
         print(traceback.format_exc())
-        return None()
+        return None
 
-def pay_invoice(wallet_adminkey: str, payment_request: str) -> Optional[Dict[str, Any]]:
+@tracer.wrap("lightning.pay_invoice")
+@rate_limited(LANE_PAYMENT, key="wallet_adminkey")
+def pay_invoice(wallet_adminkey: str, payment_request: str, amount: Optional[int] = None) -> Optional[Dict[str, Any]]:
     """
     Pays a Lightning invoice using LNbits
     
     Args:
         wallet_adminkey (str): The wallet's adminkey
         payment_request (str): The BOLT11 invoice to pay
+        amount (int, optional): Satoshis the invoice must be for
         
     Returns:
         Optional[Dict]: Payment data or None if failed
+        
+    Raises:
+        Bolt11Error: if the invoice is malformed, expired or for another amount
+        CircuitOpen: if the circuit is open; nothing was sent, so the payment failed
+        LNbitsUnavailable: if LNbits timed out, couldn't be reached or returned
+            a 5xx. The outcome is unknown: the payment may still settle, so
+            callers must keep it pending and check the wallet's payments
+            before releasing or retrying it
     """
+    # Checked locally, so a bad invoice never costs an LNbits call
+    decoded = check_bolt11(payment_request, amount=amount) if BOLT11_VERIFY else None
+    
     try:
         # Print debug info
         print(f"Paying invoice with wallet_adminkey: {wallet_adminkey[:5] if wallet_adminkey else 'None'}..., payment_request: {payment_request[:20] if payment_request else 'None'}...")
         
-        # Make a direct API call to pay an invoice
-        url = f"{LNBITS_URL}/api/v1/payments"
+        # Make a direct API call to pay an invoice from the wallet's node
+        node = registry.node_for_key(wallet_adminkey)
+        url = f"{node.url}/api/v1/payments"
         headers = {
             "X-Api-Key": wallet_adminkey,
             "Content-type": "application/json"
@@ -108,7 +151,7 @@ def pay_invoice(wallet_adminkey: str, payment_request: str) -> Optional[Dict[str
         print(f"Sending request to: {url}")
         print(f"Request data: {data}")
         
-        response = requests.post(url, headers=headers, json=data)
+        response = guarded_request("pay_invoice", "POST", url, node=node.name, headers=headers, json=data)
         print(f"Response status: {response.status_code}")
         
         if response.status_code == 201 or response.status_code == 200:
@@ -124,17 +167,27 @@ def pay_invoice(wallet_adminkey: str, payment_request: str) -> Optional[Dict[str
                 "status": payment_data.get("status", "")
             }
             
+            if decoded and result["payment_hash"] != decoded.payment_hash:
+                print(f"ERROR: LNbits reported payment hash {result['payment_hash']} "
+                      f"for an invoice with payment hash {decoded.payment_hash}")
+            elif decoded:
+                remember(decoded)
+            
             print(f"Formatted payment data: {result}")
             return result
         else:
             print(f"Error from LNbits API: {response.status_code} - {response.text}")
             return None
+    except LNbitsUnavailable:
+        raise
     except Exception as e:
         import traceback
         print(f"Exception paying invoice: {str(e)}")
         print(traceback.format_exc())
         return None
 
+@tracer.wrap("lightning.get_wallet_balance")
+@rate_limited(LANE_READ, key="wallet_key")
 def get_wallet_balance(wallet_key: str) -> int:
     """
     Gets the current balance of a wallet
@@ -143,21 +196,27 @@ def get_wallet_balance(wallet_key: str) -> int:
         wallet_key (str): The wallet's adminkey
         
     Returns:
-        int: Wallet balance in satoshis (0 if error)
+        int: Wallet balance in satoshis
+        
+    Raises:
+        LNbitsUnavailable: if LNbits timed out, is down or its circuit is open
+        Exception: if LNbits rejected the request, so callers can fall back
+            to the ledger instead of showing a balance of 0
     """
     try:
         # Print debug info
         print(f"Getting wallet balance for key: {wallet_key[:5] if wallet_key else 'None'}...")
         
         # Make a direct API call to LNbits to get the wallet balance
-        url = f"{LNBITS_URL}/api/v1/wallet"
+        node = registry.node_for_key(wallet_key)
+        url = f"{node.url}/api/v1/wallet"
         headers = {
             "X-Api-Key": wallet_key,
             "Content-type": "application/json"
         }
         
         print(f"Making direct API call to: {url}")
-        response = requests.get(url, headers=headers)
+        response = guarded_request("get_wallet", "GET", url, node=node.name, headers=headers)
         
         if response.status_code == 200:
             wallet_data = response.json()
@@ -168,17 +227,19 @@ def get_wallet_balance(wallet_key: str) -> int:
             balance_sat = balance_msat // 1000
             
             print(f"Wallet balance: {balance_sat} sats (from {balance_msat} msats)")
+            for observer in balance_observers:
+                observer(wallet_key, balance_sat)
             return balance_sat
         else:
             print(f"Error response from LNbits: Status {response.status_code}, Content: {response.text}")
-            return 0
+            raise Exception(f"Couldn't fetch wallet balance: status {response.status_code}")
         
     except Exception as e:
-        import traceback
         print(f"Exception getting balance: {str(e)}")
-        print(traceback.format_exc())
-        return 0
+        raise
 
+@tracer.wrap("lightning.get_wallet_transactions")
+@rate_limited(LANE_READ, key="wallet_key")
 def get_wallet_transactions(wallet_key: str) -> list:
     """
     Gets transaction history for a wallet
@@ -188,19 +249,23 @@ def get_wallet_transactions(wallet_key: str) -> list:
         
     Returns:
         list: List of transactions
+        
+    Raises:
+        LNbitsUnavailable: if LNbits timed out, is down or its circuit is open
     """
     try:
         # Print debug info
         print(f"Getting transactions for wallet key: {wallet_key[:5] if wallet_key else 'None'}...")
         
         # Fetch transactions directly from LNbits API
-        url = f"{LNBITS_URL}/api/v1/payments"
+        node = registry.node_for_key(wallet_key)
+        url = f"{node.url}/api/v1/payments"
         headers = {
             "X-Api-Key": wallet_key,
             "Content-type": "application/json"
         }
         
-        response = requests.get(url, headers=headers)
+        response = guarded_request("list_payments", "GET", url, node=node.name, headers=headers)
         if response.status_code == 200:
             # Return parsed JSON of transactions
             transactions = response.json()
@@ -209,6 +274,8 @@ def get_wallet_transactions(wallet_key: str) -> list:
         else:
             print(f"Error getting transactions: {response.status_code} - {response.text}")
             return []
+    except LNbitsUnavailable:
+        raise
     except Exception as e:
         import traceback
         print(f"Exception getting transactions: {str(e)}")
@@ -0,0 +1,242 @@
+# lnbits_standin.py
+"""
+A minimal in-memory stand-in for an LNbits node, for trying out LNBITS_NODES
+locally without running several real LNbits instances.
+
+It implements the endpoints the app uses: creating accounts and wallets,
+reading and renaming a wallet, and creating, paying and listing payments.
+Invoices of another stand-in listed in --peers are settled by calling that
+peer, which stands in for routing the payment over Lightning. Every wallet also answers
+as a Lightning address, <wallet name>@<host:port>, for vendor payouts
+(with SETTLE_LNURL_SCHEME=http).
+
+Usage:
+    python lnbits_standin.py --port 5001 --admin-key adminA --balance 100000 \
+        --peers http://localhost:5002
+"""
+import argparse
+import hashlib
+import json
+import secrets
+import threading
+from datetime import datetime, timedelta, timezone
+
+import requests
+from flask import Flask, jsonify, request
+
+from bolt11 import encode as encode_bolt11
+
+app = Flask(__name__)
+
+wallets = {}    # wallet id -> wallet dict
+keys = {}       # adminkey or inkey -> (wallet id, is_admin)
+invoices = {}   # bolt11 -> invoice dict
+payments = {}   # wallet id -> list of payment dicts
+peers = []
+lock = threading.Lock()
+
+INVOICE_EXPIRY = 3600
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _new_wallet(name, balance_msat=0, adminkey=None):
+    wallet = {
+        "id": secrets.token_hex(16),
+        "user": secrets.token_hex(16),
+        "name": name,
+        "adminkey": adminkey or secrets.token_hex(16),
+        "inkey": secrets.token_hex(16),
+        "deleted": False,
+        "currency": "sat",
+        "balance_msat": balance_msat,
+        "created_at": _now(),
+        "updated_at": _now(),
+        "extra": {},
+    }
+    wallets[wallet["id"]] = wallet
+    keys[wallet["adminkey"]] = (wallet["id"], True)
+    keys[wallet["inkey"]] = (wallet["id"], False)
+    payments[wallet["id"]] = []
+    return wallet
+
+
+def _wallet_for_request(admin_required=False):
+    wallet_id, is_admin = keys.get(request.headers.get("X-Api-Key", ""), (None, False))
+    if wallet_id is None or (admin_required and not is_admin):
+        return None
+    return wallets[wallet_id]
+
+
+def _payment(wallet, invoice, amount_msat, fee=0):
+    entry = dict(invoice, wallet_id=wallet["id"], amount=amount_msat, fee=fee,
+                 status="success", time=_now(), updated_at=_now())
+    payments[wallet["id"]].append(entry)
+    return entry
+
+
+def _new_invoice(wallet, amount, memo=""):
+    preimage = secrets.token_hex(32)
+    payment_hash = hashlib.sha256(bytes.fromhex(preimage)).hexdigest()
+    # A well-formed but unsigned BOLT11 invoice, so the app's decoder can read it
+    bolt11 = encode_bolt11(amount * 1000, payment_hash, memo, expiry=INVOICE_EXPIRY)
+    invoice = {
+        "checking_id": payment_hash,
+        "payment_hash": payment_hash,
+        "wallet_id": wallet["id"],
+        "amount": amount * 1000,
+        "fee": 0,
+        "bolt11": bolt11,
+        "payment_request": bolt11,
+        "status": "pending",
+        "memo": memo,
+        "expiry": (datetime.now(timezone.utc) + timedelta(seconds=INVOICE_EXPIRY)).isoformat(),
+        "webhook": "",
+        "webhook_status": 0,
+        "preimage": preimage,
+        "tag": "",
+        "extension": "",
+        "time": _now(),
+        "created_at": _now(),
+        "updated_at": _now(),
+        "extra": {},
+    }
+    invoices[invoice["bolt11"]] = invoice
+    return invoice
+
+
+@app.route('/api/v1/account', methods=['POST'])
+def create_account():
+    with lock:
+        wallet = _new_wallet(request.json.get("name", "account"))
+    return jsonify(wallet)
+
+
+@app.route('/api/v1/wallet', methods=['GET', 'POST', 'PATCH'])
+def wallet_resource():
+    with lock:
+        if request.method == 'PATCH':
+            wallet = _wallet_for_request(admin_required=True)
+            if wallet is None:
+                return jsonify({"detail": "Invalid adminkey"}), 401
+            wallet["name"] = (request.json or {}).get("name", wallet["name"])
+            return jsonify(wallet)
+        if request.method == 'POST':
+            if _wallet_for_request(admin_required=True) is None:
+                return jsonify({"detail": "Invalid adminkey"}), 401
+            return jsonify(_new_wallet(request.json.get("name", "wallet")))
+        wallet = _wallet_for_request()
+        if wallet is None:
+            return jsonify({"detail": "Wallet not found"}), 404
+        return jsonify({"name": wallet["name"], "balance": wallet["balance_msat"]})
+
+
+@app.route('/api/v1/payments', methods=['GET', 'POST'])
+def payments_resource():
+    if request.method == 'GET':
+        with lock:
+            wallet = _wallet_for_request()
+            if wallet is None:
+                return jsonify({"detail": "Wallet not found"}), 404
+            return jsonify(list(reversed(payments[wallet["id"]])))
+
+    data = request.json or {}
+    if not data.get("out"):
+        with lock:
+            wallet = _wallet_for_request()
+            if wallet is None:
+                return jsonify({"detail": "Wallet not found"}), 404
+            invoice = _new_invoice(wallet, int(data.get("amount", 0)), data.get("memo", ""))
+        return jsonify(invoice), 201
+
+    bolt11 = data.get("bolt11", "")
+    with lock:
+        wallet = _wallet_for_request(admin_required=True)
+        if wallet is None:
+            return jsonify({"detail": "Invalid adminkey"}), 401
+        invoice = invoices.get(bolt11)
+        amount_msat = invoice["amount"] if invoice else None
+        if invoice is not None:
+            if invoice["status"] != "pending":
+                return jsonify({"detail": "Invoice already paid"}), 400
+            if wallet["balance_msat"] < amount_msat:
+                return jsonify({"detail": "Insufficient balance"}), 400
+            wallet["balance_msat"] -= amount_msat
+            invoice["status"] = "success"
+            payee = wallets[invoice["wallet_id"]]
+            payee["balance_msat"] += amount_msat
+            _payment(payee, invoice, amount_msat)
+            return jsonify(_payment(wallet, invoice, -amount_msat)), 201
+
+    # Not one of ours: settle it on the peer that issued it
+    for peer in peers:
+        response = requests.post(f"{peer}/standin/settle", json={"bolt11": bolt11}, timeout=5)
+        if response.status_code != 200:
+            continue
+        invoice = response.json()
+        with lock:
+            if wallet["balance_msat"] < invoice["amount"]:
+                return jsonify({"detail": "Insufficient balance"}), 400
+            wallet["balance_msat"] -= invoice["amount"]
+            return jsonify(_payment(wallet, invoice, -invoice["amount"])), 201
+    return jsonify({"detail": "Unknown invoice"}), 400
+
+
+@app.route('/.well-known/lnurlp/<name>')
+def lnurlp(name):
+    """LNURL-pay parameters of the wallet called `name`"""
+    with lock:
+        wallet = next((w for w in wallets.values() if w["name"] == name), None)
+    if wallet is None:
+        return jsonify({"status": "ERROR", "reason": "Unknown address"}), 404
+    return jsonify({
+        "tag": "payRequest",
+        "callback": f"{request.host_url}standin/lnurlp/{wallet['id']}",
+        "minSendable": 1000,
+        "maxSendable": 100_000_000_000,
+        "metadata": json.dumps([["text/plain", f"Payment to {name}"]]),
+    })
+
+
+@app.route('/standin/lnurlp/<wallet_id>')
+def lnurlp_callback(wallet_id):
+    amount_msat = request.args.get("amount", type=int)
+    with lock:
+        wallet = wallets.get(wallet_id)
+        if wallet is None or not amount_msat:
+            return jsonify({"status": "ERROR", "reason": "Bad request"}), 400
+        invoice = _new_invoice(wallet, amount_msat // 1000, "Lightning address payment")
+    return jsonify({"pr": invoice["bolt11"], "routes": []})
+
+
+@app.route('/standin/settle', methods=['POST'])
+def settle():
+    """Marks one of this node's invoices paid on behalf of a peer"""
+    with lock:
+        invoice = invoices.get((request.json or {}).get("bolt11", ""))
+        if invoice is None or invoice["status"] != "pending":
+            return jsonify({"detail": "Unknown invoice"}), 404
+        invoice["status"] = "success"
+        payee = wallets[invoice["wallet_id"]]
+        payee["balance_msat"] += invoice["amount"]
+        _payment(payee, invoice, invoice["amount"])
+        return jsonify(invoice)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an in-memory LNbits stand-in")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--admin-key", required=True, help="adminkey of the funding wallet")
+    parser.add_argument("--balance", type=int, default=0, help="funding wallet balance in sats")
+    parser.add_argument("--peers", default="", help="comma-separated URLs of other stand-ins")
+    args = parser.parse_args(argv)
+
+    peers.extend(url.rstrip('/') for url in args.peers.split(",") if url)
+    _new_wallet("admin", args.balance * 1000, adminkey=args.admin_key)
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+# memory.py
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Start tracemalloc at import, so allocation sites cover the whole process.
+# It slows allocation down, less so with fewer frames per traceback.
+MEMORY_TRACE = os.getenv("MEMORY_TRACE", "False").lower() in ["true", "1", "t"]
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "1"))
+# Items measured per structure; larger structures are estimated from a sample
+MEMORY_SAMPLE_SIZE = int(os.getenv("MEMORY_SAMPLE_SIZE", "200"))
+# Reports requested sooner than this after the last one are served from it
+MEMORY_MIN_INTERVAL = float(os.getenv("MEMORY_MIN_INTERVAL", "10"))
+MEMORY_TOP = int(os.getenv("MEMORY_TOP", "15"))
+# Traced blocks aggregated per report; with more, every n-th block is taken and scaled up
+MEMORY_TRACE_SAMPLE = int(os.getenv("MEMORY_TRACE_SAMPLE", "100000"))
+
+# How deep into nested containers an item is followed
+_MAX_DEPTH = 6
+# Followed only for their size, never into what they refer to
+_OPAQUE = (type, type(sys), type(len), type(lambda: None), threading.Thread)
+# Frames of the diagnostics themselves, left out of allocation sites
+_IGNORED = (tracemalloc.__file__, __file__, "<frozen importlib._bootstrap>",
+            "<frozen importlib._bootstrap_external>", "<unknown>")
+
+
+def _children(obj) -> list:
+    if isinstance(obj, dict):
+        return list(itertools.chain.from_iterable(obj.items()))
+    if isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        return list(obj)
+    if hasattr(obj, "__dict__") and not isinstance(obj, _OPAQUE):
+        return [obj.__dict__]
+    if hasattr(type(obj), "__slots__"):
+        return [getattr(obj, slot) for slot in type(obj).__slots__ if hasattr(obj, slot)]
+    return []
+
+
+def deep_size(obj, seen: Optional[set] = None, depth: int = 0) -> int:
+    """Bytes of an object and everything it holds, counting shared objects once"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if depth < _MAX_DEPTH and not isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        for child in _children(obj):
+            size += deep_size(child, seen, depth + 1)
+    return size
+
+
+def estimate_size(obj, sample_size: int = MEMORY_SAMPLE_SIZE) -> Dict[str, Any]:
+    """
+    Estimates the memory held by a structure from at most `sample_size` of
+    its items, spread evenly over it.
+
+    Returns:
+        - a dict with items, bytes, sampled items and whether bytes is exact
+    """
+    if isinstance(obj, (dict, list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        count = len(obj)
+        step = max(1, count // max(1, sample_size))
+        source = obj.items() if isinstance(obj, dict) else obj
+        for _ in range(3):
+            try:
+                # A slice with a step is taken in C, so skipped items cost next to nothing
+                sample = list(itertools.islice(source, 0, None, step))[:sample_size]
+                break
+            except RuntimeError:
+                # The structure changed while sampled; take a fresh one
+                continue
+        else:
+            return {"items": count, "bytes": None, "sampled": 0, "exact": False}
+        seen = {id(obj)}
+        per_item = sum(deep_size(item, seen) for item in sample)
+        exact = len(sample) == count
+        items_bytes = per_item if exact else int(per_item / max(1, len(sample)) * count)
+        return {"items": count, "bytes": sys.getsizeof(obj) + items_bytes,
+                "sampled": len(sample), "exact": exact}
+    if isinstance(obj, Sequence) and not isinstance(obj, (str, bytes)):
+        # Another sequence, like a ledger view: sample it by position
+        count = len(obj)
+        step = max(1, count // max(1, sample_size))
+        sample = [obj[index] for index in range(0, count, step)][:sample_size]
+        seen = set()
+        per_item = sum(deep_size(item, seen) for item in sample)
+        exact = len(sample) == count
+        items_bytes = per_item if exact else int(per_item / max(1, len(sample)) * count)
+        # Plus a list slot per item
+        return {"items": count, "bytes": sys.getsizeof(obj) + items_bytes + 8 * count,
+                "sampled": len(sample), "exact": exact}
+    # An object like a cache or index: size each of its attributes
+    attributes = {name: value for name, value in vars(obj).items() if not isinstance(value, _OPAQUE)}
+    parts = [estimate_size(value, sample_size) if isinstance(value, (dict, list, set, tuple))
+             or type(value).__name__ == "deque" else
+             {"items": None, "bytes": deep_size(value), "sampled": 0, "exact": True}
+             for value in attributes.values()]
+    return {
+        "items": len(obj) if hasattr(obj, "__len__") else None,
+        "bytes": sys.getsizeof(obj) + sum(part["bytes"] or 0 for part in parts),
+        "sampled": sum(part["sampled"] for part in parts),
+        "exact": all(part["exact"] for part in parts),
+    }
+
+
+def process_memory() -> Dict[str, Optional[int]]:
+    """Current and peak resident memory in bytes, where the platform tells"""
+    result = {"rss": None, "peak_rss": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss" if line.startswith("VmRSS") else "peak_rss"
+                    result[key] = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Kilobytes on Linux, bytes on macOS
+            result["peak_rss"] = peak if sys.platform == "darwin" else peak * 1024
+        except ImportError:
+            pass
+    return result
+
+
+def allocation_sites(sample: int = MEMORY_TRACE_SAMPLE) -> Tuple[Dict[str, Tuple[int, int]], int, int]:
+    """
+    Bytes and blocks per allocation site (file:line of the newest frame)
+    from the traced blocks, like Snapshot.statistics("lineno").
+
+    Snapshot filtering and grouping build an object per block, which takes
+    seconds with a large heap; where the interpreter exposes the raw traces
+    they are grouped here instead, and only every n-th one when there are
+    more than `sample`. Otherwise the public snapshot API is used.
+
+    Returns:
+        - (sites, blocks sampled, blocks traced)
+    """
+    # (domain, size, frames newest first, ...) per block; what take_snapshot() uses.
+    # Private, so its absence or a changed shape falls back to the snapshot.
+    get_traces = getattr(tracemalloc, "_get_traces", None)
+    if get_traces is not None:
+        try:
+            return _group_traces(get_traces(), sample)
+        except (TypeError, ValueError, IndexError):
+            pass
+    return _snapshot_sites()
+
+
+def _group_traces(traces: list, sample: int) -> Tuple[Dict[str, Tuple[int, int]], int, int]:
+    step = max(1, len(traces) // max(1, sample))
+    totals: Dict[tuple, list] = {}
+    for trace in traces[::step]:
+        frame = tuple(trace[2][0]) if trace[2] else ("<unknown>", 0)
+        entry = totals.get(frame)
+        if entry is None:
+            totals[frame] = [int(trace[1]), 1]
+        else:
+            entry[0] += trace[1]
+            entry[1] += 1
+    sites = {f"{filename}:{lineno}": (size * step, count * step)
+             for (filename, lineno), (size, count) in totals.items() if filename not in _IGNORED}
+    return sites, len(traces[::step]), len(traces)
+
+
+def _snapshot_sites() -> Tuple[Dict[str, Tuple[int, int]], int, int]:
+    snapshot = tracemalloc.take_snapshot()
+    total = len(snapshot.traces)
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, filename) for filename in _IGNORED])
+    sites = {f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}": (stat.size, stat.count)
+             for stat in snapshot.statistics("lineno")}
+    return sites, total, total
+
+
+class MemoryDiagnostics:
+    """
+    Reports where a long-running worker's memory goes.
+
+    Structures registered with track() are sized by walking a sample of
+    their items and extrapolating, so sizing a large ledger costs about as
+    much as sizing a small one. When tracemalloc is tracing, a report also
+    lists the top allocation sites and those that grew most since the
+    previous report. Reports are reused for `min_interval` seconds, which
+    keeps the endpoint cheap enough to poll.
+    """
+
+    def __init__(self, sample_size: int = MEMORY_SAMPLE_SIZE, min_interval: float = MEMORY_MIN_INTERVAL,
+                 top: int = MEMORY_TOP, trace_sample: int = MEMORY_TRACE_SAMPLE):
+        self.sample_size = sample_size
+        self.min_interval = min_interval
+        self.top = top
+        self._structures: Dict[str, Callable[[], Any]] = {}
+        self._lock = threading.Lock()
+        self._report = None
+        self._report_at = 0.0
+        self._previous_sizes: Dict[str, int] = {}
+        self._previous_sites = None
+        self._previous_time = None
+        self.trace_sample = trace_sample
+
+    def track(self, name: str, getter: Callable[[], Any]):
+        """Registers a structure by a function returning it, so rebinding it is followed"""
+        self._structures[name] = getter
+
+    @staticmethod
+    def start_tracing(frames: int = MEMORY_TRACE_FRAMES):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, frames))
+
+    def stop_tracing(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._previous_sites = None
+            self._report = None
+
+    def report(self, force: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            if self._report and not force and now - self._report_at < self.min_interval:
+                return dict(self._report, cached=True)
+            self._report = self._build()
+            self._report_at = now
+            return dict(self._report, cached=False)
+
+    def _build(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        structures = {}
+        for name, getter in self._structures.items():
+            entry = estimate_size(getter(), self.sample_size)
+            if entry["bytes"] is not None and name in self._previous_sizes:
+                entry["bytes_diff"] = entry["bytes"] - self._previous_sizes[name]
+            structures[name] = entry
+        self._previous_sizes = {name: entry["bytes"] for name, entry in structures.items()
+                                if entry["bytes"] is not None}
+
+        report = {
+            "time": datetime.now().isoformat(),
+            "since": self._previous_time,
+            "process": process_memory(),
+            "structures": structures,
+            "tracing": tracemalloc.is_tracing(),
+        }
+        if tracemalloc.is_tracing():
+            sites, sampled, total = allocation_sites(self.trace_sample)
+            current, peak = tracemalloc.get_traced_memory()
+            report["traced"] = {"current": current, "peak": peak,
+                                "overhead": tracemalloc.get_tracemalloc_memory(),
+                                "blocks": total, "sampled_blocks": sampled}
+            top = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)[:self.top]
+            report["top_sites"] = [{"site": site, "bytes": size, "blocks": count} for site, (size, count) in top]
+            if self._previous_sites is not None:
+                growth = []
+                for site, (size, count) in sites.items():
+                    previous_size, previous_count = self._previous_sites.get(site, (0, 0))
+                    if size > previous_size:
+                        growth.append({"site": site, "bytes": size, "bytes_diff": size - previous_size,
+                                       "blocks_diff": count - previous_count})
+                growth.sort(key=lambda site: site["bytes_diff"], reverse=True)
+                report["growth"] = growth[:self.top]
+            # Only totals per site are kept for the next report, not the snapshot
+            self._previous_sites = sites
+        self._previous_time = report["time"]
+        report["took_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return report
+
+
+memory_diagnostics = MemoryDiagnostics()
+
+if MEMORY_TRACE:
+    memory_diagnostics.start_tracing()
@@ -0,0 +1,134 @@
+# nodes.py
+import bisect
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from circuit import DEFAULT_NODE
+
+# LNBITS_NODES lists the LNbits backends as JSON, inline or in a file:
+#     [{"name": "a", "url": "http://localhost:5001", "admin_key": "..."},
+#      {"name": "b", "url": "http://localhost:5002", "admin_key": "..."}]
+# Without it the single LNBITS_URL / ADMIN_KEY node is used.
+LNBITS_NODES = os.getenv("LNBITS_NODES", "")
+LNBITS_PLACEMENT = os.getenv("LNBITS_PLACEMENT", "hash")  # "hash" or "least_load"
+VIRTUAL_NODES = int(os.getenv("LNBITS_VIRTUAL_NODES", "100"))
+
+
+class LNbitsNode:
+    """One LNbits backend and the admin wallet that funds recipients on it"""
+
+    def __init__(self, name: str, url: str, admin_key: str, weight: int = 1):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.admin_key = admin_key
+        self.weight = max(1, int(weight))
+        self.wallets = 0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "url": self.url,
+            "weight": self.weight,
+            "wallets": self.wallets
+        }
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+class NodeRegistry:
+    """
+    Places wallets on LNbits nodes and routes calls to the node holding a key.
+
+    Placement uses a consistent-hash ring with virtual nodes, so adding a node
+    only moves the share of new placements that the node takes over, or picks
+    the node with the fewest wallets relative to its weight. Every wallet key
+    created through the registry is remembered, so calls made with just a key
+    (as in lightning.py) reach the right node.
+    """
+
+    def __init__(self, nodes: List[LNbitsNode], placement: str = LNBITS_PLACEMENT):
+        if not nodes:
+            raise ValueError("At least one LNbits node is required")
+        self.nodes: Dict[str, LNbitsNode] = {node.name: node for node in nodes}
+        self.default = nodes[0]
+        self.placement = placement
+        self._key_nodes: Dict[str, str] = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._ring = []
+        for node in nodes:
+            for replica in range(VIRTUAL_NODES * node.weight):
+                self._ring.append((_hash(f"{node.name}#{replica}"), node.name))
+        self._ring.sort()
+        self._ring_points = [point for point, _ in self._ring]
+        for node in nodes:
+            self._key_nodes[node.admin_key] = node.name
+
+    @classmethod
+    def from_env(cls, default_url: str, default_admin_key: str) -> "NodeRegistry":
+        """Builds the registry from LNBITS_NODES, falling back to a single node"""
+        config = LNBITS_NODES.strip()
+        if not config:
+            return cls([LNbitsNode(DEFAULT_NODE, default_url, default_admin_key)])
+        if not config.startswith("["):
+            with open(config, 'r') as f:
+                config = f.read()
+        entries = json.loads(config)
+        nodes = [LNbitsNode(entry["name"], entry["url"], entry["admin_key"], entry.get("weight", 1))
+                 for entry in entries]
+        print(f"Configured {len(nodes)} LNbits nodes: {', '.join(node.name for node in nodes)}")
+        return cls(nodes)
+
+    def get(self, name: Optional[str]) -> LNbitsNode:
+        """Returns a node by name; unknown or missing names map to the default node"""
+        return self.nodes.get(name or "", self.default)
+
+    def _hash_placement(self, entity_id: str) -> LNbitsNode:
+        index = bisect.bisect(self._ring_points, _hash(entity_id)) % len(self._ring)
+        return self.nodes[self._ring[index][1]]
+
+    def place(self, entity_id: str) -> LNbitsNode:
+        """Chooses the node for a new recipient or vendor wallet"""
+        with self._lock:
+            if self.placement == "least_load":
+                node = min(self.nodes.values(), key=lambda node: node.wallets / node.weight)
+            else:
+                node = self._hash_placement(entity_id)
+            return node
+
+    def register_wallet(self, node_name: str, *keys: str):
+        """Records which node holds a wallet's keys"""
+        with self._lock:
+            node = self.get(node_name)
+            node.wallets += 1
+            for key in keys:
+                if key:
+                    self._key_nodes[key] = node.name
+
+    def node_for_key(self, wallet_key: Optional[str]) -> LNbitsNode:
+        return self.get(self._key_nodes.get(wallet_key or ""))
+
+    def client(self, node_name: Optional[str] = None):
+        """Returns the LNbits service client of a node"""
+        from service import LNbits
+        node = self.get(node_name)
+        with self._lock:
+            client = self._clients.get(node.name)
+            if client is None:
+                client = self._clients[node.name] = LNbits(node.url, node=node.name)
+            return client
+
+    def stats(self) -> list:
+        with self._lock:
+            return [node.to_dict() for node in self.nodes.values()]
+
+
+registry = NodeRegistry.from_env(
+    os.getenv("LNBITS_URL", "http://localhost:5001"),
+    os.getenv("ADMIN_KEY", "9bca41d2b0f540f08393cde5dd13b178")
+)
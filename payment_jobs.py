@@ -0,0 +1,232 @@
+# payment_jobs.py
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Optional, Dict, Any
+
+from tracing import tracer
+from utils import generate_id
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+# The payment may have gone out; it holds its reservation until reconciled
+UNKNOWN = "unknown"
+
+
+class PaymentUnknown(Exception):
+    """
+    Raised by a payment task when the payment was sent but its outcome isn't
+    known, e.g. LNbits timed out. The payment may still settle, so the job is
+    neither completed nor failed until reconciled.
+
+    Attributes:
+        - payment_request (str): the BOLT11 invoice that was being paid
+    """
+
+    def __init__(self, message: str, payment_request: str):
+        super().__init__(message)
+        self.payment_request = payment_request
+
+
+class PaymentJob:
+    """A payment accepted by a request thread and carried out by the worker pool"""
+
+    def __init__(self, recipient_id, vendor_id, amount, transaction_id=None):
+        self.id = generate_id("J")
+        self.recipient_id = recipient_id
+        self.vendor_id = vendor_id
+        self.amount = amount
+        self.transaction_id = transaction_id
+        self.status = QUEUED
+        self.message = "Payment queued"
+        self.payment_hash = None
+        self.payment_request = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.status in (COMPLETE, FAILED)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "recipient_id": self.recipient_id,
+            "vendor_id": self.vendor_id,
+            "amount": self.amount,
+            "transaction_id": self.transaction_id,
+            "status": self.status,
+            "message": self.message,
+            "payment_hash": self.payment_hash,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class PaymentPipeline:
+    """
+    Runs queued payments on a bounded worker pool.
+
+    Jobs that are queued, running or of unknown outcome hold a reservation on
+    the recipient's balance; `reserved()` reports it so validation of later
+    payments can account for money that is about to leave the wallet. A job
+    of unknown outcome is reconciled every `reconcile_interval` seconds until
+    it is known to have completed or failed.
+    """
+
+    def __init__(self, workers: int = 4, max_finished: int = 10000, reconcile_interval: float = 30.0):
+        self.workers = workers
+        self.max_finished = max_finished
+        self.reconcile_interval = reconcile_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="payment")
+        self._jobs: "OrderedDict[str, PaymentJob]" = OrderedDict()
+        self._finished = 0
+        self._lock = threading.Lock()
+        self._recipient_locks = defaultdict(threading.Lock)
+
+    def recipient_lock(self, recipient_id: str) -> threading.Lock:
+        """
+        Lock to hold while validating and reserving a payment, so that two
+        concurrent requests cannot both pass against the same balance.
+        """
+        with self._lock:
+            return self._recipient_locks[recipient_id]
+
+    def reserved(self, recipient_id: str) -> int:
+        """Sats held by this recipient's queued and running jobs"""
+        with self._lock:
+            return sum(job.amount for job in self._jobs.values()
+                       if job.recipient_id == recipient_id and not job.done)
+
+    def submit(self, job: PaymentJob, task: Callable[[PaymentJob], Dict[str, Any]],
+               on_done: Optional[Callable[[PaymentJob], None]] = None,
+               reconcile: Optional[Callable[[PaymentJob], Optional[Dict[str, Any]]]] = None) -> PaymentJob:
+        """
+        Queues a job.
+
+        Args:
+            - job (PaymentJob): the job, already validated and reserved
+            - task (callable): performs the payment and returns the payment data;
+                raises PaymentUnknown if the outcome isn't known
+            - on_done (callable, optional): called with the job once it finished,
+                successfully or not, to update the ledger
+            - reconcile (callable, optional): looks up a payment of unknown
+                outcome; returns the payment data once it settled, None while
+                it's still unknown, and raises if it failed. Without it an
+                unknown outcome fails the job.
+        """
+        with self._lock:
+            self._jobs[job.id] = job
+        print(f"Queued payment job {job.id}: {job.amount} sats from {job.recipient_id} to {job.vendor_id}")
+        # The worker traces the payment under its own id, linked to the request's
+        self._executor.submit(self._run, job, task, on_done, reconcile, tracer.current_trace_id())
+        return job
+
+    def track(self, job: PaymentJob, payment_request: str,
+              on_done: Optional[Callable[[PaymentJob], None]],
+              reconcile: Callable[[PaymentJob], Optional[Dict[str, Any]]]) -> PaymentJob:
+        """
+        Takes over a payment of unknown outcome made outside the pool, e.g.
+        a synchronous payment that timed out, so it holds its reservation and
+        is reconciled like a job.
+        """
+        job.status = UNKNOWN
+        job.payment_request = payment_request
+        job.message = "Payment sent, waiting for LNbits to confirm it"
+        with self._lock:
+            self._jobs[job.id] = job
+        print(f"Tracking payment {job.id} of unknown outcome: {job.amount} sats from {job.recipient_id}")
+        self._schedule(job, on_done, reconcile)
+        return job
+
+    def _run(self, job, task, on_done, reconcile=None, request_trace_id=None):
+        with tracer.trace("payment_job", job_id=job.id, request_trace_id=request_trace_id) as span:
+            self._process(job, task, on_done, reconcile, span)
+
+    def _process(self, job, task, on_done, reconcile, span):
+        job.status = RUNNING
+        job.message = "Payment in progress"
+        try:
+            payment = task(job)
+            job.payment_hash = payment.get("payment_hash")
+            job.status = COMPLETE
+            job.message = f"Payment of {job.amount} sats completed successfully"
+        except PaymentUnknown as e:
+            print(f"Payment job {job.id} has an unknown outcome: {str(e)}")
+            span.set(outcome=UNKNOWN)
+            if reconcile is not None:
+                job.status = UNKNOWN
+                job.payment_request = e.payment_request
+                job.message = "Payment sent, waiting for LNbits to confirm it"
+                self._schedule(job, on_done, reconcile)
+                return
+            job.status = FAILED
+            job.message = f"Error processing vendor payment: {str(e)}"
+            span.fail(e)
+        except Exception as e:
+            import traceback
+            print(f"Payment job {job.id} failed: {str(e)}")
+            print(traceback.format_exc())
+            job.status = FAILED
+            job.message = f"Error processing vendor payment: {str(e)}"
+            span.fail(e)
+        self._finish(job, on_done)
+
+    def _schedule(self, job, on_done, reconcile):
+        timer = threading.Timer(self.reconcile_interval,
+                                lambda: self._executor.submit(self._reconcile, job, on_done, reconcile))
+        timer.daemon = True
+        timer.start()
+
+    def _reconcile(self, job, on_done, reconcile):
+        with tracer.trace("payment_reconcile", job_id=job.id) as span:
+            try:
+                payment = reconcile(job)
+            except Exception as e:
+                print(f"Payment job {job.id} failed on reconciliation: {str(e)}")
+                job.status = FAILED
+                job.message = f"Error processing vendor payment: {str(e)}"
+                span.fail(e)
+            else:
+                if payment is None:
+                    # Still unknown; the reservation stays until it's settled either way
+                    self._schedule(job, on_done, reconcile)
+                    return
+                job.payment_hash = payment.get("payment_hash")
+                job.status = COMPLETE
+                job.message = f"Payment of {job.amount} sats completed successfully"
+            print(f"Payment job {job.id} reconciled: {job.status}")
+            self._finish(job, on_done)
+
+    def _finish(self, job, on_done):
+        job.finished_at = datetime.now()
+
+        if on_done:
+            try:
+                on_done(job)
+            except Exception as e:
+                print(f"Error finishing payment job {job.id}: {str(e)}")
+
+        with self._lock:
+            self._finished += 1
+            # Forget the oldest finished jobs once the history is full
+            if self._finished > self.max_finished:
+                for job_id in list(self._jobs):
+                    if self._jobs[job_id].done:
+                        del self._jobs[job_id]
+                        self._finished -= 1
+                        break
+
+    def get(self, job_id: str) -> Optional[PaymentJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = defaultdict(int)
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {"workers": self.workers, "jobs": dict(counts)}
@@ -0,0 +1,250 @@
+# policy.py
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Policies are read from a JSON file and recompiled whenever it changes:
+#
+# {
+#     "rules": [
+#         {"type": "allow_categories", "categories": ["food", "medicine"]},
+#         {"type": "category_cap", "category": "food", "period": "daily", "limit": 5000},
+#         {"type": "category_cap", "category": "*", "period": "monthly", "limit": 100000,
+#          "recipients": ["R1a2b3c4d"]},
+#         {"type": "vendor_block", "vendors": ["V1a2b3c4d"]},
+#         {"type": "time_window", "category": "medicine", "start": "08:00", "end": "20:00"}
+#     ]
+# }
+#
+# Every rule applies to all recipients unless it lists "recipients". A
+# recipient-specific category allow-list replaces the program-wide one.
+POLICY_FILE = os.getenv("POLICY_FILE", "policy.json")
+POLICY_RELOAD_INTERVAL = float(os.getenv("POLICY_RELOAD_INTERVAL", "2"))
+ALLOWED_CATEGORIES = [c.strip() for c in os.getenv("ALLOWED_CATEGORIES", "food,medicine").split(",") if c.strip()]
+
+ANY = "*"
+PERIODS = ("daily", "monthly")
+
+# Looks up how much a recipient already spent: (period, category) -> sats
+SpendLookup = Callable[[str, str], int]
+
+
+class PolicyError(Exception):
+    """Raised when a policy file cannot be compiled"""
+
+
+class CategoryCap:
+    def __init__(self, category: str, period: str, limit: int):
+        if period not in PERIODS:
+            raise PolicyError(f"Unknown cap period '{period}'")
+        self.category = category
+        self.period = period
+        self.limit = int(limit)
+
+    def check(self, category: str, amount: int, now: datetime, spent: SpendLookup) -> Optional[str]:
+        already = spent(self.period, self.category)
+        if already + amount > self.limit:
+            scope = "total" if self.category == ANY else f"'{self.category}'"
+            return (f"{self.period.capitalize()} {scope} spending cap exceeded "
+                    f"(cap: {self.limit} sats, already spent: {already} sats)")
+        return None
+
+
+class TimeWindow:
+    def __init__(self, start: str, end: str):
+        try:
+            self.start = datetime.strptime(start, "%H:%M").time()
+            self.end = datetime.strptime(end, "%H:%M").time()
+        except (TypeError, ValueError):
+            raise PolicyError(f"Invalid time window {start}-{end}, expected HH:MM")
+        self.label = f"{start}-{end}"
+
+    def check(self, category: str, amount: int, now: datetime, spent: SpendLookup) -> Optional[str]:
+        current = now.time()
+        if self.start <= self.end:
+            inside = self.start <= current <= self.end
+        else:
+            # Window spans midnight, e.g. 22:00-06:00
+            inside = current >= self.start or current <= self.end
+        if not inside:
+            return f"Payments for '{category}' are only allowed between {self.label}"
+        return None
+
+
+class CompiledPolicy:
+    """
+    Policy rules compiled into lookup tables.
+
+    Checks are stored under (recipient, category) keys, where either part may be
+    the wildcard, so evaluating a payment costs four dictionary lookups plus the
+    rules that actually apply to it, regardless of how many rules exist.
+    """
+
+    def __init__(self, rules: List[dict], source: str = "defaults"):
+        self.source = source
+        self.rule_count = len(rules)
+        self.loaded_at = datetime.now()
+        self.allowed: Dict[str, frozenset] = {}
+        self.blocked: Dict[str, frozenset] = {}
+        self.checks: Dict[Tuple[str, str], list] = {}
+
+        for number, rule in enumerate(rules, start=1):
+            try:
+                self._compile(rule)
+            except PolicyError as e:
+                raise PolicyError(f"Rule {number}: {str(e)}")
+            except (KeyError, TypeError, ValueError) as e:
+                raise PolicyError(f"Rule {number}: invalid or missing field {str(e)}")
+
+        if ANY not in self.allowed:
+            self.allowed[ANY] = frozenset(ALLOWED_CATEGORIES)
+
+    def _compile(self, rule: dict):
+        rule_type = rule["type"]
+        recipients = rule.get("recipients", [ANY])
+        if isinstance(recipients, str):
+            recipients = [recipients]
+
+        for recipient_id in recipients:
+            if rule_type == "allow_categories":
+                self.allowed[recipient_id] = self.allowed.get(recipient_id, frozenset()) | frozenset(rule["categories"])
+            elif rule_type == "vendor_block":
+                self.blocked[recipient_id] = self.blocked.get(recipient_id, frozenset()) | frozenset(rule["vendors"])
+            elif rule_type == "category_cap":
+                category = rule.get("category", ANY)
+                check = CategoryCap(category, rule.get("period", "daily"), rule["limit"])
+                self.checks.setdefault((recipient_id, category), []).append(check)
+            elif rule_type == "time_window":
+                category = rule.get("category", ANY)
+                check = TimeWindow(rule["start"], rule["end"])
+                self.checks.setdefault((recipient_id, category), []).append(check)
+            else:
+                raise PolicyError(f"Unknown rule type '{rule_type}'")
+
+    def allowed_categories(self, recipient_id: str) -> frozenset:
+        return self.allowed.get(recipient_id, self.allowed[ANY])
+
+    def applicable(self, recipient_id: str, category: str) -> list:
+        """Returns the checks that apply to a (recipient, category) pair"""
+        checks = []
+        for key in ((recipient_id, category), (recipient_id, ANY), (ANY, category), (ANY, ANY)):
+            checks.extend(self.checks.get(key, ()))
+        return checks
+
+    def evaluate(self, recipient_id: str, vendor_id: str, category: str, amount: int,
+                 spent: SpendLookup, now: Optional[datetime] = None) -> Tuple[bool, str]:
+        """
+        Evaluates a payment against the rules that apply to it.
+
+        Args:
+            - recipient_id (str): the paying recipient
+            - vendor_id (str): the vendor being paid
+            - category (str): the vendor's category
+            - amount (int): the payment amount in sats
+            - spent (callable): (period, category) -> sats already spent, only
+                called when a cap applies; category may be the wildcard
+            - now (datetime, optional): evaluation time, defaults to now
+
+        Returns:
+            - (bool, str) indicating if the payment is allowed and a message
+        """
+        if vendor_id in self.blocked.get(recipient_id, ()) or vendor_id in self.blocked.get(ANY, ()):
+            return False, "Vendor is blocked for this recipient"
+
+        if category not in self.allowed_categories(recipient_id):
+            return False, f"Category '{category}' is not approved for subsidy"
+
+        now = now or datetime.now()
+        for check in self.applicable(recipient_id, category):
+            message = check.check(category, amount, now, spent)
+            if message:
+                return False, message
+
+        return True, "Policy checks passed"
+
+    def describe(self) -> dict:
+        return {
+            "source": self.source,
+            "rules": self.rule_count,
+            "loaded_at": self.loaded_at.isoformat(),
+            "allowed_categories": {key: sorted(value) for key, value in self.allowed.items()},
+            "blocked_vendors": {key: sorted(value) for key, value in self.blocked.items()},
+            "check_keys": len(self.checks),
+        }
+
+
+class PolicyEngine:
+    """
+    Holds the compiled policy and hot-reloads it when the policy file changes.
+
+    The file's modification time is checked at most every `reload_interval`
+    seconds. A file that fails to compile is reported and the previous policy
+    stays in force.
+    """
+
+    def __init__(self, path: str = POLICY_FILE, reload_interval: float = POLICY_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.last_error = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._policy = CompiledPolicy([])
+        self.reload()
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Recompiles the policy file if it changed. Returns True if a new policy was loaded.
+
+        Args:
+            - force (bool): recompile even if the modification time is unchanged,
+                e.g. after an edit within the same mtime tick
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                if self._mtime is not None:
+                    print(f"Policy file {self.path} removed, using default policy")
+                    self._policy = CompiledPolicy([])
+                    self._mtime = None
+                    return True
+                return False
+
+            if mtime == self._mtime and not force:
+                return False
+
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                rules = data.get("rules", []) if isinstance(data, dict) else data
+                policy = CompiledPolicy(rules, source=self.path)
+            except (OSError, json.JSONDecodeError, PolicyError, AttributeError) as e:
+                self.last_error = str(e)
+                self._mtime = mtime
+                print(f"Error loading policy {self.path}, keeping previous policy: {str(e)}")
+                return False
+
+            self._policy = policy
+            self._mtime = mtime
+            self.last_error = None
+            print(f"Loaded policy {self.path} with {policy.rule_count} rules")
+            return True
+
+    def current(self) -> CompiledPolicy:
+        """Returns the compiled policy, reloading it first if the file changed"""
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self._policy
+
+    def describe(self) -> dict:
+        description = self.current().describe()
+        description["last_error"] = self.last_error
+        return description
+
+
+policy_engine = PolicyEngine()
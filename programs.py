@@ -0,0 +1,174 @@
+# programs.py
+import json
+import os
+from typing import Dict, List, Optional
+
+from ledger import Ledger, LEDGER_ARCHIVE_DIR
+from nodes import registry
+from policy import PolicyEngine, policy_engine
+from search import NameIndex, recipient_index, vendor_index
+
+# PROGRAMS lists the subsidy programs as JSON, inline or in a file:
+#     [{"id": "food", "name": "Food aid", "admin_key": "...", "node": "a",
+#       "policy_file": "policy.food.json", "worker": "w1", "url": "http://w1:5000"},
+#      {"id": "health", "name": "Health", "admin_key": "...", "worker": "w2"}]
+# Every recipient, vendor and transaction belongs to one program. A program
+# without an admin_key is funded from the nodes' admin wallets, one without a
+# policy_file uses policy.<id>.json. Without PROGRAMS there is a single
+# program, DEFAULT_PROGRAM, funded and governed as before.
+PROGRAMS = os.getenv("PROGRAMS", "")
+DEFAULT_PROGRAM = os.getenv("DEFAULT_PROGRAM", "default")
+# The worker this process is; it serves the programs placed on it and those
+# without a worker. Empty serves every program.
+WORKER_NAME = os.getenv("WORKER_NAME", "")
+
+
+class ProgramError(LookupError):
+    """Raised for a program that doesn't exist, or is served by another worker"""
+
+    def __init__(self, message: str, worker: Optional[str] = None, url: Optional[str] = None):
+        super().__init__(message)
+        self.worker = worker
+        self.url = url
+
+
+def program_of(entity: Optional[dict]) -> str:
+    """The program id of a recipient, vendor or ledger entry"""
+    return (entity or {}).get("program") or DEFAULT_PROGRAM
+
+
+class Program:
+    """
+    One subsidy program: its funding wallet, spending policy, ledger shard
+    and name indexes. Only programs served by this worker are opened; the
+    others are known by name and worker only, so requests can be sent on.
+    """
+
+    def __init__(self, program_id: str, name: Optional[str] = None, admin_key: Optional[str] = None,
+                 node: Optional[str] = None, policy_file: Optional[str] = None,
+                 worker: Optional[str] = None, url: Optional[str] = None):
+        self.id = program_id
+        self.name = name or program_id
+        self.admin_key = admin_key
+        self.node = registry.get(node).name
+        self.policy_file = policy_file
+        self.worker = worker
+        self.url = url.rstrip('/') if url else None
+        self.policy = None
+        self.ledger = None
+        self.recipient_index = None
+        self.vendor_index = None
+
+    @property
+    def is_default(self) -> bool:
+        return self.id == DEFAULT_PROGRAM
+
+    def open(self):
+        """Loads the policy and attaches the ledger shard, for a program served here"""
+        if self.admin_key:
+            # So calls made with the key reach the node holding the wallet
+            registry.register_wallet(self.node, self.admin_key)
+        if self.is_default:
+            # The default program keeps the files and indexes from before programs
+            self.policy = policy_engine if not self.policy_file else PolicyEngine(self.policy_file)
+            self.ledger = Ledger()
+            self.recipient_index, self.vendor_index = recipient_index, vendor_index
+        else:
+            self.policy = PolicyEngine(self.policy_file or f"policy.{self.id}.json")
+            self.ledger = Ledger(archive_dir=os.path.join(LEDGER_ARCHIVE_DIR, self.id))
+            self.recipient_index, self.vendor_index = NameIndex(), NameIndex()
+
+    def funding_wallets(self) -> Dict[str, str]:
+        """Admin keys that fund this program's recipients, by node name"""
+        if self.admin_key:
+            return {self.node: self.admin_key}
+        return {node.name: node.admin_key for node in registry.nodes.values()}
+
+    def to_dict(self) -> dict:
+        entry = {
+            "id": self.id,
+            "name": self.name,
+            "node": self.node,
+            "own_wallet": bool(self.admin_key),
+            "worker": self.worker,
+            "url": self.url,
+            "local": self.ledger is not None,
+        }
+        if self.ledger is not None:
+            entry["policy"] = self.policy.path
+            entry["transactions"] = len(self.ledger)
+        return entry
+
+
+class ProgramRegistry:
+    """The programs, and which of them this worker serves"""
+
+    def __init__(self, programs: List[Program], worker: str = WORKER_NAME):
+        if not programs:
+            raise ValueError("At least one program is required")
+        self.programs: Dict[str, Program] = {}
+        for program in programs:
+            if program.id in self.programs:
+                raise ValueError(f"Program '{program.id}' is configured twice")
+            self.programs[program.id] = program
+        self.worker = worker
+        for program in programs:
+            if self.serves(program):
+                program.open()
+        local = self.local()
+        if not local:
+            raise ValueError(f"Worker '{worker}' serves none of the configured programs")
+        # What requests without a program are about
+        self.primary = self.programs[DEFAULT_PROGRAM] if DEFAULT_PROGRAM in self.programs \
+            and self.serves(self.programs[DEFAULT_PROGRAM]) else local[0]
+
+    @classmethod
+    def from_env(cls) -> "ProgramRegistry":
+        """Builds the programs from PROGRAMS, falling back to the single default program"""
+        config = PROGRAMS.strip()
+        if not config:
+            return cls([Program(DEFAULT_PROGRAM)])
+        if not config.startswith("["):
+            with open(config, 'r') as f:
+                config = f.read()
+        programs = [Program(entry["id"], entry.get("name"), entry.get("admin_key"), entry.get("node"),
+                            entry.get("policy_file"), entry.get("worker"), entry.get("url"))
+                    for entry in json.loads(config)]
+        loaded = cls(programs)
+        print(f"Configured {len(programs)} programs, serving: "
+              f"{', '.join(program.id for program in loaded.local())}")
+        return loaded
+
+    def serves(self, program: Program) -> bool:
+        return not self.worker or not program.worker or program.worker == self.worker
+
+    def local(self) -> List[Program]:
+        """The programs served by this worker"""
+        return [program for program in self.programs.values() if program.ledger is not None]
+
+    def get(self, program_id: Optional[str] = None) -> Program:
+        """
+        Returns a program served by this worker; no id means the primary program.
+
+        Raises:
+            - ProgramError if the program is unknown or served by another worker
+        """
+        if not program_id:
+            return self.primary
+        program = self.programs.get(program_id)
+        if program is None:
+            raise ProgramError(f"Unknown program '{program_id}'")
+        if program.ledger is None:
+            raise ProgramError(f"Program '{program_id}' is served by worker '{program.worker}'",
+                               worker=program.worker, url=program.url)
+        return program
+
+    def of(self, entity: Optional[dict]) -> Program:
+        """The program of a recipient, vendor or ledger entry"""
+        return self.get(program_of(entity))
+
+    def stats(self) -> list:
+        return [program.to_dict() for program in self.programs.values()]
+
+
+programs = ProgramRegistry.from_env()
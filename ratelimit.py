@@ -0,0 +1,274 @@
+# ratelimit.py
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Tuple, Dict, Any
+
+# Admission lanes. Payments may use every concurrency slot and the whole
+# token budget; dashboard reads only get what payments leave over.
+LANE_PAYMENT = "payment"
+LANE_READ = "read"
+
+
+class Overloaded(Exception):
+    """
+    Raised when an LNbits call is shed instead of queued.
+
+    Attributes:
+        - retry_after (float): seconds the caller should wait before retrying
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = max(retry_after, 0.0)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled continuously at `rate` tokens per second
+    up to `capacity` tokens.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def try_take(self, tokens: float = 1.0, floor: float = 0.0) -> Tuple[bool, float]:
+        """
+        Takes tokens if at least `floor + tokens` are available.
+
+        Args:
+            - tokens (float): number of tokens to take
+            - floor (float): tokens that must remain in the bucket afterwards
+
+        Returns:
+            - (True, 0.0) if the tokens were taken
+            - (False, seconds until enough tokens accumulate) otherwise
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens - tokens >= floor:
+                self.tokens -= tokens
+                return True, 0.0
+            if self.rate <= 0:
+                return False, 60.0
+            return False, (floor + tokens - self.tokens) / self.rate
+
+    def give_back(self, tokens: float = 1.0):
+        """Returns tokens taken by a call that was not admitted after all"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def is_full(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+
+class PrioritySemaphore:
+    """
+    Bounds the number of in-flight LNbits calls.
+
+    Payments may use up to `max_concurrency` slots and wait up to `payment_wait`
+    seconds for one. Reads may only use `read_concurrency` slots, never wait,
+    and are refused while a payment is waiting so that payments preempt them.
+    """
+
+    def __init__(self, max_concurrency: int, read_concurrency: int, payment_wait: float):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.read_concurrency = max(0, min(int(read_concurrency), self.max_concurrency))
+        self.payment_wait = payment_wait
+        self.in_flight = 0
+        self.payments_waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, lane: str) -> bool:
+        with self._cond:
+            if lane != LANE_PAYMENT:
+                if self.payments_waiting or self.in_flight >= self.read_concurrency:
+                    return False
+                self.in_flight += 1
+                return True
+
+            deadline = time.monotonic() + self.payment_wait
+            self.payments_waiting += 1
+            try:
+                while self.in_flight >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.payments_waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class AdmissionController:
+    """
+    Admission control in front of every LNbits call: a global token bucket,
+    one token bucket per wallet key and a priority-aware concurrency limit.
+    """
+
+    def __init__(self, rate: float, burst: float, wallet_rate: float, wallet_burst: float,
+                 max_concurrency: int, read_concurrency: int, read_reserve: float,
+                 payment_wait: float, max_wallets: int = 10000):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.wallet_rate = wallet_rate
+        self.wallet_burst = wallet_burst
+        self.read_reserve = read_reserve * burst
+        self.max_wallets = max_wallets
+        self.semaphore = PrioritySemaphore(max_concurrency, read_concurrency, payment_wait)
+        self._wallet_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = {LANE_PAYMENT: 0, LANE_READ: 0}
+        self.shed = {LANE_PAYMENT: 0, LANE_READ: 0}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Builds a controller from the LNBITS_* environment variables"""
+        return cls(
+            rate=float(os.getenv("LNBITS_RATE", "50")),
+            burst=float(os.getenv("LNBITS_BURST", "100")),
+            wallet_rate=float(os.getenv("LNBITS_WALLET_RATE", "5")),
+            wallet_burst=float(os.getenv("LNBITS_WALLET_BURST", "10")),
+            max_concurrency=int(os.getenv("LNBITS_MAX_CONCURRENCY", "16")),
+            read_concurrency=int(os.getenv("LNBITS_READ_CONCURRENCY", "10")),
+            read_reserve=float(os.getenv("LNBITS_READ_RESERVE", "0.2")),
+            payment_wait=float(os.getenv("LNBITS_PAYMENT_WAIT", "2.0")),
+        )
+
+    def _wallet_bucket(self, wallet_key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._wallet_buckets.get(wallet_key)
+            if bucket is None:
+                # Buckets that have refilled completely carry no state, so they
+                # are the ones dropped when the table is full
+                if len(self._wallet_buckets) >= self.max_wallets:
+                    for key in list(self._wallet_buckets):
+                        if self._wallet_buckets[key].is_full():
+                            del self._wallet_buckets[key]
+                        if len(self._wallet_buckets) < self.max_wallets:
+                            break
+                    else:
+                        self._wallet_buckets.popitem(last=False)
+                bucket = TokenBucket(self.wallet_rate, self.wallet_burst)
+                self._wallet_buckets[wallet_key] = bucket
+            else:
+                self._wallet_buckets.move_to_end(wallet_key)
+            return bucket
+
+    def _reject(self, lane: str, message: str, retry_after: float):
+        with self._lock:
+            self.shed[lane] = self.shed.get(lane, 0) + 1
+        print(f"Shedding LNbits {lane} call: {message}")
+        raise Overloaded(message, retry_after)
+
+    @contextmanager
+    def admit(self, wallet_key: Optional[str], lane: str = LANE_READ):
+        """
+        Admits one LNbits call or raises Overloaded without queueing.
+
+        Args:
+            - wallet_key (str, optional): the wallet key the call is made with
+            - lane (str): LANE_PAYMENT or LANE_READ
+        """
+        floor = 0.0 if lane == LANE_PAYMENT else self.read_reserve
+        ok, wait = self.global_bucket.try_take(1.0, floor)
+        if not ok:
+            self._reject(lane, "global LNbits rate limit reached", wait)
+
+        wallet_bucket = self._wallet_bucket(wallet_key) if wallet_key else None
+        if wallet_bucket is not None:
+            ok, wait = wallet_bucket.try_take(1.0)
+            if not ok:
+                self.global_bucket.give_back(1.0)
+                self._reject(lane, f"rate limit reached for wallet {wallet_key[:5]}...", wait)
+
+        if not self.semaphore.acquire(lane):
+            self.global_bucket.give_back(1.0)
+            if wallet_bucket is not None:
+                wallet_bucket.give_back(1.0)
+            self._reject(lane, "too many concurrent LNbits calls", 1.0)
+
+        with self._lock:
+            self.admitted[lane] = self.admitted.get(lane, 0) + 1
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns counters for monitoring"""
+        with self._lock:
+            return {
+                "in_flight": self.semaphore.in_flight,
+                "admitted": dict(self.admitted),
+                "shed": dict(self.shed),
+                "tracked_wallets": len(self._wallet_buckets),
+            }
+
+
+limiter = AdmissionController.from_env()
+
+_local = threading.local()
+
+
+@contextmanager
+def priority(lane: str):
+    """
+    Runs the enclosed LNbits calls in the given lane regardless of their
+    default, e.g. a balance check that is part of a payment.
+    """
+    previous = getattr(_local, "lane", None)
+    _local.lane = lane
+    try:
+        yield
+    finally:
+        _local.lane = previous
+
+
+def rate_limited(lane: str, key: Optional[str] = None):
+    """
+    Decorates an LNbits call so it passes through the admission controller.
+
+    Args:
+        - lane (str): the default lane of the call
+        - key (str, optional): name of the argument holding the wallet key
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            wallet_key = None
+            if key:
+                wallet_key = signature.bind(*args, **kwargs).arguments.get(key)
+            with limiter.admit(wallet_key, getattr(_local, "lane", None) or lane):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def retry_after_header(error: Overloaded) -> str:
+    """Formats Overloaded.retry_after for the Retry-After header"""
+    return str(max(1, math.ceil(error.retry_after)))
@@ -0,0 +1,130 @@
+# rebalance_nodes.py
+"""
+Moves funds between the admin wallets of the LNbits nodes in LNBITS_NODES.
+
+Each node's admin wallet funds the recipients placed on it. This tool
+spreads the total across the nodes in proportion to their weight. It pays
+an invoice from each node holding a surplus to each node that is short.
+
+Usage:
+    python rebalance_nodes.py [--dry-run] [--min-transfer 1000] [--json]
+"""
+import argparse
+import json
+import sys
+
+from lightning import create_invoice, pay_invoice, get_wallet_balance
+from nodes import registry
+
+
+def plan_transfers(balances, weights, min_transfer=1):
+    """
+    Works out the transfers that bring every node to its weighted share.
+
+    Args:
+        - balances (dict): node name -> admin wallet balance in sats
+        - weights (dict): node name -> weight
+        - min_transfer (int): smaller transfers are not worth the fees and are skipped
+
+    Returns:
+        - a list of (from_node, to_node, amount) tuples
+    """
+    total = sum(balances.values())
+    total_weight = sum(weights[name] for name in balances)
+    targets = {name: total * weights[name] // total_weight for name in balances}
+
+    surplus = sorted(((balances[name] - targets[name], name) for name in balances
+                      if balances[name] > targets[name]), reverse=True)
+    deficit = sorted(((targets[name] - balances[name], name) for name in balances
+                      if balances[name] < targets[name]), reverse=True)
+
+    transfers = []
+    surplus = [list(entry) for entry in surplus]
+    for needed, to_node in deficit:
+        for entry in surplus:
+            if needed < min_transfer:
+                break
+            available, from_node = entry
+            amount = min(available, needed)
+            if amount < min_transfer:
+                continue
+            transfers.append((from_node, to_node, amount))
+            entry[0] -= amount
+            needed -= amount
+    return transfers
+
+
+def transfer(from_node, to_node, amount):
+    """Pays `amount` sats from one node's admin wallet to another's"""
+    invoice = create_invoice(
+        wallet_key=to_node.admin_key,
+        amount=amount,
+        memo=f"Rebalance from {from_node.name} to {to_node.name}"
+    )
+    if not invoice or 'payment_request' not in invoice:
+        raise Exception(f"Failed to create invoice on {to_node.name}: {invoice}")
+    payment = pay_invoice(
+        wallet_adminkey=from_node.admin_key,
+        payment_request=invoice["payment_request"],
+        amount=amount
+    )
+    if not payment or 'payment_hash' not in payment:
+        raise Exception(f"Failed to pay invoice from {from_node.name}: {payment}")
+    return payment
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebalance admin wallet funds across LNbits nodes")
+    parser.add_argument("--dry-run", action="store_true", help="only print the planned transfers")
+    parser.add_argument("--min-transfer", type=int, default=1000,
+                        help="skip transfers smaller than this many sats")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args(argv)
+
+    if len(registry.nodes) < 2:
+        print("Only one LNbits node is configured, nothing to rebalance", file=sys.stderr)
+        return 0
+
+    balances = {}
+    for node in registry.nodes.values():
+        try:
+            balances[node.name] = get_wallet_balance(node.admin_key)
+        except Exception as e:
+            print(f"Could not read the admin wallet on {node.name}: {str(e)}", file=sys.stderr)
+            return 1
+
+    weights = {name: node.weight for name, node in registry.nodes.items()}
+    transfers = plan_transfers(balances, weights, args.min_transfer)
+
+    results = []
+    failed = False
+    for from_name, to_name, amount in transfers:
+        result = {"from": from_name, "to": to_name, "amount": amount, "status": "planned"}
+        if not args.dry_run:
+            try:
+                payment = transfer(registry.get(from_name), registry.get(to_name), amount)
+                result["status"] = "complete"
+                result["payment_hash"] = payment["payment_hash"]
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+                failed = True
+        results.append(result)
+
+    if args.json:
+        print(json.dumps({"balances": balances, "transfers": results}, indent=2))
+    else:
+        for name, balance in balances.items():
+            print(f"{name:<20} {balance:>12} sats")
+        if not results:
+            print("Nodes are already balanced")
+        for result in results:
+            line = f"{result['from']} -> {result['to']}: {result['amount']} sats [{result['status']}]"
+            if "error" in result:
+                line += f" {result['error']}"
+            print(line)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# replay.py
+"""
+Replays traffic recorded by capture.py and reports latency per route.
+
+Requests are sent at their original spacing divided by --speed (0 sends
+them as fast as possible), either in-process through the Flask test client
+or over HTTP to --target.
+
+Usage:
+    python replay.py traffic.jsonl [--target http://localhost:8080]
+                     [--speed 10] [--concurrency 16] [--limit 1000] [--json]
+"""
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def load_entries(path, limit=None):
+    """Reads capture lines, skipping lines that are not request records"""
+    entries = []
+    skipped = 0
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict) or "method" not in entry or "path" not in entry:
+                skipped += 1
+                continue
+            entries.append(entry)
+            if limit and len(entries) >= limit:
+                break
+    if skipped:
+        print(f"Skipped {skipped} lines that are not captured requests", file=sys.stderr)
+    entries.sort(key=lambda entry: entry.get("ts", 0))
+    return entries
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class InProcessClient:
+    """Sends requests through the Flask test client, one client per thread"""
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, entry):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        kwargs = {"query_string": entry.get("query") or None}
+        if "json" in entry:
+            kwargs["json"] = entry["json"]
+        elif "form" in entry:
+            kwargs["data"] = entry["form"]
+        response = client.open(entry["path"], method=entry["method"], **kwargs)
+        return response.status_code
+
+
+class HttpClient:
+    """Sends requests to a running server, one session per thread"""
+
+    def __init__(self, target):
+        self.target = target.rstrip('/')
+        self._local = threading.local()
+
+    def send(self, entry):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        url = self.target + entry["path"]
+        if entry.get("query"):
+            url += "?" + entry["query"]
+        kwargs = {"allow_redirects": False, "timeout": 60}
+        if "json" in entry:
+            kwargs["json"] = entry["json"]
+        elif "form" in entry:
+            kwargs["data"] = entry["form"]
+        return session.request(entry["method"], url, **kwargs).status_code
+
+
+def replay(entries, client, speed=1.0, concurrency=8):
+    """
+    Replays entries and returns per-route results.
+
+    Returns:
+        tuple: (results dict route -> list of (latency_ms, status), wall time in seconds)
+    """
+    results = defaultdict(list)
+    lock = threading.Lock()
+
+    def run(entry):
+        started = time.perf_counter()
+        try:
+            status = client.send(entry)
+        except Exception as e:
+            print(f"Error replaying {entry['method']} {entry['path']}: {str(e)}", file=sys.stderr)
+            status = None
+        latency = (time.perf_counter() - started) * 1000
+        route = f"{entry['method']} {entry.get('route') or entry['path']}"
+        with lock:
+            results[route].append((latency, status))
+
+    first_ts = entries[0].get("ts", 0) if entries else 0
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry in entries:
+            if speed > 0:
+                due = (entry.get("ts", first_ts) - first_ts) / speed
+                delay = due - (time.perf_counter() - wall_start)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, entry)
+    return results, time.perf_counter() - wall_start
+
+
+def summarize(results, wall_time):
+    """Throughput and latency percentiles per route"""
+    routes = {}
+    total = 0
+    for route, samples in sorted(results.items()):
+        latencies = sorted(latency for latency, _ in samples)
+        errors = sum(1 for _, status in samples if status is None or status >= 500)
+        total += len(samples)
+        routes[route] = {
+            "requests": len(samples),
+            "errors": errors,
+            "throughput_rps": round(len(samples) / wall_time, 2) if wall_time else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50), 2),
+            "p90_ms": round(percentile(latencies, 0.90), 2),
+            "p99_ms": round(percentile(latencies, 0.99), 2),
+            "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        }
+    return {
+        "requests": total,
+        "wall_time_s": round(wall_time, 3),
+        "throughput_rps": round(total / wall_time, 2) if wall_time else 0.0,
+        "routes": routes,
+    }
+
+
+def print_report(summary):
+    print(f"Replayed {summary['requests']} requests in {summary['wall_time_s']}s "
+          f"({summary['throughput_rps']} req/s)")
+    header = f"{'route':<45} {'count':>7} {'err':>5} {'rps':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"
+    print(header)
+    print("-" * len(header))
+    for route, stats in summary["routes"].items():
+        print(f"{route[:45]:<45} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>8} "
+              f"{stats['p50_ms']:>9} {stats['p90_ms']:>9} {stats['p99_ms']:>9} {stats['max_ms']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured traffic against the app")
+    parser.add_argument("file", help="JSONL file written by capture.py")
+    parser.add_argument("--target", help="base URL of a running server; in-process when omitted")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="speed-up factor over the original timing, 0 for no delays")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum requests in flight")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    entries = load_entries(args.file, args.limit)
+    if not entries:
+        print("No requests to replay", file=sys.stderr)
+        return 1
+
+    client = HttpClient(args.target) if args.target else InProcessClient()
+    results, wall_time = replay(entries, client, speed=args.speed, concurrency=args.concurrency)
+    summary = summarize(results, wall_time)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
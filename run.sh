@@ -23,6 +23,139 @@ export LOG_LEVEL="${LOG_LEVEL:-INFO}"
 export LOG_FILE="${LOG_FILE:-subsidy_app.log}"
 export DEFAULT_DAILY_LIMIT="${DEFAULT_DAILY_LIMIT:-10000}"
 export ALLOWED_CATEGORIES="${ALLOWED_CATEGORIES:-food,medicine}"
+export POLICY_FILE="${POLICY_FILE:-policy.json}"
+export POLICY_RELOAD_INTERVAL="${POLICY_RELOAD_INTERVAL:-2}"
+
+# LNbits admission control (token buckets in requests/second, concurrency in calls)
+export LNBITS_RATE="${LNBITS_RATE:-50}"
+export LNBITS_BURST="${LNBITS_BURST:-100}"
+export LNBITS_WALLET_RATE="${LNBITS_WALLET_RATE:-5}"
+export LNBITS_WALLET_BURST="${LNBITS_WALLET_BURST:-10}"
+export LNBITS_MAX_CONCURRENCY="${LNBITS_MAX_CONCURRENCY:-16}"
+export LNBITS_READ_CONCURRENCY="${LNBITS_READ_CONCURRENCY:-10}"
+export LNBITS_READ_RESERVE="${LNBITS_READ_RESERVE:-0.2}"
+export LNBITS_PAYMENT_WAIT="${LNBITS_PAYMENT_WAIT:-2.0}"
+
+# LNbits deadlines (seconds) and circuit breaker
+export LNBITS_TIMEOUT_READ="${LNBITS_TIMEOUT_READ:-3}"
+export LNBITS_TIMEOUT_INVOICE="${LNBITS_TIMEOUT_INVOICE:-5}"
+export LNBITS_TIMEOUT_PAY="${LNBITS_TIMEOUT_PAY:-15}"
+export LNBITS_TIMEOUT_ACCOUNT="${LNBITS_TIMEOUT_ACCOUNT:-5}"
+export LNBITS_BREAKER_FAILURES="${LNBITS_BREAKER_FAILURES:-5}"
+export LNBITS_BREAKER_RESET="${LNBITS_BREAKER_RESET:-30}"
+
+# LNbits nodes as JSON (name, url, admin_key, weight), or a path to a JSON file;
+# empty means the single LNBITS_URL / ADMIN_KEY node. Placement is "hash" or "least_load"
+export LNBITS_NODES="${LNBITS_NODES:-}"
+export LNBITS_PLACEMENT="${LNBITS_PLACEMENT:-hash}"
+
+# Subsidy programs as JSON (id, name, admin_key, node, policy_file, worker, url),
+# or a path to a JSON file like programs.example.json; empty means the single
+# DEFAULT_PROGRAM. A worker serves the programs placed on it (empty: all)
+export PROGRAMS="${PROGRAMS:-}"
+export DEFAULT_PROGRAM="${DEFAULT_PROGRAM:-default}"
+export WORKER_NAME="${WORKER_NAME:-}"
+
+# Recipient and vendor search (list pages and typeahead)
+export SEARCH_PAGE_SIZE="${SEARCH_PAGE_SIZE:-50}"
+export SEARCH_MAX_PAGE_SIZE="${SEARCH_MAX_PAGE_SIZE:-200}"
+
+# Payments: "sync" pays inside the request, "queued" uses the worker pool
+export PAYMENT_MODE="${PAYMENT_MODE:-sync}"
+export PAYMENT_WORKERS="${PAYMENT_WORKERS:-4}"
+# Seconds between lookups of a payment whose outcome LNbits left unknown (timed out)
+export PAYMENT_RECONCILE_INTERVAL="${PAYMENT_RECONCILE_INTERVAL:-30}"
+
+# Scheduled recurring funding (plans in DISBURSE_PLANS_FILE, checkpoints in DISBURSE_JOURNAL)
+export DISBURSE_PLANS_FILE="${DISBURSE_PLANS_FILE:-disbursements.json}"
+export DISBURSE_JOURNAL="${DISBURSE_JOURNAL:-disbursements.journal}"
+export DISBURSE_CHUNK_SIZE="${DISBURSE_CHUNK_SIZE:-50}"
+export DISBURSE_CONCURRENCY="${DISBURSE_CONCURRENCY:-4}"
+export DISBURSE_MAX_ATTEMPTS="${DISBURSE_MAX_ATTEMPTS:-3}"
+export DISBURSE_TICK="${DISBURSE_TICK:-60}"
+export DISBURSE_OVERLOAD_WAIT="${DISBURSE_OVERLOAD_WAIT:-120}"
+
+# Vendor payouts to Lightning addresses: one sweep per vendor per window,
+# early once SETTLE_THRESHOLD sats arrived
+export SETTLE_INTERVAL="${SETTLE_INTERVAL:-86400}"
+export SETTLE_THRESHOLD="${SETTLE_THRESHOLD:-100000}"
+export SETTLE_MIN_PAYOUT="${SETTLE_MIN_PAYOUT:-1000}"
+export SETTLE_FEE_RESERVE_PPM="${SETTLE_FEE_RESERVE_PPM:-5000}"
+export SETTLE_CONCURRENCY="${SETTLE_CONCURRENCY:-8}"
+export SETTLE_TICK="${SETTLE_TICK:-60}"
+
+# Hash-chained audit log of admin and payment actions; check it with verify_audit.py
+export AUDIT_LOG="${AUDIT_LOG:-audit.log}"
+export AUDIT_BATCH_MAX="${AUDIT_BATCH_MAX:-1000}"
+export AUDIT_QUEUE_MAX="${AUDIT_QUEUE_MAX:-100000}"
+
+# Wallets provisioned ahead of onboarding, per LNbits node (opt-in: creates
+# accounts up front and keeps their admin keys in WALLET_POOL_FILE)
+export WALLET_POOL_ENABLED="${WALLET_POOL_ENABLED:-False}"
+export WALLET_POOL_SIZE="${WALLET_POOL_SIZE:-20}"
+export WALLET_POOL_LOW_WATER="${WALLET_POOL_LOW_WATER:-5}"
+export WALLET_POOL_CONCURRENCY="${WALLET_POOL_CONCURRENCY:-2}"
+export WALLET_POOL_FILE="${WALLET_POOL_FILE:-wallet_pool.json}"
+
+# Offline spending vouchers (HS256 shares VOUCHER_SECRET with vendor terminals;
+# EdDSA signs with VOUCHER_KEY_FILE and needs the cryptography package)
+export VOUCHER_ALG="${VOUCHER_ALG:-HS256}"
+export VOUCHER_SECRET="${VOUCHER_SECRET:-}"
+export VOUCHER_KEY_FILE="${VOUCHER_KEY_FILE:-voucher_key.pem}"
+export VOUCHER_TTL="${VOUCHER_TTL:-900}"
+export VOUCHER_REDEEM_GRACE="${VOUCHER_REDEEM_GRACE:-86400}"
+export VOUCHER_BATCH_MAX="${VOUCHER_BATCH_MAX:-500}"
+
+# Sliding-window velocity checks ("flag" logs suspicious payments, "block" rejects them);
+# limits are for the last 1, 10 and 60 minutes, 0 turns a window off
+export VELOCITY_MODE="${VELOCITY_MODE:-flag}"
+export VELOCITY_RECIPIENT_MAX_COUNT="${VELOCITY_RECIPIENT_MAX_COUNT:-5,20,60}"
+export VELOCITY_RECIPIENT_MAX_SATS="${VELOCITY_RECIPIENT_MAX_SATS:-0,0,0}"
+export VELOCITY_VENDOR_MAX_COUNT="${VELOCITY_VENDOR_MAX_COUNT:-0,0,0}"
+export VELOCITY_VENDOR_MAX_SATS="${VELOCITY_VENDOR_MAX_SATS:-0,0,0}"
+export VELOCITY_VENDOR_SURGE="${VELOCITY_VENDOR_SURGE:-5}"
+
+# Memory diagnostics at /api/admin/memory; MEMORY_TRACE starts tracemalloc at
+# startup for allocation sites (it can also be switched on at runtime)
+export MEMORY_TRACE="${MEMORY_TRACE:-False}"
+export MEMORY_TRACE_FRAMES="${MEMORY_TRACE_FRAMES:-1}"
+export MEMORY_SAMPLE_SIZE="${MEMORY_SAMPLE_SIZE:-200}"
+export MEMORY_MIN_INTERVAL="${MEMORY_MIN_INTERVAL:-10}"
+export MEMORY_TRACE_SAMPLE="${MEMORY_TRACE_SAMPLE:-100000}"
+
+# Day-partitioned ledger: the last LEDGER_HOT_DAYS days stay in memory, older
+# days are archived compressed to LEDGER_ARCHIVE_DIR (retention 0 keeps them)
+export LEDGER_HOT_DAYS="${LEDGER_HOT_DAYS:-31}"
+export LEDGER_ARCHIVE_DIR="${LEDGER_ARCHIVE_DIR:-ledger_archive}"
+export LEDGER_RETENTION_DAYS="${LEDGER_RETENTION_DAYS:-0}"
+export LEDGER_BLOCK_SIZE="${LEDGER_BLOCK_SIZE:-512}"
+export LEDGER_CACHE_BLOCKS="${LEDGER_CACHE_BLOCKS:-64}"
+
+# Local BOLT11 checks of invoices created and paid; recorded payments must also
+# be for an invoice created here or found in the vendor's LNbits payments
+export BOLT11_VERIFY="${BOLT11_VERIFY:-True}"
+export BOLT11_CACHE_SIZE="${BOLT11_CACHE_SIZE:-10000}"
+
+# Request tracing: failed traces and those slower than TRACE_SLOW_MS are kept,
+# others at TRACE_SAMPLE_RATE, in a JSONL file rotated at TRACE_MAX_BYTES
+export TRACE_ENABLED="${TRACE_ENABLED:-True}"
+export TRACE_FILE="${TRACE_FILE:-traces.jsonl}"
+export TRACE_MAX_BYTES="${TRACE_MAX_BYTES:-10485760}"
+export TRACE_BACKUPS="${TRACE_BACKUPS:-5}"
+export TRACE_SLOW_MS="${TRACE_SLOW_MS:-1000}"
+export TRACE_SAMPLE_RATE="${TRACE_SAMPLE_RATE:-0.01}"
+
+# Response compression (level 0 disables it)
+export COMPRESS_LEVEL="${COMPRESS_LEVEL:-6}"
+export COMPRESS_MIN_SIZE="${COMPRESS_MIN_SIZE:-500}"
+
+# Live dashboard updates (Server-Sent Events)
+export SSE_MAX_CLIENTS="${SSE_MAX_CLIENTS:-100}"
+export SSE_HEARTBEAT="${SSE_HEARTBEAT:-15}"
+
+# Traffic capture for replay.py
+export CAPTURE_REQUESTS="${CAPTURE_REQUESTS:-False}"
+export CAPTURE_FILE="${CAPTURE_FILE:-traffic.jsonl}"
 
 # Ensure Python environment is set up
 if [ ! -d "venv" ]; then
@@ -38,6 +171,10 @@ echo "Installing/upgrading dependencies..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Fingerprint and precompress static assets
+echo "Building static assets..."
+python3 build_assets.py
+
 # Start the application
 echo "Starting application on ${HOST}:${PORT}"
 echo "LNBits URL: ${LNBITS_URL}"
@@ -0,0 +1,137 @@
+# search.py
+import bisect
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "50"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "200"))
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD.findall((text or "").lower()))
+
+
+class NameIndex:
+    """
+    A sorted prefix index over recipient or vendor names.
+
+    Every word of a name is kept in a sorted list of (word, id) pairs, so a
+    prefix query is a binary search followed by a scan over the matches only.
+    A second list sorted by full name serves paged listings without sorting
+    the whole collection on every request. Entries can carry a category, and
+    each category has its own word list so category filters don't scan
+    entries of other categories.
+    """
+
+    def __init__(self):
+        self._names: Dict[str, Tuple[str, Optional[str]]] = {}
+        self._by_name: List[Tuple[str, str]] = []
+        self._words: List[Tuple[str, str]] = []
+        self._category_words: Dict[str, List[Tuple[str, str]]] = {}
+        self._category_names: Dict[str, List[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, entity_id: str, name: str, category: Optional[str] = None):
+        """Indexes an entry, replacing an earlier entry with the same id"""
+        with self._lock:
+            if entity_id in self._names:
+                self._remove(entity_id)
+            key = normalize(name)
+            self._names[entity_id] = (key, category)
+            bisect.insort(self._by_name, (key, entity_id))
+            if category is not None:
+                bisect.insort(self._category_names.setdefault(category, []), (key, entity_id))
+            for word in set(key.split()):
+                bisect.insort(self._words, (word, entity_id))
+                if category is not None:
+                    bisect.insort(self._category_words.setdefault(category, []), (word, entity_id))
+
+    def remove(self, entity_id: str):
+        with self._lock:
+            if entity_id in self._names:
+                self._remove(entity_id)
+
+    def _remove(self, entity_id: str):
+        key, category = self._names.pop(entity_id)
+        _discard(self._by_name, (key, entity_id))
+        if category is not None:
+            _discard(self._category_names[category], (key, entity_id))
+        for word in set(key.split()):
+            _discard(self._words, (word, entity_id))
+            if category is not None:
+                _discard(self._category_words[category], (word, entity_id))
+
+    def categories(self) -> List[str]:
+        with self._lock:
+            return sorted(category for category, entries in self._category_names.items() if entries)
+
+    def search(self, query: str = "", category: Optional[str] = None, offset: int = 0,
+               limit: int = SEARCH_PAGE_SIZE) -> Tuple[List[str], bool]:
+        """
+        Finds entries whose name has a word starting with each query word.
+
+        Without a query, entries are listed in name order.
+
+        Returns:
+            tuple: (list of ids for the requested page, whether more matches follow)
+        """
+        terms = normalize(query).split()
+        offset = max(0, offset)
+        wanted = offset + limit + 1
+        with self._lock:
+            if not terms:
+                entries = self._by_name if category is None else self._category_names.get(category, [])
+                page = entries[offset:wanted]
+                return [entity_id for _, entity_id in page[:limit]], len(page) > limit
+
+            words = self._words if category is None else self._category_words.get(category, [])
+            # Scan only the matches of the most selective term; the range sizes
+            # come from two binary searches per term
+            ranges = [(_prefix_range(words, term), term) for term in terms]
+            (start, end), first = min(ranges, key=lambda entry: entry[0][1] - entry[0][0])
+            others = [term for term in terms if term is not first]
+            matches = []
+            seen = set()
+            for index in range(start, end):
+                entity_id = words[index][1]
+                if entity_id in seen:
+                    continue
+                seen.add(entity_id)
+                name_words = self._names[entity_id][0].split()
+                if all(any(name_word.startswith(term) for name_word in name_words) for term in others):
+                    matches.append((self._names[entity_id][0], entity_id))
+            matches.sort()
+            page = matches[offset:wanted]
+            return [entity_id for _, entity_id in page[:limit]], len(page) > limit
+
+
+def _prefix_range(entries: list, prefix: str) -> Tuple[int, int]:
+    """Index range of the (word, id) pairs whose word starts with prefix"""
+    start = bisect.bisect_left(entries, (prefix, ""))
+    end = bisect.bisect_left(entries, (prefix + "\uffff", ""))
+    return start, end
+
+
+def _discard(entries: list, item):
+    index = bisect.bisect_left(entries, item)
+    if index < len(entries) and entries[index] == item:
+        del entries[index]
+
+
+def page_size(value, default: int = SEARCH_PAGE_SIZE) -> int:
+    """Parses a requested page size, clamped to SEARCH_MAX_PAGE_SIZE"""
+    try:
+        return max(1, min(int(value), SEARCH_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+recipient_index = NameIndex()
+vendor_index = NameIndex()
@@ -1,10 +1,11 @@
 # service.py
-import requests
 import json
 from typing import Optional, Dict
 from datetime import datetime
 
 from models import Account, Wallet, WalletInfo, Invoice
+from ratelimit import rate_limited, LANE_PAYMENT, LANE_READ
+from circuit import guarded_request, DEFAULT_NODE
 
 class LNbits:
     """
@@ -13,8 +14,9 @@ class LNbits:
         https://demo.lnbits.com/docs
     """
 
-    def __init__(self, url_base: str):
+    def __init__(self, url_base: str, node: str = DEFAULT_NODE):
         self._URL_BASE = url_base.rstrip('/')  # Remove trailing slash if present
+        self._NODE = node  # Name of the LNbits node, used to pick its circuit breakers
 
         self._API_V1_URL = f"{self._URL_BASE}/api/v1"
 
@@ -28,6 +30,7 @@ class LNbits:
         print(f"Wallets resource: {self._WALLETS_RESOURCE}")
         print(f"Payments resource: {self._PAYMENTS_RESOURCE}")
 
+    @rate_limited(LANE_PAYMENT)
     def create_account(self, name: str) -> Account:
         """
         Creates an LNbits account.
@@ -41,12 +44,15 @@ class LNbits:
         Raises:
             - an Exception if the operation did not succeed. 
                 Check API reference & response body for details
+            - LNbitsUnavailable if LNbits timed out, is down or its circuit is open
         """
         print(f"Creating account with name: {name}")
 
         # Making the request
-        response = requests.post(
+        response = guarded_request(
+            "create_account", "POST",
             url=self._ACCOUNTS_RESOURCE,
+            node=self._NODE,
             json={
                 "name": name
             }
@@ -68,6 +74,7 @@ class LNbits:
         # Converting a json dict into a model
         return Account(**response_data)
     
+    @rate_limited(LANE_PAYMENT, key="account_api_key")
     def create_wallet(self, account_api_key: str, name: str) -> Wallet:
         """
         Creates an LNbits wallet.
@@ -82,12 +89,15 @@ class LNbits:
         Raises:
             - an Exception if the operation did not succeed. 
                 Check API reference & response body for details
+            - LNbitsUnavailable if LNbits timed out, is down or its circuit is open
         """
         print(f"Creating wallet with name: {name} for account key: {account_api_key[:5]}...")
 
         # Making the request
-        response = requests.post(
+        response = guarded_request(
+            "create_wallet", "POST",
             url=self._WALLETS_RESOURCE,
+            node=self._NODE,
             headers=self._get_header(account_api_key),
             json={
                 "name": name
@@ -110,6 +120,52 @@ class LNbits:
         # Converting a json dict into a model
         return Wallet(**response_data)
     
+    @rate_limited(LANE_PAYMENT, key="wallet_adminkey")
+    def rename_wallet(self, wallet_adminkey: str, name: str):
+        """
+        Renames a wallet.
+
+        Args:
+            - wallet_adminkey (str): the wallet's adminkey
+            - name (str): the new name of the wallet
+
+        Raises:
+            - an Exception if the operation did not succeed. 
+                Check API reference & response body for details
+            - LNbitsUnavailable if LNbits timed out, is down or its circuit is open
+        """
+        print(f"Renaming wallet with key: {wallet_adminkey[:5]}... to {name}")
+
+        response = guarded_request(
+            "rename_wallet", "PATCH",
+            url=self._WALLETS_RESOURCE,
+            node=self._NODE,
+            headers=self._get_header(wallet_adminkey),
+            json={
+                "name": name
+            }
+        )
+
+        # LNbits versions before PATCH /wallet take the name in the path
+        if response.status_code in (404, 405):
+            response = guarded_request(
+                "rename_wallet", "PUT",
+                url=f"{self._WALLETS_RESOURCE}/{name}",
+                node=self._NODE,
+                headers=self._get_header(wallet_adminkey)
+            )
+
+        print(f"Rename wallet response status: {response.status_code}")
+
+        # Checking for errors
+        if response.status_code != 200:
+            error_message = f"Couldn't rename the wallet.\n" \
+                           f"Response status code: {response.status_code}\n" \
+                           f"Response body: {response.text}"
+            print(error_message)
+            raise Exception(error_message)
+    
+    @rate_limited(LANE_READ, key="wallet_key")
     def get_wallet(self, wallet_key: str) -> Optional[WalletInfo]:
         """
         Fetches a wallet by its inkey or adminkey.
@@ -124,12 +180,15 @@ class LNbits:
         Raises:
             - an Exception if the operation did not succeed. 
                 Check API reference & response body for details
+            - LNbitsUnavailable if LNbits timed out, is down or its circuit is open
         """
         print(f"Getting wallet with key: {wallet_key[:5]}...")
 
         # Making the request
-        response = requests.get(
+        response = guarded_request(
+            "get_wallet", "GET",
             url=self._WALLETS_RESOURCE,
+            node=self._NODE,
             headers=self._get_header(wallet_key)
         )
 
@@ -154,6 +213,7 @@ class LNbits:
         # Converting a json dict into a model
         return WalletInfo(**response_data)
     
+    @rate_limited(LANE_PAYMENT, key="wallet_key")
     def create_invoice(self, wallet_key: str, amount_sats: int, memo: str = "") -> Invoice:
         """
         Creates an invoice to be paid by another wallet.
@@ -169,12 +229,15 @@ class LNbits:
         Raises:
             - an Exception if the operation did not succeed. 
                 Check API reference & response body for details
+            - LNbitsUnavailable if LNbits timed out, is down or its circuit is open
         """
         print(f"Creating invoice for amount: {amount_sats} sats, memo: {memo}, wallet key: {wallet_key[:5]}...")
 
         # Making the request with explicit out=False to create an invoice
-        response = requests.post(
+        response = guarded_request(
+            "create_invoice", "POST",
             url=self._PAYMENTS_RESOURCE,
+            node=self._NODE,
             headers=self._get_header(wallet_key),
             json={
                 "out": False,
@@ -217,6 +280,7 @@ class LNbits:
         # Converting a json dict into a model
         return Invoice(**response_data)
     
+    @rate_limited(LANE_PAYMENT, key="wallet_adminkey")
     def pay_invoice(self, wallet_adminkey: str, invoice: str) -> Invoice:
         """
         Pays an invoice.
@@ -231,12 +295,15 @@ class LNbits:
         Raises:
             - an Exception if the operation did not succeed. 
                 Check API reference & response body for details
+            - LNbitsUnavailable if LNbits timed out, is down or its circuit is open
         """
         print(f"Paying invoice: {invoice[:20]}... with wallet key: {wallet_adminkey[:5]}...")
 
         # Making the request with explicit out=True to pay an invoice
-        response = requests.post(
+        response = guarded_request(
+            "pay_invoice", "POST",
             url=self._PAYMENTS_RESOURCE,
+            node=self._NODE,
             headers=self._get_header(wallet_adminkey),
             json={
                 "out": True,
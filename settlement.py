@@ -0,0 +1,317 @@
+# settlement.py
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+import requests
+
+from bolt11 import Bolt11Error, check as check_bolt11
+from circuit import CircuitOpen, LNbitsUnavailable
+from lightning import get_wallet_balance, get_wallet_transactions, pay_invoice
+from ratelimit import Overloaded
+
+# Length of a settlement window in seconds; a vendor gets at most one payout per window
+SETTLE_INTERVAL = int(os.getenv("SETTLE_INTERVAL", "86400"))
+# Sweep early once this many sats arrived in the window (vendors can set their own)
+SETTLE_THRESHOLD = int(os.getenv("SETTLE_THRESHOLD", "100000"))
+# Smaller balances stay in the wallet until the next window
+SETTLE_MIN_PAYOUT = int(os.getenv("SETTLE_MIN_PAYOUT", "1000"))
+# Kept back for routing fees: parts per million of the balance, at least SETTLE_FEE_RESERVE_MIN sats
+SETTLE_FEE_RESERVE_PPM = int(os.getenv("SETTLE_FEE_RESERVE_PPM", "5000"))
+SETTLE_FEE_RESERVE_MIN = int(os.getenv("SETTLE_FEE_RESERVE_MIN", "10"))
+SETTLE_CONCURRENCY = int(os.getenv("SETTLE_CONCURRENCY", "8"))
+SETTLE_SCHEDULER = os.getenv("SETTLE_SCHEDULER", "True").lower() in ["true", "1", "t"]
+SETTLE_TICK = float(os.getenv("SETTLE_TICK", "60"))
+SETTLE_HISTORY = int(os.getenv("SETTLE_HISTORY", "500"))
+# Lightning addresses are resolved over https; "http" is only for local testing
+SETTLE_LNURL_SCHEME = os.getenv("SETTLE_LNURL_SCHEME", "https")
+SETTLE_LNURL_TIMEOUT = float(os.getenv("SETTLE_LNURL_TIMEOUT", "10"))
+
+SCHEDULED = "scheduled"
+THRESHOLD = "threshold"
+MANUAL = "manual"
+
+
+class PayoutAddressError(Exception):
+    """Raised when a vendor's payout address can't produce an invoice"""
+
+
+def validate_address(address: str) -> str:
+    """
+    Checks the form of a Lightning address (name@domain).
+
+    Raises:
+        - ValueError if it isn't one
+    """
+    address = (address or "").strip()
+    name, _, domain = address.partition("@")
+    if not name or not domain or "/" in domain or " " in address:
+        raise ValueError("Payout address must be a Lightning address like name@example.com")
+    return address
+
+
+def resolve_address(address: str, amount: int) -> str:
+    """
+    Gets an invoice for `amount` sats from a Lightning address (LNURL-pay).
+
+    Returns:
+        - the BOLT11 payment request
+
+    Raises:
+        - PayoutAddressError if the address's server refused or returned nonsense
+    """
+    name, _, domain = address.partition("@")
+    try:
+        response = requests.get(f"{SETTLE_LNURL_SCHEME}://{domain}/.well-known/lnurlp/{name}",
+                                timeout=SETTLE_LNURL_TIMEOUT)
+        params = response.json()
+        if params.get("tag") != "payRequest":
+            raise PayoutAddressError(f"{address} is not a pay request: {params.get('reason', params)}")
+        amount_msat = amount * 1000
+        if not params["minSendable"] <= amount_msat <= params["maxSendable"]:
+            raise PayoutAddressError(
+                f"{address} accepts {params['minSendable'] // 1000}-{params['maxSendable'] // 1000} sats, "
+                f"not {amount}"
+            )
+        response = requests.get(params["callback"], params={"amount": amount_msat},
+                                timeout=SETTLE_LNURL_TIMEOUT)
+        invoice = response.json()
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        raise PayoutAddressError(f"Could not resolve {address}: {str(e)}")
+    if invoice.get("status") == "ERROR" or not invoice.get("pr"):
+        raise PayoutAddressError(f"{address} returned no invoice: {invoice.get('reason', invoice)}")
+    # LNURL-pay wallets must check the invoice is for the amount asked (LUD-06)
+    try:
+        check_bolt11(invoice["pr"], amount=amount)
+    except Bolt11Error as e:
+        raise PayoutAddressError(f"{address} returned a bad invoice: {str(e)}")
+    return invoice["pr"]
+
+
+def fee_reserve(balance: int) -> int:
+    return max(SETTLE_FEE_RESERVE_MIN, balance * SETTLE_FEE_RESERVE_PPM // 1_000_000)
+
+
+class SettlementEngine:
+    """
+    Sweeps vendor wallets to their external payout addresses.
+
+    Time is cut into windows of `interval` seconds, and each vendor gets at
+    most one payout per window, for the whole balance. The payout for a window
+    goes out when the window closes, or early once the sats received during
+    the window reach the vendor's threshold. Received sats are counted from
+    ledger updates, so the threshold check costs no LNbits call; the wallet
+    balance is read only when a sweep runs. Sweeps of different vendors run
+    in parallel on a pool of `concurrency` threads, and since every vendor
+    wallet has its own admission bucket they don't slow each other down.
+
+    A payout whose outcome LNbits didn't report is recorded as pending and
+    still counts as the window's payout; it is checked against the vendor's
+    LNbits payments on the next tick.
+    """
+
+    def __init__(self, interval: int = SETTLE_INTERVAL, concurrency: int = SETTLE_CONCURRENCY):
+        self.interval = max(1, interval)
+        self.concurrency = max(1, concurrency)
+        self.received: Dict[str, int] = {}   # vendor id -> sats received since its last sweep
+        self.settled: Dict[str, int] = {}    # vendor id -> last window swept
+        self.pending: Dict[str, dict] = {}   # vendor id -> ledger entry of an unconfirmed payout
+        self.sweeps = deque(maxlen=SETTLE_HISTORY)
+        self.totals = {"sweeps": 0, "payouts": 0, "sats": 0, "failed": 0}
+        self._active = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="settlement")
+        self._thread = None
+        self.vendors = None
+        self.record = None
+        self.update = None
+
+    def bind(self, vendors: Callable, record: Callable, update: Callable):
+        """
+        Connects the engine to the app.
+
+        Args:
+            - vendors (callable): vendors(), returns the vendor dict by id
+            - record (callable): record(vendor_id, amount, status, payment_hash, reference, address),
+                appends a settlement entry to the ledger and returns it
+            - update (callable): update(transaction, status, payment_hash), settles a pending entry
+        """
+        self.vendors = vendors
+        self.record = record
+        self.update = update
+
+    def window(self, now: Optional[float] = None) -> int:
+        return int((now if now is not None else time.time()) // self.interval)
+
+    def threshold(self, vendor: dict) -> int:
+        return vendor.get("payout_threshold") or SETTLE_THRESHOLD
+
+    # Triggers
+
+    def observe(self, vendor_id: str, amount: int):
+        """
+        Counts sats a vendor received; sweeps right away once they reach the
+        vendor's threshold, unless the vendor was already paid out this window.
+        """
+        vendor = self.vendors().get(vendor_id)
+        if not vendor or not vendor.get("payout_address"):
+            return
+        window = self.window()
+        with self._lock:
+            self.received[vendor_id] = self.received.get(vendor_id, 0) + amount
+            due = (self.received[vendor_id] >= self.threshold(vendor)
+                   and self.settled.get(vendor_id, -1) < window)
+        if due:
+            self.submit(vendor_id, window, THRESHOLD)
+
+    def start(self):
+        """Starts the scheduler thread that closes windows"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="settlements", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error in settlement scheduler: {str(e)}")
+            time.sleep(SETTLE_TICK)
+
+    def tick(self, now: Optional[float] = None):
+        """Sweeps every vendor whose previous window closed without a payout"""
+        closed = self.window(now) - 1
+        for vendor_id in list(self.pending):
+            self._pool.submit(self._reconcile, vendor_id)
+        for vendor_id, vendor in list(self.vendors().items()):
+            if not vendor.get("payout_address") or self.settled.get(vendor_id, -1) >= closed:
+                continue
+            if vendor_id in self.settled and self.received.get(vendor_id, 0) < SETTLE_MIN_PAYOUT:
+                # Nothing worth paying arrived since the last sweep: skip the balance read
+                with self._lock:
+                    self.settled[vendor_id] = max(self.settled[vendor_id], closed)
+                continue
+            self.submit(vendor_id, closed, SCHEDULED)
+
+    def submit(self, vendor_id: str, window: int, reason: str = MANUAL):
+        """Queues a sweep of one vendor for `window`; returns False if one is running"""
+        with self._lock:
+            if vendor_id in self._active:
+                return False
+            self._active.add(vendor_id)
+        self._pool.submit(self._sweep, vendor_id, window, reason)
+        return True
+
+    # Execution
+
+    def _sweep(self, vendor_id: str, window: int, reason: str):
+        result = {"vendor_id": vendor_id, "window": window, "reason": reason,
+                  "started_at": datetime.now().isoformat(), "amount": 0}
+        try:
+            result.update(self._payout(vendor_id, window))
+        except Exception as e:
+            result.update(status="failed", error=str(e))
+        finally:
+            with self._lock:
+                self._active.discard(vendor_id)
+                self.totals["sweeps"] += 1
+                if result["status"] in ("complete", "pending"):
+                    self.totals["payouts"] += 1
+                    self.totals["sats"] += result["amount"]
+                elif result["status"] == "failed":
+                    self.totals["failed"] += 1
+            result["finished_at"] = datetime.now().isoformat()
+            self.sweeps.append(result)
+            if result["status"] != "skipped":
+                print(f"Settlement of {vendor_id} for window {window} ({reason}): {result['status']} "
+                      f"{result['amount']} sats {result.get('error', '')}")
+
+    def _payout(self, vendor_id: str, window: int) -> dict:
+        vendor = self.vendors()[vendor_id]
+        address = vendor["payout_address"]
+        with self._lock:
+            if self.settled.get(vendor_id, -1) >= window:
+                return {"status": "skipped"}
+            received = self.received.get(vendor_id, 0)
+
+        balance = get_wallet_balance(vendor["adminkey"])
+        amount = balance - fee_reserve(balance)
+        if amount < SETTLE_MIN_PAYOUT:
+            with self._lock:
+                self.settled[vendor_id] = max(self.settled.get(vendor_id, -1), window)
+                self.received[vendor_id] = self.received.get(vendor_id, 0) - received
+            return {"status": "skipped", "balance": balance}
+
+        # Nothing is marked settled before this point, so a failure to get
+        # an invoice or an admission refusal is retried on the next tick
+        payment_request = resolve_address(address, amount)
+        reference = f"settlement/{vendor_id}/{window}"
+        try:
+            payment = pay_invoice(wallet_adminkey=vendor["adminkey"], payment_request=payment_request,
+                                  amount=amount)
+        except (Overloaded, CircuitOpen):
+            raise
+        except LNbitsUnavailable as e:
+            # The payment may have gone out; don't pay the window twice
+            transaction = self.record(vendor_id, amount, "pending", None, reference, address)
+            transaction["payment_request"] = payment_request
+            with self._lock:
+                self.settled[vendor_id] = max(self.settled.get(vendor_id, -1), window)
+                self.received[vendor_id] = self.received.get(vendor_id, 0) - received
+                self.pending[vendor_id] = transaction
+            return {"status": "pending", "amount": amount, "error": str(e), "transaction_id": transaction["id"]}
+
+        if not payment or not payment.get("payment_hash"):
+            raise Exception(f"Payout to {address} failed: {payment}")
+        transaction = self.record(vendor_id, amount, "complete", payment["payment_hash"], reference, address)
+        with self._lock:
+            self.settled[vendor_id] = max(self.settled.get(vendor_id, -1), window)
+            self.received[vendor_id] = self.received.get(vendor_id, 0) - received
+        return {"status": "complete", "amount": amount, "payment_hash": payment["payment_hash"],
+                "transaction_id": transaction["id"]}
+
+    def _reconcile(self, vendor_id: str):
+        """Settles a pending payout from the vendor's LNbits payments"""
+        transaction = self.pending.get(vendor_id)
+        vendor = self.vendors().get(vendor_id)
+        if transaction is None or vendor is None:
+            return
+        try:
+            payments = get_wallet_transactions(vendor["adminkey"])
+        except (Overloaded, LNbitsUnavailable):
+            return
+        for payment in payments:
+            if payment.get("bolt11") != transaction["payment_request"]:
+                continue
+            if payment.get("pending", False) or payment.get("status") == "pending":
+                return
+            status = "complete" if payment.get("status", "success") == "success" else "failed"
+            self.update(transaction, status, payment.get("payment_hash"))
+            break
+        else:
+            # LNbits never took the payment
+            self.update(transaction, "failed", None)
+        self.pending.pop(vendor_id, None)
+
+    # Views
+
+    def history(self, vendor_id: Optional[str] = None) -> list:
+        sweeps = [sweep for sweep in reversed(self.sweeps)
+                  if sweep["status"] != "skipped" and (vendor_id is None or sweep["vendor_id"] == vendor_id)]
+        return sweeps
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.totals,
+                        window=self.window(),
+                        interval=self.interval,
+                        active=sorted(self._active),
+                        pending=sorted(self.pending))
+
+
+settlements = SettlementEngine()
@@ -0,0 +1,23 @@
+/* static/js/balances.js - fill the balance cells of cached tables from [data-balances-url] */
+(function () {
+    var source = document.querySelector('[data-balances-url]');
+    if (!source || !window.fetch) {
+        return;
+    }
+
+    fetch(source.getAttribute('data-balances-url'), {credentials: 'same-origin'})
+        .then(function (response) {
+            return response.ok ? response.json() : {};
+        })
+        .then(function (balances) {
+            Object.keys(balances).forEach(function (key) {
+                document.querySelectorAll('[data-balance-for="' + key + '"]').forEach(function (element) {
+                    element.textContent = balances[key].balance;
+                });
+                document.querySelectorAll('[data-estimated-for="' + key + '"]').forEach(function (element) {
+                    element.hidden = !balances[key].estimated;
+                });
+            });
+        })
+        .catch(function () {});
+})();
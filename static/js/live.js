@@ -0,0 +1,85 @@
+/* static/js/live.js - apply ledger events from /events to the page in place */
+(function () {
+    var source = document.querySelector('[data-events-url]');
+    if (!source || !window.EventSource) {
+        return;
+    }
+
+    var STATUS_CLASSES = {complete: 'bg-success', pending: 'bg-warning', queued: 'bg-warning'};
+
+    function formatField(field, tx) {
+        var value = tx[field];
+        if (field === 'amount') {
+            return value + ' sats';
+        }
+        if (field === 'date' && value) {
+            return String(value).slice(0, 16).replace('T', ' ');
+        }
+        return value === null || value === undefined ? '' : value;
+    }
+
+    function setStatus(element, status) {
+        element.textContent = status;
+        if (element.classList.contains('badge')) {
+            element.classList.remove('bg-success', 'bg-warning', 'bg-danger');
+            element.classList.add(STATUS_CLASSES[status] || 'bg-danger');
+        }
+    }
+
+    function addTransaction(tx) {
+        var body = document.querySelector('[data-transactions]');
+        var template = document.querySelector('template[data-row-template]');
+        if (!body || !template || body.querySelector('[data-status-for="' + tx.id + '"]')) {
+            return;
+        }
+        var row = template.content.firstElementChild.cloneNode(true);
+        row.querySelectorAll('[data-field]').forEach(function (cell) {
+            cell.textContent = formatField(cell.getAttribute('data-field'), tx);
+        });
+        var status = row.querySelector('[data-status]');
+        if (status) {
+            status.setAttribute('data-status-for', tx.id);
+            setStatus(status, tx.status);
+        }
+        var empty = document.querySelector('[data-transactions-empty]');
+        if (empty) {
+            empty.remove();
+        }
+        var table = body.closest('table');
+        if (table) {
+            table.hidden = false;
+        }
+        body.appendChild(row);
+    }
+
+    function adjustBalance(key, delta) {
+        if (!delta) {
+            return;
+        }
+        document.querySelectorAll('[data-balance-for="' + key + '"]').forEach(function (element) {
+            var current = parseInt(element.textContent, 10);
+            if (!isNaN(current)) {
+                element.textContent = current + delta;
+            }
+        });
+    }
+
+    var events = new EventSource(source.getAttribute('data-events-url'));
+
+    events.addEventListener('transaction', function (event) {
+        addTransaction(JSON.parse(event.data));
+    });
+
+    events.addEventListener('status', function (event) {
+        var tx = JSON.parse(event.data);
+        document.querySelectorAll('[data-status-for="' + tx.id + '"]').forEach(function (element) {
+            setStatus(element, tx.status);
+        });
+    });
+
+    events.addEventListener('balance', function (event) {
+        var change = JSON.parse(event.data);
+        adjustBalance('recipient:' + change.recipient_id, change.recipient_delta);
+        adjustBalance('vendor:' + change.vendor_id, change.vendor_delta);
+    });
+})();
@@ -0,0 +1,84 @@
+/* static/js/typeahead.js - search-as-you-type for <select data-search-url> */
+(function () {
+    var DELAY = 250;
+
+    function optionLabel(select, item) {
+        var label = item.name;
+        if (item.category && select.hasAttribute('data-show-category')) {
+            label += ' (' + item.category + ')';
+        }
+        if (select.hasAttribute('data-show-wallet')) {
+            label += ' - Wallet ID: ' + item.wallet_id;
+        }
+        return label;
+    }
+
+    function setup(select) {
+        var url = select.getAttribute('data-search-url');
+        var pageSize = parseInt(select.getAttribute('data-page-size'), 10) || 50;
+        var filter = document.querySelector('[data-filter-for="' + select.id + '"]');
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.placeholder = 'Type to search...';
+        input.setAttribute('aria-controls', select.id);
+        select.parentNode.insertBefore(input, select);
+
+        var more = document.createElement('button');
+        more.type = 'button';
+        more.className = 'button small secondary';
+        more.textContent = 'Show more';
+        more.hidden = !select.hasAttribute('data-has-more');
+        select.parentNode.insertBefore(more, select.nextSibling);
+
+        var offset = select.options.length;
+        var timer = null;
+        var request = 0;
+
+        function load(append) {
+            var current = ++request;
+            var params = new URLSearchParams({
+                q: input.value,
+                offset: append ? offset : 0,
+                limit: pageSize
+            });
+            if (filter && filter.value) {
+                params.set('category', filter.value);
+            }
+            fetch(url + '?' + params.toString(), {headers: {Accept: 'application/json'}})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (current !== request) {
+                        return;  // a newer query is in flight
+                    }
+                    var selected = select.value;
+                    if (!append) {
+                        select.innerHTML = '';
+                        offset = 0;
+                    }
+                    data.results.forEach(function (item) {
+                        var option = document.createElement('option');
+                        option.value = item.id;
+                        option.textContent = optionLabel(select, item);
+                        option.selected = item.id === selected;
+                        select.appendChild(option);
+                    });
+                    offset += data.results.length;
+                    more.hidden = !data.more;
+                });
+        }
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () { load(false); }, DELAY);
+        });
+        if (filter) {
+            filter.addEventListener('change', function () { load(false); });
+        }
+        more.addEventListener('click', function () { load(true); });
+    }
+
+    if (!window.fetch) {
+        return;
+    }
+    Array.prototype.forEach.call(document.querySelectorAll('select[data-search-url]'), setup);
+})();
@@ -0,0 +1,85 @@
+# test_audit.py
+import json
+
+from audit import GENESIS, AuditLog, chain_hash, read_head, verify_file
+
+
+def write_log(path, count=5):
+    log = AuditLog(path=str(path), enabled=True)
+    for n in range(count):
+        log.record("make_payment", actor="admin", amount=n)
+    assert log.flush()
+    return log
+
+
+def test_chain_verifies_and_links_each_line(tmp_path):
+    path = tmp_path / "audit.log"
+    log = write_log(path)
+    lines = path.read_bytes().splitlines()
+    assert len(lines) == 5
+    previous = GENESIS
+    for seq, line in enumerate(lines, start=1):
+        digest, _, body = line.partition(b" ")
+        assert digest.decode() == chain_hash(previous, body)
+        assert json.loads(body)["seq"] == seq
+        previous = digest.decode()
+    assert verify_file(str(path), expected_head=log.head) == {"ok": True, "entries": 5, "head": log.head}
+
+
+def test_edited_entry_breaks_the_chain_at_its_line(tmp_path):
+    path = tmp_path / "audit.log"
+    write_log(path)
+    lines = path.read_bytes().splitlines(keepends=True)
+    lines[2] = lines[2].replace(b'"amount":2', b'"amount":200')
+    path.write_bytes(b"".join(lines))
+
+    result = verify_file(str(path))
+    assert not result["ok"]
+    assert result["line"] == 3
+    assert result["seq"] == 3
+    assert result["entries"] == 2
+
+
+def test_removed_entry_breaks_the_chain(tmp_path):
+    path = tmp_path / "audit.log"
+    write_log(path)
+    lines = path.read_bytes().splitlines(keepends=True)
+    del lines[1]
+    path.write_bytes(b"".join(lines))
+
+    result = verify_file(str(path))
+    assert not result["ok"]
+    assert result["line"] == 2
+
+
+def test_truncation_is_caught_with_the_expected_head(tmp_path):
+    path = tmp_path / "audit.log"
+    log = write_log(path)
+    lines = path.read_bytes().splitlines(keepends=True)
+    path.write_bytes(b"".join(lines[:-1]))
+
+    assert verify_file(str(path))["ok"]
+    result = verify_file(str(path), expected_head=log.head)
+    assert not result["ok"]
+    assert result["entries"] == 4
+
+
+def test_reopened_log_continues_the_chain(tmp_path):
+    path = tmp_path / "audit.log"
+    first = write_log(path, count=3)
+    assert read_head(str(path)) == (3, first.head)
+
+    second = write_log(path, count=2)
+    assert second.seq == 5
+    assert verify_file(str(path), expected_head=second.head)["ok"]
+
+
+def test_torn_last_line_is_dropped_on_open(tmp_path):
+    path = tmp_path / "audit.log"
+    write_log(path, count=3)
+    with open(path, "ab") as f:
+        f.write(b"deadbeef {\"seq\":")
+
+    log = AuditLog(path=str(path), enabled=True)
+    assert log.seq == 3
+    assert verify_file(str(path), expected_head=log.head) == {"ok": True, "entries": 3, "head": log.head}
@@ -0,0 +1,108 @@
+# test_bolt11.py
+import pytest
+
+import bolt11
+from bolt11 import Bolt11Error, check, decode, encode, lookup, remember
+
+# Test vectors from the BOLT11 specification, all for payment hash 0001020304...0102
+SPEC_HASH = "0001020304050607080900010203040506070809000102030405060708090102"
+DONATION = ("lnbc1pvjluezsp5zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zygspp5qqqsyqcyq5rqwzqfqqqsyqcyq5rqwz"
+            "qfqqqsyqcyq5rqwzqfqypqdpl2pkx2ctnv5sxxmmwwd5kgetjypeh2ursdae8g6twvus8g6rfwvs8qun0dfjkxaq9qrsgq357wnc"
+            "5r2ueh7ck6q93dj32dlqnls087fxdwk8qakdyafkq3yap9us6v52vjjsrvywa6rt52cm9r9zqt8r2t7mlcwspyetp5h2tztugp9l"
+            "fyql")
+COFFEE = ("lnbc2500u1pvjluezsp5zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zygspp5qqqsyqcyq5rqwzqfqqqsyqcyq5"
+          "rqwzqfqqqsyqcyq5rqwzqfqypqdq5xysxxatsyp3k7enxv4jsxqzpu9qrsgquk0rl77nj30yxdy8j9vdx85fkpmdla2087ne0xh8nhedh"
+          "8w27kyke0lp53ut353s06fv3qfegext0eh0ymjpf39tuven09sam30g4vgpfna3rh")
+COFFEE_LEGACY = ("lnbc2500u1pvjluezpp5qqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqypqdq5xysxxatsyp3k7enxv4jsxqzpu"
+                 "aztrnwngzn3kdzw5hydlzf03qdgm2hdq27cqv3agm2awhz5se903vruatfhq77w3ls4evs3ch9zw97j25emudupq63nyw24cg2"
+                 "7h2rspfj9srp")
+HASHED_DESCRIPTION = ("lnbc20m1pvjluezsp5zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3zygspp5qqqsyqcyq5rqwzqfqq"
+                      "qsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqypqhp58yjmdan79s6qqdhdzgynm4zwqd5d7xmw5fk98klysy043l2ahrqs9qrsgq"
+                      "7ea976txfraylvgzuxs8kgcw23ezlrszfnh8r6qtfpr6cxga50aj6txm9rxrydzd06dfeawfk6swupvz4erwnyutnjq7x39y"
+                      "mw6j38gp7ynn44")
+HASHED_DESCRIPTION_LEGACY = ("lnbc20m1pvjluezpp5qqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqypqhp58yjmdan79s6qqdh"
+                             "dzgynm4zwqd5d7xmw5fk98klysy043l2ahrqscc6gd6ql3jrc5yzme8v4ntcewwz5cnw92tz0pc8qcuufvq7khhr8wp"
+                             "ald05e92xw006sq94mg8v2ndf4sefvf9sygkshp5zfem29trqq2yxxz7")
+
+
+def test_donation_vector_has_no_amount():
+    invoice = decode(DONATION)
+    assert invoice.currency == "bc"
+    assert invoice.amount_msat is None
+    assert invoice.timestamp == 1496314658
+    assert invoice.payment_hash == SPEC_HASH
+    assert invoice.description == "Please consider supporting this project"
+    assert invoice.expiry == 3600
+
+
+@pytest.mark.parametrize("payment_request", [COFFEE, COFFEE_LEGACY])
+def test_coffee_vector_amount_and_expiry(payment_request):
+    invoice = decode(payment_request)
+    assert invoice.amount_msat == 250_000_000
+    assert invoice.amount_sat == 250_000
+    assert invoice.payment_hash == SPEC_HASH
+    assert invoice.description == "1 cup coffee"
+    assert invoice.expiry == 60
+
+
+@pytest.mark.parametrize("payment_request", [HASHED_DESCRIPTION, HASHED_DESCRIPTION_LEGACY])
+def test_hashed_description_vector(payment_request):
+    invoice = decode(payment_request)
+    assert invoice.amount_msat == 2_000_000_000
+    assert invoice.description is None
+    assert invoice.description_hash == "3925b6f67e2c340036ed12093dd44e0368df1b6ea26c53dbe4811f58fd5db8c1"
+
+
+def test_uppercase_and_uri_prefix_are_accepted():
+    assert decode(COFFEE.upper()).payment_hash == SPEC_HASH
+    assert decode("lightning:" + COFFEE).payment_hash == SPEC_HASH
+
+
+@pytest.mark.parametrize("payment_request", [
+    COFFEE[:-1] + ("q" if COFFEE[-1] != "q" else "p"),   # last checksum character
+    COFFEE[:40] + ("q" if COFFEE[40] != "q" else "p") + COFFEE[41:],   # inside the payment hash
+    COFFEE.replace("lnbc2500u", "lnbc2600u"),   # amount
+])
+def test_changed_characters_fail_the_checksum(payment_request):
+    with pytest.raises(Bolt11Error, match="checksum"):
+        decode(payment_request)
+
+
+@pytest.mark.parametrize("payment_request", ["", "lnbc", "not an invoice", COFFEE[:60], "lnbc1" + "b" * 120])
+def test_malformed_invoices_are_rejected(payment_request):
+    with pytest.raises(Bolt11Error):
+        decode(payment_request)
+
+
+def test_encoded_invoice_round_trips():
+    payment_hash = "ab" * 32
+    for amount_msat in (None, 1_000, 250_000_000, 1_500, 7):
+        invoice = decode(encode(amount_msat, payment_hash, "groceries", timestamp=1700000000, expiry=600))
+        assert invoice.amount_msat == amount_msat
+        assert invoice.payment_hash == payment_hash
+        assert invoice.description == "groceries"
+        assert invoice.timestamp == 1700000000
+        assert invoice.expiry == 600
+
+
+def test_check_compares_amount_hash_and_expiry():
+    payment_hash = "cd" * 32
+    payment_request = encode(5_000, payment_hash)
+    assert check(payment_request, amount=5, payment_hash=payment_hash.upper()).amount_sat == 5
+    with pytest.raises(Bolt11Error, match="expected 6 sats"):
+        check(payment_request, amount=6)
+    with pytest.raises(Bolt11Error, match="payment hash"):
+        check(payment_request, payment_hash="ef" * 32)
+    with pytest.raises(Bolt11Error, match="expired"):
+        check(COFFEE)
+    assert check(COFFEE, amount=250_000, allow_expired=True).payment_hash == SPEC_HASH
+
+
+def test_only_remembered_invoices_are_looked_up():
+    payment_hash = "12" * 32
+    invoice = decode(encode(3_000, payment_hash))
+    assert lookup(payment_hash) is None
+
+    remember(invoice)
+    assert lookup(payment_hash.upper()) == invoice
+    assert bolt11.stats()["by_hash"] >= 1
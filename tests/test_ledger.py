@@ -0,0 +1,120 @@
+# test_ledger.py
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from ledger import ColdPartition, ExpiredPartition, HotPartition, Ledger
+
+DAYS = [date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 3)]
+TODAY = DAYS[-1]
+
+
+def entry(n, day, status="complete"):
+    return {"id": f"T{n}", "recipient_id": "R1", "vendor_id": "V1", "amount": n + 1, "type": "payment",
+            "status": status, "date": datetime.combine(day, datetime.min.time()) + timedelta(hours=n % 24),
+            "payment_hash": f"{n:064x}"}
+
+
+def filled_ledger(archive_dir, per_day=5, **options):
+    # Built without archiving, so appending past days doesn't start a background run
+    ledger = Ledger(archive_dir=str(archive_dir), hot_days=1, archive=False, block_size=2, **options)
+    n = 0
+    for day in DAYS:
+        for _ in range(per_day):
+            ledger.append(entry(n, day))
+            n += 1
+    ledger.archive = True
+    return ledger
+
+
+def test_old_days_are_archived_in_place(tmp_path):
+    ledger = filled_ledger(tmp_path)
+    before = list(ledger)
+
+    result = ledger.maintain(TODAY)
+
+    assert result == {"archived": ["2024-03-01", "2024-03-02"], "expired": []}
+    assert sorted(os.listdir(tmp_path)) == ["2024-03-01-000000000000.ldg", "2024-03-02-000000000005.ldg"]
+    kinds = [type(partition) for partition in ledger._snapshot()]
+    assert kinds == [ColdPartition, ColdPartition, HotPartition]
+    assert len(ledger) == 15
+    assert list(ledger) == before
+    assert ledger[7] == before[7]
+    assert ledger[-1] == before[-1]
+
+
+def test_archives_are_reattached_on_reload(tmp_path):
+    ledger = filled_ledger(tmp_path)
+    archived = [ledger[i] for i in range(10)]
+    ledger.maintain(TODAY)
+
+    reloaded = Ledger(archive_dir=str(tmp_path), hot_days=1, block_size=2)
+
+    assert len(reloaded) == 10
+    assert [reloaded[i] for i in range(10)] == archived
+    assert isinstance(reloaded[3]["date"], datetime)
+    march_2 = datetime(2024, 3, 2)
+    assert [t["id"] for t in reloaded.between(march_2, march_2 + timedelta(days=1))] == \
+        [f"T{n}" for n in range(5, 10)]
+
+    # New entries go after the archived positions
+    reloaded.append(entry(99, TODAY))
+    assert len(reloaded) == 11
+    assert reloaded[10]["id"] == "T99"
+
+
+def test_partition_with_open_entries_stays_in_memory(tmp_path):
+    ledger = Ledger(archive_dir=str(tmp_path), hot_days=1, archive=False)
+    ledger.append(entry(0, DAYS[0], status="pending"))
+    ledger.append(entry(1, DAYS[1]))
+    ledger.append(entry(2, TODAY))
+    ledger.archive = True
+
+    assert ledger.maintain(TODAY)["archived"] == ["2024-03-02"]
+    assert isinstance(ledger._snapshot()[0], HotPartition)
+
+    ledger[0]["status"] = "complete"
+    assert ledger.maintain(TODAY)["archived"] == ["2024-03-01"]
+
+
+def test_expired_days_keep_their_positions(tmp_path):
+    ledger = filled_ledger(tmp_path, retention_days=1)
+
+    result = ledger.maintain(TODAY)
+
+    assert result["expired"] == ["2024-03-01"]
+    assert isinstance(ledger._snapshot()[0], ExpiredPartition)
+    assert not os.path.exists(tmp_path / "2024-03-01-000000000000.ldg")
+    assert len(ledger) == 15
+    assert ledger[5]["id"] == "T5"
+    with pytest.raises(IndexError):
+        ledger[0]
+    assert ledger.ranges() == [(5, 10), (10, 15)]
+
+
+def test_payment_hashes_survive_archiving_and_reload(tmp_path):
+    ledger = filled_ledger(tmp_path)
+    ledger.maintain(TODAY)
+    assert ledger.has_payment_hash(f"{1:064x}")
+
+    reloaded = Ledger(archive_dir=str(tmp_path), hot_days=1)
+    assert reloaded.has_payment_hash(f"{1:064x}")
+    assert reloaded.has_payment_hash(f"{9:064x}")
+    assert not reloaded.has_payment_hash(f"{10:064x}")
+
+
+def test_payment_hashes_are_read_from_archives_without_them_in_the_footer(tmp_path):
+    ledger = filled_ledger(tmp_path)
+    ledger.maintain(TODAY)
+    path = tmp_path / "2024-03-01-000000000000.ldg"
+    data = path.read_bytes()
+    footer_length = int.from_bytes(data[-8:], "big")
+    footer = json.loads(data[-8 - footer_length:-8])
+    del footer["payment_hashes"]
+    encoded = json.dumps(footer).encode()
+    path.write_bytes(data[:-8 - footer_length] + encoded + len(encoded).to_bytes(8, "big"))
+
+    reloaded = Ledger(archive_dir=str(tmp_path), hot_days=1)
+    assert reloaded.has_payment_hash(f"{2:064x}")
@@ -0,0 +1,89 @@
+# test_vouchers.py
+import threading
+
+import pytest
+
+from vouchers import VoucherBook, VoucherError, VoucherSigner
+
+
+@pytest.fixture
+def book():
+    return VoucherBook(VoucherSigner(alg="HS256", secret="test-secret"))
+
+
+def test_issued_voucher_checks_out(book):
+    token, claims = book.issue("R1", ["food"], cap=1000)
+    assert book.check(token, "food", 400) == claims
+    with pytest.raises(VoucherError):
+        book.check(token, "fuel", 400)
+    with pytest.raises(VoucherError):
+        book.check(token, "food", 1001)
+
+
+def test_tampered_voucher_is_rejected(book):
+    token, _ = book.issue("R1", ["food"], cap=1000)
+    header, claims, signature = token.split(".")
+    other, _ = book.issue("R1", ["food"], cap=100000)
+    with pytest.raises(VoucherError, match="signature"):
+        book.check(".".join([header, other.split(".")[1], signature]), "food", 400)
+
+
+def test_holds_stop_at_the_cap(book):
+    _, claims = book.issue("R1", ["food"], cap=1000)
+    book.hold(claims, 600)
+    book.hold(claims, 400)
+    with pytest.raises(VoucherError, match="cap exceeded"):
+        book.hold(claims, 1)
+    assert book.redeemed[claims["jti"]] == 1000
+
+
+def test_released_hold_frees_the_cap(book):
+    _, claims = book.issue("R1", ["food"], cap=1000)
+    book.hold(claims, 600)
+    with pytest.raises(VoucherError):
+        book.hold(claims, 600)
+    book.release(claims, 600)
+    book.hold(claims, 600)
+    assert book.redeemed[claims["jti"]] == 600
+
+
+def test_concurrent_holds_never_pass_the_cap(book):
+    _, claims = book.issue("R1", ["food"], cap=1000)
+    held = []
+
+    def redeem():
+        try:
+            book.hold(claims, 100)
+            held.append(100)
+        except VoucherError:
+            pass
+
+    threads = [threading.Thread(target=redeem) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(held) == 1000
+    assert book.redeemed[claims["jti"]] == 1000
+
+
+def test_results_are_replayed_and_pending_ones_replaced(book):
+    book.finish("V1", "r-1", {"status": "pending", "amount": 300})
+    assert book.previous("V1", "r-1")["status"] == "pending"
+    assert book.counters["redeemed"] == book.counters["rejected"] == 0
+
+    book.finish("V1", "r-1", {"status": "redeemed", "amount": 300})
+    assert book.previous("V1", "r-1")["status"] == "redeemed"
+    assert book.previous("V2", "r-1") is None
+    assert book.counters["redeemed"] == 1
+    assert book.counters["sats"] == 300
+
+    book.forget("V1", "r-1")
+    assert book.previous("V1", "r-1") is None
+
+
+def test_redemptions_without_an_id_are_not_stored(book):
+    book.finish("V1", "", {"status": "redeemed", "amount": 100})
+    book.finish("V1", "", {"status": "redeemed", "amount": 100})
+    assert book.results == {}
+    assert book.counters["redeemed"] == 2
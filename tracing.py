@@ -0,0 +1,400 @@
+# tracing.py
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "True").lower() in ["true", "1", "t"]
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# The file is rotated at this size, keeping TRACE_BACKUPS older files (.1 is the newest)
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+# Traces that fail or take at least this long are always kept
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+# Share of the other traces kept anyway, as a baseline of normal requests
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# Spans recorded per trace; a loop making more only counts the rest
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+# Kept traces held in memory for /api/admin/traces
+TRACE_RECENT = int(os.getenv("TRACE_RECENT", "100"))
+
+# Sent to LNbits with every call and returned to clients; accepted from clients
+TRACE_HEADER = "X-Trace-Id"
+# Long-lived streams and asset downloads would only ever look slow
+TRACE_SKIP_PREFIXES = ("/static/", "/assets/", "/events")
+
+_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+# W3C trace context: version-trace id-parent span id-flags
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+
+
+def _span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "attrs", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str] = None, attrs: Optional[dict] = None):
+        self.span_id = _span_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.attrs = attrs or {}
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        """Marks the span, and so its trace, as failed"""
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        entry = {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+        }
+        if self.attrs:
+            entry["attrs"] = self.attrs
+        if self.error:
+            entry["error"] = self.error
+        return entry
+
+
+class _NoopSpan:
+    """Stands in for a span while tracing is disabled"""
+
+    span_id = None
+
+    def set(self, **attrs):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    """The spans of one request, or of one background task"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, attrs: Optional[dict] = None,
+                 max_spans: int = TRACE_MAX_SPANS):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.root = Span(name, attrs=attrs)
+        self.spans = [self.root]
+        self.stack = [self.root]
+        self.max_spans = max_spans
+        self.dropped_spans = 0
+
+    def open(self, name: str, attrs: dict) -> Span:
+        span = Span(name, self.stack[-1].span_id, attrs)
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+        self.stack.append(span)
+        return span
+
+    def close(self, span: Span):
+        span.finish()
+        self.stack.pop()
+
+    @property
+    def error(self) -> Optional[str]:
+        return next((span.error for span in self.spans if span.error), None)
+
+    def to_dict(self, reason: str) -> dict:
+        origin = self.root.start
+        record = {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": datetime.fromtimestamp(self.started_at).isoformat(),
+            "duration_ms": round((self.root.end - origin) * 1000, 3),
+            "kept": reason,
+            "error": self.error,
+            "spans": [span.to_dict(origin) for span in self.spans],
+        }
+        if self.dropped_spans:
+            record["dropped_spans"] = self.dropped_spans
+        return record
+
+
+class RotatingExporter:
+    """
+    Appends traces as JSON lines to a file, rotating it once it reaches
+    `max_bytes`: traces.jsonl becomes traces.jsonl.1, .1 becomes .2, and so
+    on up to `backups` files.
+    """
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.exported = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def export(self, record: dict):
+        line = (json.dumps(record, default=str) + "\n").encode()
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                if self._size and self._size + len(line) > self.max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._file.flush()
+                self._size += len(line)
+                self.exported += 1
+            except OSError as e:
+                # Losing a trace must never fail the request it describes
+                self.errors += 1
+                print(f"Error exporting trace to {self.path}: {str(e)}")
+
+    def _open(self):
+        self._file = open(self.path, 'ab')
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Tracer:
+    """
+    Lightweight request tracing.
+
+    Every request gets a trace id (taken from an incoming X-Trace-Id or
+    traceparent header when valid) and a root span; span() and wrap() nest
+    spans under whatever span is open on the current thread. LNbits calls
+    send the trace id on, see headers(). Work outside a request, such as a
+    payment worker or a scheduler, starts a trace of its own.
+
+    Sampling happens when a trace ends, once its outcome is known: failed
+    traces and those slower than `slow_ms` are always exported, the others
+    at `sample_rate`. Kept traces go to the exporter and the most recent
+    stay in memory.
+    """
+
+    def __init__(self, enabled: bool = TRACE_ENABLED, slow_ms: float = TRACE_SLOW_MS,
+                 sample_rate: float = TRACE_SAMPLE_RATE, exporter: Optional[RotatingExporter] = None,
+                 recent: int = TRACE_RECENT):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.exporter = exporter or RotatingExporter()
+        self.recent = deque(maxlen=recent)
+        self.counters = {"traces": 0, "error": 0, "slow": 0, "sampled": 0, "dropped": 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    # Traces
+
+    def begin(self, name: str, trace_id: Optional[str] = None, **attrs) -> Optional[Trace]:
+        """Starts a trace on the current thread, replacing any left open"""
+        if not self.enabled:
+            return None
+        trace = Trace(name, trace_id, attrs)
+        self._local.trace = trace
+        return trace
+
+    def end(self, error=None) -> Optional[dict]:
+        """
+        Ends the current thread's trace and decides whether to keep it.
+
+        Returns:
+            - the exported record, or None if the trace was dropped
+        """
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            return None
+        self._local.trace = None
+        if error is not None:
+            trace.root.fail(error)
+        trace.root.finish()
+
+        duration_ms = (trace.root.end - trace.root.start) * 1000
+        if trace.error:
+            reason = "error"
+        elif duration_ms >= self.slow_ms:
+            reason = "slow"
+        elif random.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            reason = None
+        with self._lock:
+            self.counters["traces"] += 1
+            self.counters[reason or "dropped"] += 1
+        if reason is None:
+            return None
+
+        record = trace.to_dict(reason)
+        self.exporter.export(record)
+        with self._lock:
+            self.recent.append(record)
+        return record
+
+    @contextmanager
+    def trace(self, name: str, trace_id: Optional[str] = None, **attrs):
+        """A trace around a block, for work outside a request"""
+        trace = self.begin(name, trace_id, **attrs)
+        if trace is None:
+            yield _NOOP
+            return
+        try:
+            yield trace.root
+        except BaseException as e:
+            self.end(e)
+            raise
+        self.end()
+
+    # Spans
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """A span around a block, under the span open on this thread"""
+        if not self.enabled:
+            yield _NOOP
+            return
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            with self.trace(name, **attrs) as root:
+                yield root
+            return
+        span = trace.open(name, attrs)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            trace.close(span)
+
+    def wrap(self, name: Optional[str] = None):
+        """Decorator running a function in a span, named after it by default"""
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def current_span(self):
+        trace = getattr(self._local, "trace", None)
+        return trace.stack[-1] if trace is not None else _NOOP
+
+    def current_trace_id(self) -> Optional[str]:
+        trace = getattr(self._local, "trace", None)
+        return trace.trace_id if trace is not None else None
+
+    def headers(self, headers: Optional[dict] = None) -> Optional[dict]:
+        """
+        Adds the current trace to outgoing request headers: X-Trace-Id, and a
+        W3C traceparent naming the open span as the parent.
+        """
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            return headers
+        headers = dict(headers or {})
+        headers[TRACE_HEADER] = trace.trace_id
+        headers["traceparent"] = f"00-{trace.trace_id}-{trace.stack[-1].span_id}-01"
+        return headers
+
+    # Flask
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._finish_response)
+        app.teardown_request(self._end_request)
+        print(f"Tracing requests to {self.exporter.path} (slow: {self.slow_ms:g} ms, "
+              f"sample rate: {self.sample_rate:g})")
+
+    def _start_request(self):
+        from flask import request
+        if request.path.startswith(TRACE_SKIP_PREFIXES):
+            return
+        trace_id = request.headers.get(TRACE_HEADER, "").lower()
+        if not _TRACE_ID.match(trace_id):
+            match = _TRACEPARENT.match(request.headers.get("traceparent", "").lower())
+            trace_id = match.group(1) if match else None
+        route = request.url_rule.rule if request.url_rule else request.path
+        self.begin(f"{request.method} {route}", trace_id, path=request.path)
+
+    def _finish_response(self, response):
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace.root.set(status=response.status_code)
+            if response.status_code >= 500:
+                trace.root.fail(f"HTTP {response.status_code}")
+            response.headers[TRACE_HEADER] = trace.trace_id
+        return response
+
+    def _end_request(self, error=None):
+        self.end(error)
+
+    # Reporting
+
+    def recent_traces(self, limit: int = 20, trace_id: Optional[str] = None) -> list:
+        with self._lock:
+            records = list(self.recent)
+        if trace_id:
+            return [record for record in records if record["trace_id"] == trace_id]
+        return records[-limit:][::-1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self.counters,
+                enabled=self.enabled,
+                file=self.exporter.path,
+                slow_ms=self.slow_ms,
+                sample_rate=self.sample_rate,
+                exported=self.exporter.exported,
+                export_errors=self.exporter.errors,
+            )
+
+
+tracer = Tracer()
@@ -3,6 +3,8 @@ import json
 import hashlib
 from datetime import datetime, time
 
+from tracing import tracer
+
 def generate_id(prefix=""):
     """Generate a unique ID with optional prefix"""
     timestamp = str(datetime.now().timestamp())
@@ -14,9 +16,32 @@ def get_today_range():
     today = datetime.now().date()
     return datetime.combine(today, time.min), datetime.combine(today, time.max)
 
+def parse_transaction_date(tx_date):
+    """Parse a transaction date stored as a datetime or string (None if invalid)"""
+    if isinstance(tx_date, str):
+        try:
+            return datetime.fromisoformat(tx_date.replace('Z', '+00:00'))
+        except ValueError:
+            try:
+                # Try another common format
+                return datetime.strptime(tx_date, '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                return None
+    return tx_date
+
+def ledger_since(transactions, start):
+    """
+    The part of the ledger that can hold entries dated from `start` on: only
+    the partitions reaching it for a partitioned ledger, a plain list as is
+    """
+    since = getattr(transactions, "since", None)
+    return since(start) if since is not None else transactions
+
+@tracer.wrap("utils.calculate_spent_today")
 def calculate_spent_today(transactions, recipient_id):
     """Calculate how much a recipient has spent today"""
     today_start, today_end = get_today_range()
+    transactions = ledger_since(transactions, today_start)
     
     print(f"Calculating spent today for recipient {recipient_id}")
     print(f"Today range: {today_start} to {today_end}")
@@ -25,7 +50,7 @@ def calculate_spent_today(transactions, recipient_id):
     # Filter transactions that are:
     # 1. For this recipient
     # 2. Happened today
-    # 3. Are complete
+    # 3. Are complete, or queued (funds already reserved for a worker)
     # 4. Are payments (not deposits)
     today_transactions = []
     
@@ -39,24 +64,17 @@ def calculate_spent_today(transactions, recipient_id):
             continue
         
         # Check date - handle both string and datetime objects
-        tx_date = t["date"]
-        if isinstance(tx_date, str):
-            try:
-                tx_date = datetime.fromisoformat(tx_date.replace('Z', '+00:00'))
-            except ValueError:
-                try:
-                    # Try another common format
-                    tx_date = datetime.strptime(tx_date, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    print(f"  Skip: Invalid date format ({tx_date})")
-                    continue
+        tx_date = parse_transaction_date(t["date"])
+        if tx_date is None:
+            print(f"  Skip: Invalid date format ({t['date']})")
+            continue
         
         if not (today_start <= tx_date <= today_end):
             print(f"  Skip: Not today ({tx_date})")
             continue
         
         # Check status and type
-        if t["status"] != "complete":
+        if t["status"] not in ("complete", "queued"):
             print(f"  Skip: Status not complete ({t['status']})")
             continue
             
@@ -73,6 +91,55 @@ def calculate_spent_today(transactions, recipient_id):
     print(f"Total spent today: {total_spent} sats")
     return total_spent
 
+@tracer.wrap("utils.calculate_spent_today_by_recipient")
+def calculate_spent_today_by_recipient(transactions, recipient_ids):
+    """Calculate today's spending for several recipients in a single ledger pass"""
+    today_start, today_end = get_today_range()
+    spent = {recipient_id: 0 for recipient_id in recipient_ids}
+    
+    for t in ledger_since(transactions, today_start):
+        if t["recipient_id"] not in spent:
+            continue
+        if t["type"] != "payment" or t["status"] not in ("complete", "queued"):
+            continue
+        tx_date = parse_transaction_date(t["date"])
+        if tx_date is None or not (today_start <= tx_date <= today_end):
+            continue
+        spent[t["recipient_id"]] += t["amount"]
+    
+    return spent
+
+@tracer.wrap("utils.calculate_category_spending")
+def calculate_category_spending(transactions, recipient_id, vendors):
+    """
+    Calculate a recipient's spending today and this month, per vendor category
+    
+    Returns:
+        dict: {(period, category): sats} for periods "daily" and "monthly";
+            category "*" holds the totals
+    """
+    today_start, today_end = get_today_range()
+    month_start = today_start.replace(day=1)
+    spending = {}
+    
+    for t in ledger_since(transactions, month_start):
+        if t["recipient_id"] != recipient_id:
+            continue
+        if t["type"] != "payment" or t["status"] not in ("complete", "queued"):
+            continue
+        tx_date = parse_transaction_date(t["date"])
+        if tx_date is None or not (month_start <= tx_date <= today_end):
+            continue
+        
+        vendor = vendors.get(t["vendor_id"])
+        category = vendor["category"] if vendor else None
+        periods = ("daily", "monthly") if tx_date >= today_start else ("monthly",)
+        for period in periods:
+            for key in ((period, "*"), (period, category)):
+                spending[key] = spending.get(key, 0) + t["amount"]
+    
+    return spending
+
 def load_data(filename):
     """Load data from JSON file"""
     try:
@@ -1,15 +1,50 @@
 # validation.py
 from datetime import datetime
 from lightning import get_wallet_balance
-from utils import calculate_spent_today
+from utils import calculate_spent_today, calculate_spent_today_by_recipient, calculate_category_spending
+from policy import policy_engine
+from ratelimit import Overloaded, priority, LANE_PAYMENT
+from velocity import velocity
+from tracing import tracer
+from programs import program_of
 
-def validate_transaction(recipient_id, vendor_id, amount, recipients, vendors, transactions):
+@tracer.wrap("validation.check_policy")
+def check_policy(recipient_id, vendor_id, amount, vendors, transactions, pending=None, policy=None):
+    """
+    Checks a payment against the spending policy: category allow-lists,
+    per-category daily and monthly caps, vendor blocklists and time windows
+    
+    Args:
+        pending (dict, optional): Sats per category (and "*" in total) approved
+            earlier in the same batch but not yet in the ledger
+        policy (PolicyEngine, optional): The program's policy, default POLICY_FILE
+    
+    Returns:
+        tuple: (bool, str) indicating if the policy allows the payment and a message
+    """
+    spending = None
+    
+    def spent(period, category):
+        # Only scan the ledger if a cap actually applies to this payment
+        nonlocal spending
+        if spending is None:
+            spending = calculate_category_spending(transactions, recipient_id, vendors)
+        return spending.get((period, category), 0) + (pending or {}).get(category, 0)
+    
+    return (policy or policy_engine).current().evaluate(
+        recipient_id, vendor_id, vendors[vendor_id]["category"], amount, spent
+    )
+
+@tracer.wrap("validation.validate_transaction")
+def validate_transaction(recipient_id, vendor_id, amount, recipients, vendors, transactions, reserved=0,
+                         policy=None, record=True):
     """
     Validates a transaction based on:
-    1. Vendor whitelist
+    1. Vendor whitelist, within the recipient's program
     2. Daily spending limits
-    3. Available balance
-    4. Vendor category restrictions
+    3. Payment velocity (flagged, or blocked in VELOCITY_MODE=block)
+    4. Available balance
+    5. Spending policy (categories, caps, blocklists, time windows)
     
     Args:
         recipient_id (str): ID of the recipient
@@ -17,7 +52,10 @@ def validate_transaction(recipient_id, vendor_id, amount, recipients, vendors, t
         amount (int): Transaction amount in satoshis
         recipients (dict): Dictionary of recipients
         vendors (dict): Dictionary of vendors
-        transactions (list): List of past transactions
+        transactions (list): The program's past transactions
+        reserved (int, optional): Sats held by queued payments not yet paid out
+        policy (PolicyEngine, optional): The program's spending policy
+        record (bool): Record velocity flags; False for dry runs
     
     Returns:
         tuple: (bool, str) indicating if transaction is valid and a message
@@ -33,11 +71,14 @@ def validate_transaction(recipient_id, vendor_id, amount, recipients, vendors, t
     if not recipient:
         return False, "Recipient not found"
     
-    # Validate vendor category
-    vendor_category = vendors[vendor_id]["category"]
-    allowed_categories = ["food", "medicine"]  # From config 
-    if vendor_category not in allowed_categories:
-        return False, f"Category '{vendor_category}' is not approved for subsidy"
+    # Vendors only serve recipients of their own program
+    if program_of(vendors[vendor_id]) != program_of(recipient):
+        return False, "Vendor not approved for subsidy program"
+    
+    # Apply the spending policy
+    valid, message = check_policy(recipient_id, vendor_id, amount, vendors, transactions, policy=policy)
+    if not valid:
+        return False, message
     
     # Check daily spending limit
     try:
@@ -56,20 +97,148 @@ def validate_transaction(recipient_id, vendor_id, amount, recipients, vendors, t
         print(f"Error checking daily limit: {str(e)}")
         return False, f"Error checking daily limit: {str(e)}"
     
+    # Check payment velocity before spending an LNbits call on the balance
+    valid, message = velocity.check(recipient_id, vendor_id, amount, record=record)
+    if not valid:
+        return False, message
+    
     # Check wallet balance
     try:
-        balance = get_wallet_balance(recipient["adminkey"])
-        print(f"Wallet balance: {balance} sats, required: {amount} sats")
+        # The balance check gates a payment, so it must not queue behind dashboard reads
+        with priority(LANE_PAYMENT):
+            balance = get_wallet_balance(recipient["adminkey"])
+        print(f"Wallet balance: {balance} sats, reserved: {reserved} sats, required: {amount} sats")
         
-        if balance < amount:
+        if balance - reserved < amount:
+            if reserved:
+                return False, (
+                    f"Insufficient balance "
+                    f"(balance: {balance} sats, "
+                    f"reserved by queued payments: {reserved} sats, "
+                    f"required: {amount} sats)"
+                )
             return False, (
                 f"Insufficient balance "
                 f"(balance: {balance} sats, "
                 f"required: {amount} sats)"
             )
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error checking wallet balance: {str(e)}")
         return False, f"Error checking wallet balance: {str(e)}"
     
     # If all checks pass, transaction is valid
-    return True, "Transaction validated successfully"
\ No newline at end of file
+    return True, "Transaction validated successfully"
+
+@tracer.wrap("validation.validate_batch")
+def validate_batch(items, recipients, vendors, transactions, reserved=None, policy=None, record=True):
+    """
+    Validates many (recipient, vendor, amount) tuples at once
+    
+    Items are grouped by recipient: today's spending for every recipient in the
+    batch comes from a single ledger pass and each balance is fetched once.
+    Within a recipient's group the items are evaluated in order, and every
+    approved item counts against the daily limit and balance of the items
+    after it, as if they were all paid.
+    
+    Args:
+        items (list): Dicts with recipient_id, vendor_id and amount
+        recipients (dict): Dictionary of recipients
+        vendors (dict): Dictionary of vendors
+        transactions (list): The program's past transactions
+        reserved (dict, optional): Sats held by queued payments per recipient
+        policy (PolicyEngine, optional): The program's spending policy
+        record (bool): Record velocity flags; False for dry runs
+    
+    Returns:
+        list: One (bool, str) verdict per item, in the order given
+    """
+    reserved = reserved or {}
+    verdicts = [None] * len(items)
+    groups = {}
+    
+    for index, item in enumerate(items):
+        recipient_id = item.get("recipient_id")
+        vendor_id = item.get("vendor_id")
+        try:
+            amount = int(item.get("amount"))
+        except (TypeError, ValueError):
+            amount = None
+        
+        if not recipient_id or not vendor_id or not amount:
+            verdicts[index] = (False, "Missing required fields")
+        elif amount <= 0:
+            verdicts[index] = (False, "Amount must be positive")
+        elif vendor_id not in vendors:
+            verdicts[index] = (False, "Vendor not approved for subsidy program")
+        elif recipient_id not in recipients:
+            verdicts[index] = (False, "Recipient not found")
+        elif program_of(vendors[vendor_id]) != program_of(recipients[recipient_id]):
+            verdicts[index] = (False, "Vendor not approved for subsidy program")
+        else:
+            groups.setdefault(recipient_id, []).append((index, vendor_id, amount))
+    
+    if not groups:
+        return verdicts
+    
+    spent_today = calculate_spent_today_by_recipient(transactions, groups.keys())
+    # (count, sats) approved per vendor so far in this batch, for velocity checks
+    vendor_pending = {}
+    print(f"Validating batch of {len(items)} items for {len(groups)} recipients")
+    
+    for recipient_id, group in groups.items():
+        recipient = recipients[recipient_id]
+        daily_limit = recipient.get("daily_limit", 10000)
+        
+        try:
+            with priority(LANE_PAYMENT):
+                balance = get_wallet_balance(recipient["adminkey"])
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Error checking wallet balance for {recipient_id}: {str(e)}")
+            for index, _, _ in group:
+                verdicts[index] = (False, f"Error checking wallet balance: {str(e)}")
+            continue
+        
+        spent = spent_today[recipient_id]
+        available = balance - reserved.get(recipient_id, 0)
+        pending = {}
+        approved = 0
+        for index, vendor_id, amount in group:
+            valid, message = check_policy(recipient_id, vendor_id, amount, vendors, transactions, pending, policy)
+            if not valid:
+                verdicts[index] = (False, message)
+            elif spent + amount > daily_limit:
+                verdicts[index] = (False, (
+                    f"Daily spending limit exceeded "
+                    f"(limit: {daily_limit} sats, "
+                    f"already spent: {spent} sats)"
+                ))
+            elif available < amount:
+                verdicts[index] = (False, (
+                    f"Insufficient balance "
+                    f"(available: {available} sats, "
+                    f"required: {amount} sats)"
+                ))
+            else:
+                valid, message = velocity.check(
+                    recipient_id, vendor_id, amount,
+                    pending_recipient=(approved, pending.get("*", 0)),
+                    pending_vendor=vendor_pending.get(vendor_id, (0, 0)),
+                    record=record
+                )
+                if not valid:
+                    verdicts[index] = (False, message)
+                    continue
+                spent += amount
+                available -= amount
+                approved += 1
+                count, total = vendor_pending.get(vendor_id, (0, 0))
+                vendor_pending[vendor_id] = (count + 1, total + amount)
+                for category in ("*", vendors[vendor_id]["category"]):
+                    pending[category] = pending.get(category, 0) + amount
+                verdicts[index] = (True, "Transaction validated successfully")
+    
+    return verdicts
@@ -0,0 +1,238 @@
+# velocity.py
+import math
+import os
+import threading
+import time
+from array import array
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from tracing import tracer
+
+VELOCITY_ENABLED = os.getenv("VELOCITY_ENABLED", "True").lower() in ["true", "1", "t"]
+# "flag" only records and logs suspicious payments, "block" also rejects them
+VELOCITY_MODE = os.getenv("VELOCITY_MODE", "flag")
+# Width of a ring buffer slot; windows are exact to within one slot
+VELOCITY_BUCKET_SECONDS = int(os.getenv("VELOCITY_BUCKET_SECONDS", "30"))
+# Limits for the last 1, 10 and 60 minutes, comma separated; 0 turns a window off
+VELOCITY_RECIPIENT_MAX_COUNT = os.getenv("VELOCITY_RECIPIENT_MAX_COUNT", "5,20,60")
+VELOCITY_RECIPIENT_MAX_SATS = os.getenv("VELOCITY_RECIPIENT_MAX_SATS", "0,0,0")
+VELOCITY_VENDOR_MAX_COUNT = os.getenv("VELOCITY_VENDOR_MAX_COUNT", "0,0,0")
+VELOCITY_VENDOR_MAX_SATS = os.getenv("VELOCITY_VENDOR_MAX_SATS", "0,0,0")
+# A vendor surges when its last 10 minutes bring in more than this many times
+# its average 10 minutes over the rest of the hour (0 turns it off), and at
+# least VELOCITY_SURGE_MIN_SATS
+VELOCITY_VENDOR_SURGE = float(os.getenv("VELOCITY_VENDOR_SURGE", "5"))
+VELOCITY_SURGE_MIN_SATS = int(os.getenv("VELOCITY_SURGE_MIN_SATS", "10000"))
+# Flagged payments kept for /api/admin/velocity
+VELOCITY_FLAGS_KEPT = int(os.getenv("VELOCITY_FLAGS_KEPT", "1000"))
+
+# Window lengths in seconds, in the order limits are given
+WINDOWS = (60, 600, 3600)
+WINDOW_NAMES = ("1m", "10m", "60m")
+
+
+def parse_limits(value: str) -> Tuple[int, ...]:
+    """Turns "5,20,60" into one limit per window; missing or empty entries are 0 (off)"""
+    limits = [int(part) if part.strip() else 0 for part in value.split(",")] if value.strip() else []
+    if len(limits) > len(WINDOWS):
+        raise ValueError(f"At most {len(WINDOWS)} velocity limits (1, 10 and 60 minutes)")
+    return tuple(limits + [0] * (len(WINDOWS) - len(limits)))
+
+
+class _Ring:
+    """
+    Counts and sums of one entity in fixed time slots covering the longest
+    window. A slot is reused once its time has passed, so adding is O(1)
+    and the memory per entity never grows.
+    """
+
+    __slots__ = ("stamps", "counts", "sums", "last")
+
+    def __init__(self, size: int):
+        self.stamps = array('q', [-1]) * size
+        self.counts = array('q', [0]) * size
+        self.sums = array('q', [0]) * size
+        self.last = -1
+
+    def add(self, slot: int, amount: int):
+        i = slot % len(self.stamps)
+        if self.stamps[i] != slot:
+            self.stamps[i] = slot
+            self.counts[i] = 0
+            self.sums[i] = 0
+        self.counts[i] += 1
+        self.sums[i] += amount
+        self.last = slot
+
+    def totals(self, slot: int, spans: Tuple[int, ...]) -> List[Tuple[int, int]]:
+        """(count, sum) for the last `span` slots up to `slot`, for each of the increasing spans"""
+        size = len(self.stamps)
+        results = []
+        count = total = 0
+        oldest = slot + 1
+        for span in spans:
+            for s in range(slot - span + 1, oldest):
+                i = s % size
+                if self.stamps[i] == s:
+                    count += self.counts[i]
+                    total += self.sums[i]
+            oldest = slot - span + 1
+            results.append((count, total))
+        return results
+
+
+class VelocityMonitor:
+    """
+    Sliding-window payment velocity per recipient and per vendor.
+
+    Every payment appended to the ledger is added to its recipient's and
+    vendor's ring buffers. check() tells whether a new payment would take
+    either past the configured count or sat limits for the last 1, 10 or
+    60 minutes, or make the vendor surge against its usual volume. Failed
+    payments are not counted; queued ones are, like attempts.
+
+    Entities without a payment in the last hour are dropped, so memory is
+    bounded by the recipients and vendors active within the hour.
+    """
+
+    def __init__(self, mode: str = VELOCITY_MODE, bucket_seconds: int = VELOCITY_BUCKET_SECONDS,
+                 enabled: bool = VELOCITY_ENABLED):
+        if mode not in ("flag", "block"):
+            raise ValueError("VELOCITY_MODE must be 'flag' or 'block'")
+        self.mode = mode
+        self.enabled = enabled
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.spans = tuple(max(1, math.ceil(window / self.bucket_seconds)) for window in WINDOWS)
+        self.limits = {
+            "recipient": (parse_limits(VELOCITY_RECIPIENT_MAX_COUNT), parse_limits(VELOCITY_RECIPIENT_MAX_SATS)),
+            "vendor": (parse_limits(VELOCITY_VENDOR_MAX_COUNT), parse_limits(VELOCITY_VENDOR_MAX_SATS)),
+        }
+        self.surge = VELOCITY_VENDOR_SURGE
+        self.surge_min = VELOCITY_SURGE_MIN_SATS
+        self._rings: Dict[str, Dict[str, _Ring]] = {"recipient": {}, "vendor": {}}
+        self._lock = threading.Lock()
+        self._pruned = 0
+        self.flags = deque(maxlen=VELOCITY_FLAGS_KEPT)
+        self.counters = {"observed": 0, "flagged": 0, "blocked": 0}
+
+    def _slot(self, now: Optional[float] = None) -> int:
+        return int((now if now is not None else time.time()) // self.bucket_seconds)
+
+    # Updates
+
+    def observe(self, transaction: dict):
+        """Ledger append hook: counts a payment for its recipient and vendor"""
+        if not self.enabled or transaction.get("type") != "payment" or transaction.get("status") == "failed":
+            return
+        slot = self._slot()
+        amount = int(transaction["amount"])
+        with self._lock:
+            for kind, entity_id in (("recipient", transaction["recipient_id"]),
+                                    ("vendor", transaction["vendor_id"])):
+                ring = self._rings[kind].get(entity_id)
+                if ring is None:
+                    ring = self._rings[kind][entity_id] = _Ring(self.spans[-1])
+                ring.add(slot, amount)
+            self.counters["observed"] += 1
+            if slot - self._pruned >= self.spans[-1]:
+                self._prune(slot)
+
+    def _prune(self, slot: int):
+        """Drops entities idle for the longest window; called with the lock held"""
+        cutoff = slot - self.spans[-1]
+        for rings in self._rings.values():
+            for entity_id in [entity_id for entity_id, ring in rings.items() if ring.last <= cutoff]:
+                del rings[entity_id]
+        self._pruned = slot
+
+    # Queries
+
+    def windows(self, kind: str, entity_id: str) -> Dict[str, dict]:
+        """Count and sum per window for a recipient or vendor"""
+        slot = self._slot()
+        with self._lock:
+            ring = self._rings[kind].get(entity_id)
+            totals = ring.totals(slot, self.spans) if ring else [(0, 0)] * len(WINDOWS)
+        return {name: {"count": count, "sats": total} for name, (count, total) in zip(WINDOW_NAMES, totals)}
+
+    @tracer.wrap("velocity.check")
+    def check(self, recipient_id: str, vendor_id: str, amount: int,
+              pending_recipient: Tuple[int, int] = (0, 0),
+              pending_vendor: Tuple[int, int] = (0, 0), record: bool = True) -> Tuple[bool, str]:
+        """
+        Checks a payment against the velocity limits as if it were made now.
+
+        Args:
+            - pending_recipient, pending_vendor: (count, sats) approved earlier
+                in the same batch but not yet in the ledger
+            - record (bool): count and keep crossings; False for dry runs such
+                as a POS pre-check, which would flag the real payment twice
+
+        Returns:
+            - (bool, str): False only in block mode when a limit is crossed;
+                in flag mode crossings are recorded and the payment passes
+        """
+        if not self.enabled:
+            return True, "Velocity checks disabled"
+        slot = self._slot()
+        reasons = []
+        with self._lock:
+            for kind, entity_id, pending in (("recipient", recipient_id, pending_recipient),
+                                             ("vendor", vendor_id, pending_vendor)):
+                ring = self._rings[kind].get(entity_id)
+                totals = ring.totals(slot, self.spans) if ring else [(0, 0)] * len(WINDOWS)
+                max_counts, max_sats = self.limits[kind]
+                for name, (count, total), max_count, max_total in zip(WINDOW_NAMES, totals, max_counts, max_sats):
+                    count += pending[0] + 1
+                    total += pending[1] + amount
+                    if max_count and count > max_count:
+                        reasons.append(f"{kind} {entity_id}: {count} payments in {name} (limit {max_count})")
+                    if max_total and total > max_total:
+                        reasons.append(f"{kind} {entity_id}: {total} sats in {name} (limit {max_total})")
+                if kind == "vendor" and self.surge:
+                    recent = totals[1][1] + pending[1] + amount
+                    # The rest of the hour, as an average 10 minutes
+                    baseline = (totals[2][1] - totals[1][1]) * self.spans[1] / (self.spans[2] - self.spans[1])
+                    if recent >= self.surge_min and recent > self.surge * baseline:
+                        reasons.append(f"vendor {vendor_id}: {recent} sats in 10m, "
+                                       f"usually {int(baseline)} sats")
+        if not reasons:
+            return True, "Velocity within limits"
+
+        blocked = self.mode == "block"
+        message = "Unusual payment velocity: " + "; ".join(reasons)
+        if not record:
+            return not blocked, message
+        print(f"{'Blocked' if blocked else 'Flagged'} payment of {amount} sats from {recipient_id} "
+              f"to {vendor_id}: {message}")
+        with self._lock:
+            self.counters["blocked" if blocked else "flagged"] += 1
+            self.flags.append({
+                "time": datetime.now().isoformat(),
+                "recipient_id": recipient_id,
+                "vendor_id": vendor_id,
+                "amount": amount,
+                "reasons": reasons,
+                "action": "blocked" if blocked else "flagged",
+            })
+        return not blocked, message
+
+    def recent_flags(self, limit: int = 100) -> List[dict]:
+        with self._lock:
+            return list(self.flags)[-limit:][::-1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                self.counters,
+                enabled=self.enabled,
+                mode=self.mode,
+                bucket_seconds=self.bucket_seconds,
+                recipients=len(self._rings["recipient"]),
+                vendors=len(self._rings["vendor"]),
+            )
+
+
+velocity = VelocityMonitor()
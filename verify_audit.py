@@ -0,0 +1,56 @@
+# verify_audit.py
+"""
+Checks the hash chain of the audit log written by audit.py.
+
+Every line's hash is recomputed from the previous one, so an edited,
+inserted or deleted entry shows up as the first line whose hash doesn't
+match. Removing entries from the end can't be seen from the log alone:
+pass a head hash recorded earlier (from /api/admin/lnbits_status or a
+previous run) with --expect-head to catch that.
+
+Usage:
+    python verify_audit.py [audit.log] [--expect-head HASH] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from audit import AUDIT_LOG, verify_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the audit log hash chain")
+    parser.add_argument("path", nargs="?", default=AUDIT_LOG, help="audit log to check")
+    parser.add_argument("--expect-head", help="hash the log must end with")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"No audit log at {args.path}", file=sys.stderr)
+        return 1
+
+    started = time.monotonic()
+    result = verify_file(args.path, args.expect_head)
+    elapsed = time.monotonic() - started
+    size = os.path.getsize(args.path)
+    result["seconds"] = round(elapsed, 3)
+    result["mb_per_second"] = round(size / (1 << 20) / elapsed, 1) if elapsed else None
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif result["ok"]:
+        print(f"OK: {result['entries']} entries, head {result['head']} "
+              f"({result['seconds']}s, {result['mb_per_second']} MB/s)")
+    else:
+        if result.get("line"):
+            print(f"BROKEN at line {result['line']} (seq {result['seq']}): {result['error']}; "
+                  f"{result['entries']} entries before it verified, last good hash {result['head']}")
+        else:
+            print(f"BROKEN: {result['error']}")
+    return 0 if result["ok"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
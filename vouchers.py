@@ -0,0 +1,277 @@
+# vouchers.py
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+except ImportError:
+    Ed25519PrivateKey = None
+
+# Vouchers are JWTs, so vendor software can check them with any JWT library:
+#   HS256 - HMAC-SHA256 with VOUCHER_SECRET, shared with trusted vendor terminals
+#   EdDSA - Ed25519 (needs the cryptography package); vendors only need the
+#           public key from /api/vouchers/key and can't mint vouchers
+VOUCHER_ALG = os.getenv("VOUCHER_ALG", "HS256")
+VOUCHER_SECRET = os.getenv("VOUCHER_SECRET", "")
+VOUCHER_KEY_FILE = os.getenv("VOUCHER_KEY_FILE", "voucher_key.pem")
+# Lifetime of a voucher in seconds, and the longest a caller may ask for
+VOUCHER_TTL = int(os.getenv("VOUCHER_TTL", "900"))
+VOUCHER_MAX_TTL = int(os.getenv("VOUCHER_MAX_TTL", "86400"))
+# How long after expiry redemptions made before it are still accepted, for
+# vendors that were offline
+VOUCHER_REDEEM_GRACE = int(os.getenv("VOUCHER_REDEEM_GRACE", "86400"))
+VOUCHER_CLOCK_SKEW = int(os.getenv("VOUCHER_CLOCK_SKEW", "300"))
+VOUCHER_BATCH_MAX = int(os.getenv("VOUCHER_BATCH_MAX", "500"))
+
+ALGORITHMS = ("HS256", "EdDSA")
+
+
+class VoucherError(Exception):
+    """Raised when a voucher or a redemption of it is not valid"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class VoucherSigner:
+    """Signs and verifies voucher tokens with HS256 or EdDSA"""
+
+    def __init__(self, alg: str = VOUCHER_ALG, secret: str = VOUCHER_SECRET,
+                 key_file: str = VOUCHER_KEY_FILE):
+        if alg not in ALGORITHMS:
+            raise ValueError(f"VOUCHER_ALG must be one of {', '.join(ALGORITHMS)}")
+        self.alg = alg
+        if alg == "HS256":
+            if not secret:
+                print("WARNING: VOUCHER_SECRET is not set; vouchers won't verify after a restart")
+                secret = secrets.token_hex(32)
+            self._secret = secret.encode()
+            self.kid = hashlib.sha256(self._secret).hexdigest()[:8]
+            return
+        if Ed25519PrivateKey is None:
+            raise RuntimeError("VOUCHER_ALG=EdDSA needs the cryptography package")
+        self._private_key = self._load_key(key_file)
+        self._public_key = self._private_key.public_key()
+        self.kid = hashlib.sha256(self.public_key_bytes()).hexdigest()[:8]
+
+    @staticmethod
+    def _load_key(path: str):
+        try:
+            with open(path, 'rb') as f:
+                return serialization.load_pem_private_key(f.read(), password=None)
+        except FileNotFoundError:
+            key = Ed25519PrivateKey.generate()
+            pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pem)
+            print(f"Generated a new voucher signing key in {path}")
+            return key
+
+    def public_key_bytes(self) -> bytes:
+        return self._public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+    def describe(self) -> dict:
+        """What vendor software needs to verify vouchers (never the HS256 secret)"""
+        description = {"alg": self.alg, "kid": self.kid}
+        if self.alg == "EdDSA":
+            # Also as a JWK, which JWT libraries take directly
+            description["jwk"] = {"kty": "OKP", "crv": "Ed25519", "kid": self.kid,
+                                  "x": _b64encode(self.public_key_bytes())}
+        return description
+
+    def _signature(self, signing_input: bytes) -> bytes:
+        if self.alg == "HS256":
+            return hmac.new(self._secret, signing_input, hashlib.sha256).digest()
+        return self._private_key.sign(signing_input)
+
+    def sign(self, claims: dict) -> str:
+        header = {"alg": self.alg, "typ": "JWT", "kid": self.kid}
+        signing_input = ".".join(
+            _b64encode(json.dumps(part, separators=(",", ":")).encode()) for part in (header, claims)
+        ).encode()
+        return signing_input.decode() + "." + _b64encode(self._signature(signing_input))
+
+    def verify(self, token: str) -> dict:
+        """
+        Checks a token's signature and returns its claims; expiry is up to the caller.
+
+        Raises:
+            - VoucherError if the token is malformed or the signature doesn't match
+        """
+        try:
+            header_part, claims_part, signature_part = token.split(".")
+            header = json.loads(_b64decode(header_part))
+            signature = _b64decode(signature_part)
+        except (ValueError, AttributeError):
+            raise VoucherError("Malformed voucher")
+        if header.get("alg") != self.alg or header.get("kid") != self.kid:
+            raise VoucherError("Voucher was signed with another key")
+        signing_input = f"{header_part}.{claims_part}".encode()
+        if self.alg == "HS256":
+            valid = hmac.compare_digest(self._signature(signing_input), signature)
+        else:
+            try:
+                self._public_key.verify(signature, signing_input)
+                valid = True
+            except InvalidSignature:
+                valid = False
+        if not valid:
+            raise VoucherError("Invalid voucher signature")
+        try:
+            return json.loads(_b64decode(claims_part))
+        except ValueError:
+            raise VoucherError("Malformed voucher")
+
+
+class VoucherBook:
+    """
+    Issues vouchers and keeps track of what has been redeemed against them.
+
+    A voucher lets its recipient spend up to `cap` sats at vendors of the
+    listed categories until it expires. Vendors check it offline and submit
+    redemptions in batches. A redemption is identified by the vendor and the
+    vendor's own redemption id, so a batch can be resubmitted safely. The
+    redeemed total of each voucher is held while its payment runs, so
+    vendors redeeming the same voucher at once can't go over the cap.
+    """
+
+    def __init__(self, signer: Optional[VoucherSigner] = None):
+        self._signer = signer
+        self._lock = threading.Lock()
+        self.redeemed: Dict[str, int] = {}       # voucher id -> sats held or paid
+        self.expires: Dict[str, int] = {}        # voucher id -> expiry
+        self.results: Dict[Tuple[str, str], tuple] = {}  # (vendor, redemption id) -> (expiry, result)
+        self.counters = {"issued": 0, "redeemed": 0, "rejected": 0, "sats": 0}
+
+    @property
+    def signer(self) -> VoucherSigner:
+        # Created on first use, so a missing key only matters once vouchers are used
+        if self._signer is None:
+            self._signer = VoucherSigner()
+        return self._signer
+
+    def issue(self, recipient_id: str, categories: List[str], cap: int,
+              ttl: int = VOUCHER_TTL) -> Tuple[str, dict]:
+        now = int(time.time())
+        claims = {
+            "jti": secrets.token_hex(8),
+            "sub": recipient_id,
+            "cat": sorted(categories),
+            "cap": cap,
+            "iat": now,
+            "exp": now + max(1, min(ttl, VOUCHER_MAX_TTL)),
+        }
+        with self._lock:
+            self.counters["issued"] += 1
+        return self.signer.sign(claims), claims
+
+    def check(self, token: str, category: str, amount: int, redeemed_at: Optional[str] = None) -> dict:
+        """
+        Checks one redemption the way vendor software does offline, plus the
+        grace period for late submission.
+
+        Raises:
+            - VoucherError explaining why the redemption is not acceptable
+        """
+        claims = self.signer.verify(token)
+        now = time.time()
+        when = now
+        if redeemed_at:
+            try:
+                when = datetime.fromisoformat(redeemed_at.replace('Z', '+00:00')).timestamp()
+            except (ValueError, AttributeError):
+                raise VoucherError("Invalid redeemed_at time")
+            if when > now + VOUCHER_CLOCK_SKEW:
+                raise VoucherError("Redemption time is in the future")
+        if not claims["iat"] - VOUCHER_CLOCK_SKEW <= when <= claims["exp"] + VOUCHER_CLOCK_SKEW:
+            raise VoucherError("Voucher was not valid at the time of redemption")
+        if now > claims["exp"] + VOUCHER_REDEEM_GRACE:
+            raise VoucherError("Voucher expired too long ago to be redeemed")
+        if category not in claims["cat"]:
+            raise VoucherError(f"Voucher is not valid for category '{category}'")
+        if amount <= 0:
+            raise VoucherError("Amount must be positive")
+        if amount > claims["cap"]:
+            raise VoucherError(f"Amount exceeds the voucher cap of {claims['cap']} sats")
+        return claims
+
+    # Redemption bookkeeping
+
+    def previous(self, vendor_id: str, redemption_id: str) -> Optional[dict]:
+        entry = self.results.get((vendor_id, redemption_id))
+        return entry[1] if entry else None
+
+    def hold(self, claims: dict, amount: int):
+        """
+        Reserves `amount` of the voucher's cap.
+
+        Raises:
+            - VoucherError if the voucher's cap is used up
+        """
+        with self._lock:
+            self._prune()
+            used = self.redeemed.get(claims["jti"], 0)
+            if used + amount > claims["cap"]:
+                raise VoucherError(f"Voucher cap exceeded (cap: {claims['cap']} sats, "
+                                   f"already redeemed: {used} sats)")
+            self.redeemed[claims["jti"]] = used + amount
+            self.expires[claims["jti"]] = claims["exp"]
+
+    def release(self, claims: dict, amount: int):
+        """Gives back a hold whose payment didn't go through"""
+        with self._lock:
+            self.redeemed[claims["jti"]] = self.redeemed.get(claims["jti"], 0) - amount
+
+    def finish(self, vendor_id: str, redemption_id: str, result: dict, expires: Optional[int] = None):
+        """
+        Stores a result, so resubmitting the redemption returns it again. It
+        is kept as long as the voucher could be redeemed; after that a
+        resubmission is turned down as expired anyway. A "pending" result,
+        for a payment of unknown outcome, is replaced once it's known.
+        """
+        with self._lock:
+            if redemption_id:
+                self.results[(vendor_id, redemption_id)] = (expires or int(time.time()), result)
+            if result["status"] == "redeemed":
+                self.counters["redeemed"] += 1
+                self.counters["sats"] += result["amount"]
+            elif result["status"] == "rejected":
+                self.counters["rejected"] += 1
+
+    def forget(self, vendor_id: str, redemption_id: str):
+        """Drops a stored result, so the redemption can be submitted again"""
+        with self._lock:
+            self.results.pop((vendor_id, redemption_id), None)
+
+    def _prune(self):
+        """Forgets vouchers that can't be redeemed anymore; called with the lock held"""
+        cutoff = time.time() - VOUCHER_REDEEM_GRACE - VOUCHER_CLOCK_SKEW
+        for jti in [jti for jti, exp in self.expires.items() if exp < cutoff]:
+            del self.expires[jti]
+            del self.redeemed[jti]
+        for key in [key for key, (exp, _) in self.results.items() if exp < cutoff]:
+            del self.results[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, tracked=len(self.redeemed), results=len(self.results))
+
+
+voucher_book = VoucherBook()
@@ -0,0 +1,218 @@
+# walletpool.py
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Dict, Optional
+
+from models import Wallet
+from nodes import registry
+from ratelimit import Overloaded, priority, LANE_READ
+
+# Off by default: it creates LNbits accounts up front and keeps their admin keys on disk
+WALLET_POOL_ENABLED = os.getenv("WALLET_POOL_ENABLED", "False").lower() in ["true", "1", "t"]
+# Ready wallets kept per LNbits node
+WALLET_POOL_SIZE = int(os.getenv("WALLET_POOL_SIZE", "20"))
+# A refill starts once a node's pool drops to this many wallets
+WALLET_POOL_LOW_WATER = int(os.getenv("WALLET_POOL_LOW_WATER", "5"))
+# Wallets provisioned at the same time; every one takes two LNbits calls
+WALLET_POOL_CONCURRENCY = int(os.getenv("WALLET_POOL_CONCURRENCY", "2"))
+# Unclaimed wallets survive restarts here (it holds admin keys, so it is created 0600)
+WALLET_POOL_FILE = os.getenv("WALLET_POOL_FILE", "wallet_pool.json")
+# Seconds to wait before refilling again after LNbits refused or failed
+WALLET_POOL_RETRY = float(os.getenv("WALLET_POOL_RETRY", "30"))
+
+
+class WalletPool:
+    """
+    Keeps LNbits account and wallet pairs provisioned ahead of onboarding.
+
+    Each node has its own pool, because a new recipient's or vendor's node is
+    chosen by placement before a wallet is claimed. claim() takes a ready
+    wallet without calling LNbits; the wallet is renamed for its owner in the
+    background. When a node's pool drops to `low_water`, it is refilled to
+    `size` by `concurrency` background workers. If a pool is empty, claim()
+    returns None and the caller creates the wallet inline as before.
+
+    Provisioning and renames run in the read lane, so they only use LNbits
+    capacity that payments leave over. Renames have their own worker, so a
+    claimed wallet isn't renamed only after a whole refill.
+    """
+
+    def __init__(self, size: int = WALLET_POOL_SIZE, low_water: int = WALLET_POOL_LOW_WATER,
+                 concurrency: int = WALLET_POOL_CONCURRENCY, path: str = WALLET_POOL_FILE,
+                 enabled: bool = WALLET_POOL_ENABLED):
+        self.size = max(0, size)
+        self.low_water = min(max(0, low_water), self.size)
+        self.concurrency = max(1, concurrency)
+        self.path = path
+        self.enabled = enabled and self.size > 0
+        self._ready: Dict[str, deque] = {name: deque() for name in registry.nodes}
+        self._in_flight: Dict[str, int] = {name: 0 for name in registry.nodes}
+        self._counters: Dict[str, Dict[str, float]] = {
+            name: {"claimed": 0, "misses": 0, "provisioned": 0, "failures": 0,
+                   "rename_failures": 0, "provision_seconds": 0.0}
+            for name in registry.nodes
+        }
+        self._last_error: Dict[str, Optional[str]] = {name: None for name in registry.nodes}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._renamer = None
+        self.started = False
+
+    def start(self):
+        """Loads wallets left from the last run and fills every node's pool"""
+        if not self.enabled or self.started:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="wallet-pool")
+        self._renamer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wallet-pool-rename")
+        self._load()
+        self.started = True
+        for name in registry.nodes:
+            self._refill(name, force=True)
+
+    # Persistence
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            print(f"Error loading wallet pool from {self.path}: {str(e)}")
+            return
+        with self._lock:
+            for name, wallets in saved.items():
+                if name in self._ready:
+                    self._ready[name].extend(Wallet(**wallet) for wallet in wallets)
+        print(f"Loaded {sum(len(wallets) for wallets in self._ready.values())} pooled wallets")
+
+    def _save(self):
+        """Writes the unclaimed wallets; called with the lock held"""
+        data = {name: [asdict(wallet) for wallet in wallets] for name, wallets in self._ready.items()}
+        temp_path = self.path + ".tmp"
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, default=str)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving wallet pool to {self.path}: {str(e)}")
+
+    # Claiming
+
+    def claim(self, node_name: str, name: str) -> Optional[Wallet]:
+        """
+        Takes a ready wallet on a node and renames it to `name` in the background.
+
+        Returns:
+            - a Wallet, already registered with the node registry
+            - None if the node's pool is empty or the pool is off
+        """
+        if not self.started:
+            return None
+        with self._lock:
+            ready = self._ready.get(node_name)
+            if not ready:
+                if node_name in self._counters:
+                    self._counters[node_name]["misses"] += 1
+                wallet = None
+            else:
+                wallet = ready.popleft()
+                self._counters[node_name]["claimed"] += 1
+                self._save()
+        if wallet is None:
+            self._refill(node_name)
+            return None
+        registry.register_wallet(node_name, wallet.adminkey, wallet.inkey)
+        wallet.name = name
+        self._renamer.submit(self._rename, node_name, wallet.adminkey, name)
+        self._refill(node_name)
+        return wallet
+
+    def _rename(self, node_name: str, adminkey: str, name: str):
+        # The wallet works under its pooled name too, so a failure is only counted
+        try:
+            with priority(LANE_READ):
+                registry.client(node_name).rename_wallet(adminkey, name)
+        except Exception as e:
+            print(f"Error renaming pooled wallet to {name}: {str(e)}")
+            with self._lock:
+                self._counters[node_name]["rename_failures"] += 1
+
+    # Refilling
+
+    def _refill(self, node_name: str, force: bool = False):
+        if not self.started or node_name not in self._ready:
+            return
+        with self._lock:
+            available = len(self._ready[node_name]) + self._in_flight[node_name]
+            if not force and available > self.low_water:
+                return
+            missing = self.size - available
+            self._in_flight[node_name] += max(0, missing)
+        for _ in range(missing):
+            self._executor.submit(self._provision, node_name)
+
+    def _provision(self, node_name: str):
+        started = time.monotonic()
+        try:
+            client = registry.client(node_name)
+            with priority(LANE_READ):
+                account = client.create_account(name=f"Pooled-{node_name}")
+                wallet = client.create_wallet(account_api_key=account.adminkey, name="pooled-wallet")
+        except Exception as e:
+            with self._lock:
+                self._in_flight[node_name] -= 1
+                self._counters[node_name]["failures"] += 1
+                self._last_error[node_name] = str(e)
+                retry = self._in_flight[node_name] == 0
+            if retry:
+                # One retry timer per node, started by the last failed worker
+                delay = e.retry_after if isinstance(e, Overloaded) else WALLET_POOL_RETRY
+                timer = threading.Timer(delay, self._refill, args=(node_name,))
+                timer.daemon = True
+                timer.start()
+            return
+        with self._lock:
+            self._in_flight[node_name] -= 1
+            self._ready[node_name].append(wallet)
+            self._counters[node_name]["provisioned"] += 1
+            self._counters[node_name]["provision_seconds"] += time.monotonic() - started
+            self._last_error[node_name] = None
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            nodes = {}
+            for name, counters in self._counters.items():
+                provisioned = counters["provisioned"]
+                requests = counters["claimed"] + counters["misses"]
+                nodes[name] = {
+                    "ready": len(self._ready[name]),
+                    "provisioning": self._in_flight[name],
+                    "claimed": counters["claimed"],
+                    "misses": counters["misses"],
+                    "hit_rate": round(counters["claimed"] / requests, 3) if requests else None,
+                    "provisioned": provisioned,
+                    "failures": counters["failures"],
+                    "rename_failures": counters["rename_failures"],
+                    "avg_provision_ms": round(counters["provision_seconds"] * 1000 / provisioned, 1)
+                    if provisioned else None,
+                    "last_error": self._last_error[name],
+                }
+        return {
+            "enabled": self.enabled,
+            "started": self.started,
+            "size": self.size,
+            "low_water": self.low_water,
+            "concurrency": self.concurrency,
+            "nodes": nodes,
+        }
+
+
+wallet_pool = WalletPool()